@@ -0,0 +1,125 @@
+from utils.logger import logging
+from utils.exception import CustomException
+from backend.wsgi import application as wsgi_application
+import sys
+import os
+import io
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+# ASGI variant of the production entry point, served by uvicorn workers:
+#     gunicorn -c backend/gunicorn.conf.py -k uvicorn.workers.UvicornWorker backend.asgi:application
+# The event loop reads request bodies and writes responses, the Flask app (and the forecast code)
+# runs on a small thread pool once a request is complete. A slow client only holds a coroutine,
+# never a thread or a worker.
+
+# Threads running the Flask app per worker process
+ASGI_THREADS = int(os.environ.get('ASGI_THREADS', 4))
+# Largest accepted request body (POST /batch, POST /update)
+MAX_REQUEST_BODY = int(os.environ.get('MAX_REQUEST_BODY', 1024 * 1024))
+
+# Created on first use, thread pools do not survive the fork from the preloading master
+_executor = None
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers = ASGI_THREADS, thread_name_prefix = 'forecast')
+    return _executor
+
+def build_environ(scope, body):
+    # PEP 3333 environ from the ASGI http scope
+    server_name, server_port = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf8').decode('latin1'),
+        'PATH_INFO': scope['path'].encode('utf8').decode('latin1'),
+        'QUERY_STRING': scope['query_string'].decode('latin1'),
+        'SERVER_NAME': server_name,
+        'SERVER_PORT': str(server_port),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': (scope.get('client') or ('', 0))[0],
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False}
+    for name, value in scope['headers']:
+        name = name.decode('latin1').upper().replace('-', '_')
+        value = value.decode('latin1')
+        if name == 'CONTENT_LENGTH':
+            continue
+        key = name if name == 'CONTENT_TYPE' else f'HTTP_{name}'
+        environ[key] = f'{environ[key]},{value}' if key in environ else value
+    return environ
+
+def call_wsgi(environ):
+    # Runs on the thread pool: the whole Flask request, response body collected in memory
+    response = {}
+
+    def start_response(status, headers, exc_info = None):
+        response['status'] = int(status.split(' ', 1)[0])
+        response['headers'] = [(name.encode('latin1'), value.encode('latin1')) for name, value in headers]
+        return chunks.append
+
+    chunks = []
+    result = wsgi_application(environ, start_response)
+    try:
+        chunks.extend(result)
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
+    return response['status'], response['headers'], b''.join(chunks)
+
+async def read_body(receive):
+    body = bytearray()
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return None
+        body.extend(message.get('body', b''))
+        if len(body) > MAX_REQUEST_BODY:
+            raise ValueError('Request body too large')
+        if not message.get('more_body', False):
+            return bytes(body)
+
+async def send_response(send, status, headers, body):
+    await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+    await send({'type': 'http.response.body', 'body': body})
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            get_executor()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            if _executor is not None:
+                _executor.shutdown(wait = True)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    if scope['type'] != 'http':
+        return
+    try:
+        body = await read_body(receive)
+    except ValueError as e:
+        return await send_response(send, 413, [(b'content-type', b'application/json')],
+                                   f'{{"error": "{e}"}}'.encode())
+    if body is None:
+        # Client went away before sending the whole request, nothing to compute
+        return
+    try:
+        loop = asyncio.get_running_loop()
+        status, headers, response_body = await loop.run_in_executor(get_executor(), call_wsgi, build_environ(scope, body))
+    except Exception as e:
+        logging.error(CustomException(e,sys))
+        status, headers, response_body = 500, [(b'content-type', b'application/json')], b'{"error": "Internal server error"}'
+    await send_response(send, status, headers, response_body)
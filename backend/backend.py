@@ -1,113 +1,454 @@
-from utils.logger import logging
-from utils.exception import CustomException
-import sys
-import os
-import joblib
-
-from flask import Flask, request, jsonify
-# from flask_cors import CORS
-import pandas as pd
-import numpy as np
-from datetime import datetime
-
-import warnings
-warnings.filterwarnings("ignore")
-
-app = Flask(__name__)
-# CORS(app)
-
-def load_model_and_exog():
-    model_path = os.path.abspath(os.path.join(os.path.dirname(__file__),'models', 'arima_model.pkl'))
-    df_path = os.path.abspath(os.path.join(os.path.dirname(__file__),'data','df_cleaned.csv'))
-
-    # Debug logs
-    logging.info(f"Model path: {model_path}")
-    logging.info(f"Dataframe path: {df_path}")
-    # print(model_path)
-    print(f"Model path exists: {os.path.exists(model_path)}")
-    print(f"Dataframe path exists: {os.path.exists(df_path)}")
-  
-
-    try:
-        logging.info('Load Model and Base Future Exogenous Variables')
-        if os.path.exists(model_path) and os.path.exists(df_path):
-            model_arima = joblib.load(model_path)
-            df = pd.read_csv(df_path, index_col = 0)
-            logging.info('Model and Dataframe Successfully Loaded')
-            return model_arima, df
-        else:
-            logging.error('Model Path or Dataframe Path not found')
-    except Exception as e:
-        logging.error(CustomException(e,sys))
-        raise CustomException(e, sys)
-
-
-def predict_future(start_date, end_date, model_arima, df):
-    try:
-        logging.info('Prepare exogenous dataframe for future predictions')
-        # #Prepare exog dataframe based on date range
-        all_dates = pd.date_range(start = start_date, end = end_date, freq = 'B')
-        features = df.drop(['close','close_log','close_log_diff'], axis = 1).columns.tolist()
-        exog_future = df[features].tail(len(all_dates))
-        exog_future.index = all_dates
-        exog_future['year'] = all_dates.year
-        exog_future['month'] = all_dates.month
-        exog_future['day'] = all_dates.day
-
-        logging.info('Prediction Initialization')
-        y_pred = model_arima.get_forecast(steps = len(all_dates), exog = exog_future).predicted_mean.values
-
-        df_pred = pd.DataFrame({
-            'close_pred': y_pred}, index = all_dates)
-
-        df_pred['close_pred_original_scale'] = np.exp(df_pred['close_pred'].cumsum() + df['close_log'].iloc[-1])
-        logging.info('Prediction Completed')
-
-        return df_pred[['close_pred_original_scale']]
-    
-    except Exception as e:
-        logging.error(CustomException(e,sys))
-        raise CustomException(e,sys)
-
-@app.route('/health', methods=['GET'])
-def health_check():
-    return 'OK', 200
-
-@app.route('/', methods = ['GET'])
-def prediction():
-    try:
-        model_arima, df_exog = load_model_and_exog()
-        start_date_str = request.args.get('start_date')
-        end_date_str = request.args.get('end_date')
-        if not start_date_str:
-            start_date_str = '2024-10-05'
-        if not end_date_str:
-            end_date_str = '2024-10-13'
-
-        #Validate condition
-        #1. start_date_str must be greater than 2024-10-04 
-        #2. end_date_str must be greater than start_date_str
-
-        if start_date_str <= '2024-10-04':
-            return jsonify({'error': 'Start Date must be greater than 2024-10-04'})
-        if end_date_str <= start_date_str:
-            return jsonify({'error': 'End Date must be greater than Start Date'})
-        
-        start_date = datetime.strptime(start_date_str, '%Y-%m-%d').date()
-        end_date = datetime.strptime(end_date_str, '%Y-%m-%d').date()
-
-        df_pred = predict_future(start_date,end_date, model_arima, df_exog)
-        df_pred = df_pred[['close_pred_original_scale']]
-        df_pred.index = df_pred.index.astype('str')
-
-        print(df_pred)
-
-        return jsonify(df_pred.to_dict(orient='index'))
-
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500 
-
-if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000, debug=True, threaded=True)
-
-
+from utils.logger import logging
+from utils.exception import CustomException
+from backend.model_store import ModelStore
+from backend.model_registry import ModelRegistry, ModelNotFound, ticker_paths, DEFAULT_TICKER
+from backend.forecast_cache import ForecastCache
+from backend.model_update import update_artifacts
+from utils.forecast import forecast_origin, forecast_path, slice_bounds, load_forecast_table, simulate_paths, path_distribution
+from utils.store import load_store, schema_path
+from utils.arima_state import ArimaState
+from utils.metrics import REGISTRY, span
+from utils.profiler import SamplingProfiler
+import sys
+import os
+import hmac
+import time
+
+from flask import Flask, request, jsonify, g
+# from flask_cors import CORS
+import pandas as pd
+import numpy as np
+from datetime import datetime, timedelta
+
+import warnings
+warnings.filterwarnings("ignore")
+
+app = Flask(__name__)
+# CORS(app)
+
+# NumPy serving artifact exported next to arima_model.pkl by the pipeline, statsmodels is not needed here
+MODEL_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__),'models', 'arima_state.npz'))
+# Served dataframe: the backend's own copy of the dataset store, published next to the model by the pipeline
+# (data/models/<ticker>/df_served). POST /update appends to it, the pipeline's training store is never touched
+DF_PATH = os.path.abspath(os.environ.get('SERVED_STORE_PATH', os.path.join(os.path.dirname(__file__),'models', 'df_served')))
+# Precomputed max-horizon forecast published by the pipeline next to the model (optional)
+TABLE_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__),'models', 'forecast_table.npy'))
+# Seconds between two checks of the artifacts for a newly published model
+MODEL_RELOAD_INTERVAL = float(os.environ.get('MODEL_RELOAD_INTERVAL', 5))
+# Serialized responses kept per (start_date, end_date, model version)
+FORECAST_CACHE_SIZE = int(os.environ.get('FORECAST_CACHE_SIZE', 256))
+FORECAST_CACHE_TTL = float(os.environ.get('FORECAST_CACHE_TTL', 3600))
+# Maximum number of date ranges accepted by one POST /batch call
+MAX_BATCH_RANGES = int(os.environ.get('MAX_BATCH_RANGES', 100))
+# Token required by POST /update, the endpoint is disabled when it is not set
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')
+# Business days of the forecast table regenerated after an online update
+FORECAST_HORIZON = int(os.environ.get('FORECAST_HORIZON', 260))
+# Longest run of POST /debug/profiler, the request blocks while it samples
+PROFILER_MAX_DURATION = float(os.environ.get('PROFILER_MAX_DURATION', 60))
+# Upper bound of simulated paths x business days of one ?simulate= request (8 bytes each)
+MAX_SIMULATION_CELLS = int(os.environ.get('MAX_SIMULATION_CELLS', 10_000_000))
+DEFAULT_QUANTILES = '0.05,0.5,0.95'
+
+def load_model_and_exog(model_path = MODEL_PATH, df_path = DF_PATH, table_path = TABLE_PATH):
+
+    # Debug logs
+    logging.info(f"Model path: {model_path}")
+    logging.info(f"Dataframe path: {df_path}")
+    logging.debug(f"Model path exists: {os.path.exists(model_path)}, dataframe path exists: {os.path.exists(df_path)}")
+
+    try:
+        logging.info('Load Model and Base Future Exogenous Variables')
+        if os.path.exists(model_path) and os.path.exists(schema_path(df_path)):
+            model_arima = ArimaState.load(model_path)
+            df = load_store(df_path)
+            logging.info('Model and Dataframe Successfully Loaded')
+            return model_arima, df, load_table(df, table_path)
+        else:
+            logging.error('Model Path or Dataframe Path not found')
+            raise FileNotFoundError(f'{model_path} or {df_path} not found')
+    except Exception as e:
+        logging.error(CustomException(e,sys))
+        raise CustomException(e, sys)
+
+def load_table(df, table_path = TABLE_PATH):
+    if not os.path.exists(table_path):
+        logging.info('Forecast table not found, every prediction will call the model')
+        return None
+    forecast_table = load_forecast_table(table_path)
+    # The table must start right after the served data, otherwise date slicing is off
+    if len(forecast_table) == 0 or forecast_table['date'][0] != forecast_origin(df):
+        logging.error(f'Forecast table {table_path} does not match the dataframe, ignoring it')
+        return None
+    logging.info(f'Forecast table covering {len(forecast_table)} business days loaded')
+    return forecast_table
+
+def model_paths(slug):
+    # -> return: (model_path, df_path, table_path), the default ticker keeps the artifacts published in backend/models
+    if slug == model_registry.default_slug:
+        return MODEL_PATH, DF_PATH, TABLE_PATH
+    return ticker_paths(slug)
+
+def create_model_store(slug):
+    model_path, df_path, table_path = model_paths(slug)
+    # /update publishes the three artifacts under a file lock next to the model, then writes published.json
+    model_folder = os.path.dirname(model_path)
+    store = ModelStore(lambda: load_model_and_exog(model_path, df_path, table_path),
+                       [model_path, schema_path(df_path), table_path], check_interval = MODEL_RELOAD_INTERVAL,
+                       published_path = os.path.join(model_folder, 'published.json'),
+                       lock_path = os.path.join(model_folder, '.update.lock'))
+    # Forecasts of the previous model are never served again, drop them on reload
+    store.add_reload_listener(lambda old_snapshot, new_snapshot: forecast_cache.clear())
+    return store
+
+def model_published(slug):
+    model_path, df_path, _ = model_paths(slug)
+    return os.path.exists(model_path) and os.path.exists(schema_path(df_path))
+
+forecast_cache = ForecastCache(max_size = FORECAST_CACHE_SIZE, ttl = FORECAST_CACHE_TTL)
+# Models of other tickers are loaded on their first request (?ticker=) and evicted under the memory budget
+model_registry = ModelRegistry(create_model_store, model_published)
+# Default model: loaded once per worker (preloaded by wsgi.py), swapped atomically when the pipeline publishes
+# new artifacts, never evicted
+model_store = model_registry.register(DEFAULT_TICKER, create_model_store(model_registry.default_slug))
+# Runs for the duration of a POST /debug/profiler, idle otherwise
+profiler = SamplingProfiler()
+
+REGISTRY.callback('forecast_cache_hits_total', 'counter', 'Forecast cache hits',
+                  lambda: {(): forecast_cache.stats()['hits']})
+REGISTRY.callback('forecast_cache_misses_total', 'counter', 'Forecast cache misses',
+                  lambda: {(): forecast_cache.stats()['misses']})
+REGISTRY.callback('forecast_cache_evictions_total', 'counter', 'Forecast cache entries evicted or expired',
+                  lambda: {(): forecast_cache.stats()['evictions'] + forecast_cache.stats()['expirations']})
+REGISTRY.callback('forecast_cache_size', 'gauge', 'Forecast cache entries',
+                  lambda: {(): forecast_cache.stats()['size']})
+REGISTRY.callback('model_info', 'gauge', 'Served model version by ticker',
+                  lambda: {(('ticker', model['ticker']), ('version', model['version'])): 1
+                           for model in model_registry.models() if model['version']})
+REGISTRY.callback('model_registry_models', 'gauge', 'Models loaded in this worker',
+                  lambda: {(): model_registry.stats()['models']})
+REGISTRY.callback('model_registry_bytes', 'gauge', 'Approximate bytes of the loaded models',
+                  lambda: {(): model_registry.stats()['bytes']})
+REGISTRY.callback('model_registry_budget_bytes', 'gauge', 'Memory budget of the loaded models',
+                  lambda: {(): model_registry.memory_budget})
+REGISTRY.callback('model_registry_loads_total', 'counter', 'Cold model loads',
+                  lambda: {(): model_registry.stats()['loads']})
+REGISTRY.callback('model_registry_load_errors_total', 'counter', 'Cold model loads that failed',
+                  lambda: {(): model_registry.stats()['load_errors']})
+REGISTRY.callback('model_registry_dedup_waits_total', 'counter', 'Requests that waited for a load already in progress',
+                  lambda: {(): model_registry.stats()['dedup_waits']})
+REGISTRY.callback('model_registry_evictions_total', 'counter', 'Models evicted to stay under the memory budget',
+                  lambda: {(): model_registry.stats()['evictions']})
+
+@app.before_request
+def start_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request(response):
+    # Route pattern as label, never the raw path (unbounded label values)
+    endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    if 'request_started' in g:
+        REGISTRY.histogram('http_request_duration_seconds', 'Request latency by route',
+                           endpoint = endpoint, method = request.method).observe(time.perf_counter() - g.request_started)
+    REGISTRY.counter('http_requests_total', 'Requests by route and status',
+                     endpoint = endpoint, method = request.method, status = response.status_code).inc()
+    return response
+
+
+def get_forecast_path(model_arima, df, forecast_table, horizon):
+    # Path covering at least `horizon` business days, computed only when the table is too short
+    if forecast_table is not None and horizon <= len(forecast_table):
+        logging.info('Slice prediction from forecast table')
+        return forecast_table
+    logging.info('Prediction Initialization')
+    return forecast_path(model_arima, df, horizon)
+
+def parse_simulation(args):
+    '''
+    -> args: query parameters, simulate (number of paths), quantiles and thresholds (comma separated), seed
+    -> return: None without simulate, else dict(n_paths, quantiles, thresholds, seed), ValueError when invalid
+    '''
+    n_paths = args.get('simulate')
+    if not n_paths:
+        return None
+    n_paths = int(n_paths)
+    if n_paths < 1:
+        raise ValueError('simulate must be a positive number of paths')
+    # Given strings are kept as column names, ex. quantile_0.05 and prob_above_130
+    quantiles = [value.strip() for value in args.get('quantiles', DEFAULT_QUANTILES).split(',') if value.strip()]
+    thresholds = [value.strip() for value in args.get('thresholds', '').split(',') if value.strip()]
+    if not all(0 <= float(value) <= 1 for value in quantiles):
+        raise ValueError('quantiles must be between 0 and 1')
+    if not all(np.isfinite(float(value)) for value in thresholds):
+        raise ValueError('thresholds must be prices')
+    seed = args.get('seed')
+    return {'n_paths': n_paths, 'quantiles': tuple(quantiles), 'thresholds': tuple(thresholds),
+            'seed': int(seed) if seed is not None else None}
+
+def simulate_future(path, i, j, model_arima, df, simulation):
+    # Distribution columns of the rows [i, j), the paths are simulated from the origin so hit probabilities count every day
+    with span('simulate'):
+        paths = simulate_paths(model_arima, path['close_pred'][:j], df['close_log'].iloc[-1],
+                               simulation['n_paths'], simulation['seed'])
+    with span('simulate_reduce'):
+        distribution = path_distribution(paths, [float(q) for q in simulation['quantiles']],
+                                         [float(threshold) for threshold in simulation['thresholds']])
+    columns = {}
+    for k, q in enumerate(simulation['quantiles']):
+        columns[f'quantile_{q}'] = distribution['quantiles'][k, i:j]
+    for k, threshold in enumerate(simulation['thresholds']):
+        columns[f'prob_above_{threshold}'] = distribution['exceed'][k, i:j]
+        columns[f'prob_hit_{threshold}'] = distribution['hit'][k, i:j]
+    return columns
+
+def predict_future(start_date, end_date, model_arima, df, forecast_table = None, simulation = None):
+    try:
+        # Every forecast starts at the same origin, a date range is a row range of one path
+        i, j = slice_bounds(forecast_origin(df), start_date, end_date)
+        path = get_forecast_path(model_arima, df, forecast_table, j)
+        columns = simulate_future(path, i, j, model_arima, df, simulation) if simulation else {}
+
+        with span('forecast_slice'):
+            rows = path[i:j]
+            df_pred = pd.DataFrame({
+                'close_pred_original_scale': rows['close_pred_original_scale'], **columns}, index = pd.DatetimeIndex(rows['date']))
+        logging.info('Prediction Completed')
+
+        return df_pred
+    
+    except Exception as e:
+        logging.error(CustomException(e,sys))
+        raise CustomException(e,sys)
+
+def ticker_error(e):
+    # Response for a ticker that cannot be served, None for any other error
+    if isinstance(e, ModelNotFound):
+        return jsonify({'error': e.args[0]}), 404
+    if isinstance(e, ValueError):
+        return jsonify({'error': str(e)}), 400
+    return None
+
+def load_snapshot(ticker):
+    with span('model_load'):
+        return model_registry.get(ticker)
+
+@app.route('/health', methods=['GET'])
+def health_check():
+    try:
+        snapshot = load_snapshot(None)
+    except Exception as e:
+        return jsonify({'status': 'ERROR', 'model_version': None, 'error': str(e)}), 503
+    # last_date moves forward with /update, clients derive the valid date window from it
+    return jsonify({'status': 'OK', 'model_version': snapshot.version, 'last_date': last_observed_date(snapshot.df),
+                    'forecast_cache': forecast_cache.stats(), 'model_registry': model_registry.stats()}), 200
+
+@app.route('/models', methods=['GET'])
+def loaded_models():
+    # Models loaded in this worker, most recently used first, with the load and eviction counters
+    return jsonify({**model_registry.stats(), 'loaded': model_registry.models()})
+
+def last_observed_date(df):
+    return df.index[-1].strftime('%Y-%m-%d')
+
+def validate_date_range(start_date_str, end_date_str, last_date_str):
+    #Validate condition
+    #1. start_date_str must be greater than the last observed date (2024-10-04 for the published model)
+    #2. end_date_str must be greater than start_date_str
+    if start_date_str <= last_date_str:
+        return f'Start Date must be greater than {last_date_str}'
+    if end_date_str <= start_date_str:
+        return 'End Date must be greater than Start Date'
+    return None
+
+@app.route('/', methods = ['GET'])
+def prediction():
+    try:
+        ticker = request.args.get('ticker')
+        snapshot = load_snapshot(ticker)
+        model_arima, df_exog = snapshot.model, snapshot.df
+        start_date_str = request.args.get('start_date')
+        end_date_str = request.args.get('end_date')
+        # Default range: the first 9 days after the last observed date
+        last_date = df_exog.index[-1]
+        if not start_date_str:
+            start_date_str = (last_date + timedelta(days = 1)).strftime('%Y-%m-%d')
+        if not end_date_str:
+            end_date_str = (last_date + timedelta(days = 9)).strftime('%Y-%m-%d')
+
+        error = validate_date_range(start_date_str, end_date_str, last_observed_date(df_exog))
+        if error:
+            return jsonify({'error': error})
+        try:
+            simulation = parse_simulation(request.args)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        start_date = datetime.strptime(start_date_str, '%Y-%m-%d').date()
+        end_date = datetime.strptime(end_date_str, '%Y-%m-%d').date()
+        if simulation:
+            horizon = slice_bounds(forecast_origin(df_exog), start_date, end_date)[1]
+            if simulation['n_paths'] * horizon > MAX_SIMULATION_CELLS:
+                return jsonify({'error': f'simulate x business days must stay below {MAX_SIMULATION_CELLS}, '
+                                         f'at most {MAX_SIMULATION_CELLS // max(horizon, 1)} paths for this range'}), 400
+
+        cache_key = (model_registry.slug(ticker), start_date.isoformat(), end_date.isoformat(), snapshot.version,
+                     tuple(sorted(simulation.items())) if simulation else None)
+        # Unseeded simulations are drawn again on every request
+        cacheable = not simulation or simulation['seed'] is not None
+        body = forecast_cache.get(cache_key) if cacheable else None
+        if body is None:
+            with span('predict'):
+                df_pred = predict_future(start_date,end_date, model_arima, df_exog, snapshot.forecast_table, simulation)
+            df_pred.index = df_pred.index.astype('str')
+
+            with span('serialize'):
+                body = app.json.dumps(df_pred.to_dict(orient='index'))
+            if cacheable:
+                forecast_cache.put(cache_key, body)
+
+        return app.response_class(body, mimetype = 'application/json')
+
+    except Exception as e:
+        return ticker_error(e) or (jsonify({'error': str(e)}), 500)
+
+@app.route('/batch', methods = ['POST'])
+def batch_prediction():
+    '''
+    -> body: {"ticker": "NVDA", "ranges": [{"start_date": "2024-10-07", "end_date": "2024-10-11"}, ...]}
+       (ticker is optional, ?ticker= works too)
+    -> return: {"model_version": ..., "results": [...]} in the order of the requested ranges,
+       each result holds the same per-date predictions as GET / or an error
+    '''
+    try:
+        payload = request.get_json(silent = True) or {}
+        ranges = payload.get('ranges')
+        if not isinstance(ranges, list) or not ranges:
+            return jsonify({'error': 'Body must contain a non-empty list of ranges'}), 400
+        if len(ranges) > MAX_BATCH_RANGES:
+            return jsonify({'error': f'At most {MAX_BATCH_RANGES} ranges per batch'}), 400
+
+        snapshot = load_snapshot(payload.get('ticker') or request.args.get('ticker'))
+        origin = forecast_origin(snapshot.df)
+        last_date_str = last_observed_date(snapshot.df)
+
+        # Validate every range first to find the longest horizon
+        results = []
+        bounds = []
+        for date_range in ranges:
+            date_range = date_range if isinstance(date_range, dict) else {}
+            start_date_str = str(date_range.get('start_date', ''))
+            end_date_str = str(date_range.get('end_date', ''))
+            result = {'start_date': start_date_str, 'end_date': end_date_str}
+            error = validate_date_range(start_date_str, end_date_str, last_date_str)
+            if not error:
+                try:
+                    start_date = datetime.strptime(start_date_str, '%Y-%m-%d').date()
+                    end_date = datetime.strptime(end_date_str, '%Y-%m-%d').date()
+                    bounds.append((len(results), slice_bounds(origin, start_date, end_date)))
+                except ValueError as e:
+                    error = str(e)
+            if error:
+                result['error'] = error
+            results.append(result)
+
+        # One path for the longest horizon, every range is a slice of it
+        if bounds:
+            horizon = max(j for _, (i, j) in bounds)
+            with span('predict'):
+                path = get_forecast_path(snapshot.model, snapshot.df, snapshot.forecast_table, horizon)
+            with span('forecast_slice'):
+                dates = path['date'][:horizon].astype(str)
+                prices = path['close_pred_original_scale'][:horizon].tolist()
+                for position, (i, j) in bounds:
+                    results[position]['predictions'] = {
+                        dates[k]: {'close_pred_original_scale': prices[k]} for k in range(i, j)}
+
+        with span('serialize'):
+            return jsonify({'model_version': snapshot.version, 'results': results})
+
+    except Exception as e:
+        return ticker_error(e) or (jsonify({'error': str(e)}), 500)
+
+def check_admin_token():
+    # Error response for admin endpoints, None when the X-Admin-Token header matches ADMIN_TOKEN
+    if not ADMIN_TOKEN:
+        return jsonify({'error': 'Admin endpoints are disabled, set ADMIN_TOKEN to enable them'}), 403
+    if not hmac.compare_digest(request.headers.get('X-Admin-Token', ''), ADMIN_TOKEN):
+        return jsonify({'error': 'Invalid admin token'}), 403
+    return None
+
+@app.route('/update', methods = ['POST'])
+def update_model():
+    '''
+    -> header: X-Admin-Token (must match the ADMIN_TOKEN environment variable)
+    -> body: {"prices": [{"date": "2024-10-07", "close": 127.72}, ...]} (?ticker= for another model than the default)
+    -> return: {"model_version": ..., "last_date": ..., "rows_added": ...}
+       new closing prices are absorbed into the model state (parameters are not re-estimated)
+       and the valid date window starts after the last absorbed date
+    '''
+    error = check_admin_token()
+    if error:
+        return error
+    try:
+        payload = request.get_json(silent = True) or {}
+        prices = payload.get('prices')
+        if not isinstance(prices, list) or not prices or not all(isinstance(price, dict) for price in prices):
+            return jsonify({'error': 'Body must contain a non-empty list of prices'}), 400
+
+        ticker = request.args.get('ticker')
+        try:
+            store = model_registry.store(ticker)
+        except Exception as e:
+            return ticker_error(e) or (jsonify({'error': str(e)}), 500)
+        model_path, df_path, table_path = model_paths(model_registry.slug(ticker))
+
+        rows_before = len(store.get().df)
+        try:
+            with span('model_update'):
+                snapshot = store.update(lambda snapshot: update_artifacts(
+                    snapshot, prices, model_path, df_path, table_path,
+                    len(snapshot.forecast_table) if snapshot.forecast_table is not None else FORECAST_HORIZON))
+        except (KeyError, TypeError, ValueError) as e:
+            return jsonify({'error': str(e)}), 400
+
+        return jsonify({'model_version': snapshot.version, 'last_date': last_observed_date(snapshot.df),
+                        'rows_added': len(snapshot.df) - rows_before})
+
+    except Exception as e:
+        logging.error(CustomException(e,sys))
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/metrics', methods = ['GET'])
+def metrics():
+    # Prometheus text format, per process (every gunicorn worker keeps its own numbers)
+    return app.response_class(REGISTRY.render(), mimetype = 'text/plain; version=0.0.4')
+
+@app.route('/debug/profiler', methods = ['GET', 'POST'])
+def sampling_profiler():
+    '''
+    -> POST: sample every stack of the worker answering the request for ?duration=seconds (default 10, at most
+       PROFILER_MAX_DURATION, ?interval=seconds between samples, default 0.005) and return the folded stacks
+       (text, input of flamegraph.pl or speedscope). Start and result always belong to the same worker
+    -> GET: profiler state of the worker answering the request
+    '''
+    error = check_admin_token()
+    if error:
+        return error
+    if request.method == 'GET':
+        return jsonify(profiler.stats())
+    duration = request.args.get('duration', 10, type = float)
+    interval = request.args.get('interval', type = float)
+    if not 0 < duration <= PROFILER_MAX_DURATION:
+        return jsonify({'error': f'duration must be between 0 and {PROFILER_MAX_DURATION:g} seconds'}), 400
+    if interval is not None and not 0.0001 <= interval <= 1:
+        return jsonify({'error': 'interval must be between 0.0001 and 1 second'}), 400
+    folded = profiler.profile(duration, interval)
+    if folded is None:
+        return jsonify({'error': 'The profiler is already running in this worker'}), 409
+    return app.response_class(folded, mimetype = 'text/plain')
+
+if __name__ == '__main__':
+    app.run(host='0.0.0.0', port=5000, debug=True, threaded=True)
+
+
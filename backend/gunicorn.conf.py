@@ -0,0 +1,29 @@
+import os
+
+# gunicorn -c backend/gunicorn.conf.py backend.wsgi:application
+# gunicorn -c backend/gunicorn.conf.py -k uvicorn.workers.UvicornWorker backend.asgi:application
+# Every setting can be overridden from the environment. Send HUP to the master for a graceful restart
+# of the workers (in-flight requests get graceful_timeout seconds to finish).
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+# The forecast code is CPU bound and holds the GIL, scale with processes rather than threads
+workers = int(os.environ.get('WEB_CONCURRENCY', os.cpu_count() or 1))
+threads = int(os.environ.get('GUNICORN_THREADS', 1))
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'sync')
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+# Recycle workers after this many requests (0 disables), jitter avoids restarting all of them at once
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 0))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', 0))
+
+# Load the model once in the master and fork the workers from it (shared copy-on-write)
+preload_app = True
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG', '-')
+
+
+def when_ready(server):
+    server.log.info(f'Serving with {server.cfg.workers} {server.cfg.worker_class_str} workers, model preloaded in master {os.getpid()}')
+
+def post_fork(server, worker):
+    server.log.info(f'Worker {worker.pid} forked')
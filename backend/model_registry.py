@@ -0,0 +1,211 @@
+from utils.logger import logging
+from utils.exception import CustomException
+from utils.metrics import span
+import sys
+import os
+import re
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import numpy as np
+
+# Many served models in one process: one ModelStore per ticker, created on the first request for it
+# and dropped again, least recently used first, when the loaded models exceed the memory budget.
+# The pipeline layout is served as is:
+#     <MODELS_ROOT>/<ticker>/arima_state.npz, forecast_table.npy, df_served (copy of the dataset store)
+# A dropped model is reloaded on its next request, requests still holding its snapshot finish with it.
+
+MODELS_ROOT = os.path.abspath(os.environ.get('MODELS_ROOT', os.path.join(os.path.dirname(__file__),'..','data','models')))
+# Megabytes of model state, dataframe and forecast table kept loaded (memory mapped columns included)
+MODEL_MEMORY_BUDGET = int(float(os.environ.get('MODEL_MEMORY_BUDGET_MB', 512)) * 1024 ** 2)
+# Ticker served when a request does not name one
+DEFAULT_TICKER = os.environ.get('DEFAULT_TICKER', 'NVDA')
+# Folder names only, a ticker never reaches outside the model root
+SLUG_PATTERN = re.compile(r'^[a-z0-9][a-z0-9.=_-]{0,31}$')
+
+
+class ModelNotFound(KeyError):
+    pass
+
+
+def ticker_slug(ticker_code):
+    # Same folder names as pipeline/paths.py: NVDA -> nvda, ^GSPC -> gspc
+    slug = str(ticker_code).strip().lower().replace('^', '')
+    if not SLUG_PATTERN.match(slug):
+        raise ValueError(f'Invalid ticker {ticker_code!r}')
+    return slug
+
+def ticker_paths(slug):
+    # -> return: (model_path, df_path, table_path) of a ticker in the pipeline layout
+    return (os.path.join(MODELS_ROOT, slug, 'arima_state.npz'),
+            os.path.join(MODELS_ROOT, slug, 'df_served'),
+            os.path.join(MODELS_ROOT, slug, 'forecast_table.npy'))
+
+def snapshot_bytes(snapshot):
+    # Approximate memory of a snapshot: state arrays, dataframe columns and forecast table
+    size = sum(value.nbytes for value in vars(snapshot.model).values() if isinstance(value, np.ndarray))
+    size += int(snapshot.df.memory_usage(index = True, deep = False).sum())
+    if snapshot.forecast_table is not None:
+        size += snapshot.forecast_table.nbytes
+    return size
+
+
+class _Entry:
+    def __init__(self, store, pinned):
+        self.store = store
+        self.pinned = pinned
+        self.bytes = 0
+        self.last_used = time.time()
+
+
+class ModelRegistry:
+    '''
+    -> store_factory: callable(slug) returning the ModelStore of a ticker, called once per cold load
+    -> exists: callable(slug) telling whether the artifacts of a ticker are published (unknown tickers are not loaded)
+    -> memory_budget: bytes of loaded snapshots above which the least recently used models are dropped
+    Concurrent requests for a model that is not loaded yet wait for a single load.
+    '''
+    def __init__(self, store_factory, exists, memory_budget = MODEL_MEMORY_BUDGET, default_ticker = DEFAULT_TICKER):
+        self.store_factory = store_factory
+        self.exists = exists
+        self.memory_budget = memory_budget
+        self.default_slug = ticker_slug(default_ticker)
+        self._entries = OrderedDict()
+        self._loading = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.loads = 0
+        self.load_errors = 0
+        self.load_seconds = 0.0
+        self.dedup_waits = 0
+        self.evictions = 0
+        self.evicted_bytes = 0
+
+    def slug(self, ticker = None):
+        return ticker_slug(ticker) if ticker else self.default_slug
+
+    def register(self, ticker, store, pinned = True):
+        '''
+        Serve an already built store for a ticker (ex. the default model preloaded before the workers fork).
+        -> pinned: never evicted, its memory still counts against the budget
+        '''
+        slug = self.slug(ticker)
+        entry = _Entry(store, pinned)
+        store.add_reload_listener(lambda old_snapshot, new_snapshot: self._resize(slug, entry, new_snapshot))
+        with self._lock:
+            self._entries[slug] = entry
+            self._entries.move_to_end(slug)
+        if store.version() is not None:
+            self._resize(slug, entry, store.get())
+        return store
+
+    def store(self, ticker = None):
+        '''
+        -> args: ticker (default ticker when empty)
+        -> return: ModelStore of the ticker, loaded on first use
+        raises ValueError for a malformed ticker and ModelNotFound when nothing is published for it
+        '''
+        slug = self.slug(ticker)
+        with self._lock:
+            entry = self._entries.get(slug)
+            if entry is not None:
+                self._entries.move_to_end(slug)
+                entry.last_used = time.time()
+                self.hits += 1
+                return entry.store
+            pending = self._loading.get(slug)
+            owner = pending is None
+            if owner:
+                pending = self._loading[slug] = Future()
+            else:
+                self.dedup_waits += 1
+        if not owner:
+            # Raises the exception of the load we waited for
+            return pending.result()
+
+        try:
+            if not self.exists(slug):
+                raise ModelNotFound(f'No model published for ticker {slug}')
+            started = time.perf_counter()
+            with span('model_registry_load'):
+                store = self.store_factory(slug)
+                snapshot = store.get()
+        except Exception as e:
+            with self._lock:
+                del self._loading[slug]
+                if not isinstance(e, ModelNotFound):
+                    self.load_errors += 1
+            if not isinstance(e, ModelNotFound):
+                logging.error(CustomException(e,sys))
+            pending.set_exception(e)
+            raise
+
+        entry = _Entry(store, pinned = False)
+        store.add_reload_listener(lambda old_snapshot, new_snapshot: self._resize(slug, entry, new_snapshot))
+        with self._lock:
+            self._entries[slug] = entry
+            del self._loading[slug]
+            self.loads += 1
+            self.load_seconds += time.perf_counter() - started
+        logging.info(f'Model {slug} version {snapshot.version} loaded in {time.perf_counter() - started:.3f}s')
+        self._resize(slug, entry, snapshot)
+        pending.set_result(store)
+        return store
+
+    def get(self, ticker = None):
+        # -> return: served ModelSnapshot of the ticker
+        return self.store(ticker).get()
+
+    def _resize(self, slug, entry, snapshot):
+        # Called after a load and after every reload of a store: account its new size, then enforce the budget
+        try:
+            size = snapshot_bytes(snapshot)
+        except Exception as e:
+            logging.error(CustomException(e,sys))
+            return
+        with self._lock:
+            entry.bytes = size
+            self._evict(keep = slug)
+
+    def _evict(self, keep = None):
+        # Registry lock held. Least recently used first, the model just used and pinned models stay
+        total = sum(entry.bytes for entry in self._entries.values())
+        for slug, entry in list(self._entries.items()):
+            if total <= self.memory_budget:
+                break
+            if slug == keep or entry.pinned:
+                continue
+            del self._entries[slug]
+            total -= entry.bytes
+            self.evictions += 1
+            self.evicted_bytes += entry.bytes
+            logging.info(f'Model {slug} evicted ({entry.bytes} bytes), {total} bytes loaded')
+        if total > self.memory_budget:
+            logging.info(f'{total} bytes loaded, above the budget of {self.memory_budget} bytes')
+
+    def evict(self, ticker):
+        # Drop a model now, -> return: True when it was loaded
+        slug = self.slug(ticker)
+        with self._lock:
+            entry = self._entries.pop(slug, None)
+            if entry is None:
+                return False
+            self.evictions += 1
+            self.evicted_bytes += entry.bytes
+        return True
+
+    def models(self):
+        # -> return: loaded models, most recently used first
+        with self._lock:
+            entries = list(self._entries.items())[::-1]
+        return [{'ticker': slug, 'version': entry.store.version(), 'bytes': entry.bytes,
+                 'pinned': entry.pinned, 'last_used': entry.last_used} for slug, entry in entries]
+
+    def stats(self):
+        with self._lock:
+            return {'models': len(self._entries), 'bytes': sum(entry.bytes for entry in self._entries.values()),
+                    'memory_budget': self.memory_budget, 'loading': len(self._loading), 'hits': self.hits,
+                    'loads': self.loads, 'load_errors': self.load_errors, 'load_seconds': self.load_seconds,
+                    'dedup_waits': self.dedup_waits, 'evictions': self.evictions, 'evicted_bytes': self.evicted_bytes}
@@ -0,0 +1,205 @@
+from utils.logger import logging
+from utils.exception import CustomException
+import sys
+import os
+import json
+import time
+import fcntl
+import hashlib
+import threading
+import contextlib
+from collections import namedtuple
+
+# Immutable view of the served artifacts. A request grabs one snapshot and uses it until it
+# returns, so a reload in the middle of a request never mixes an old model with new data.
+ModelSnapshot = namedtuple('ModelSnapshot', ['model', 'df', 'forecast_table', 'version', 'loaded_at'])
+
+
+def file_fingerprint(paths):
+    # (mtime_ns, size) per artifact, cheap enough to check on every poll. Missing files are None
+    fingerprint = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            fingerprint.append((stat.st_mtime_ns, stat.st_size))
+        except FileNotFoundError:
+            fingerprint.append(None)
+    return tuple(fingerprint)
+
+
+def content_version(paths, length = 12):
+    # Short content hash of the artifacts, used as the served model version
+    digest = hashlib.sha256()
+    for path in paths:
+        if not os.path.exists(path):
+            continue
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(block)
+    return digest.hexdigest()[:length]
+
+
+@contextlib.contextmanager
+def artifact_lock(lock_path, shared = False):
+    '''
+    File lock shared by every process serving the same artifacts (gunicorn workers, uvicorn workers).
+    -> shared: readers (reloads) run together, an exclusive holder (online update) waits for them and blocks them
+    '''
+    try:
+        f = open(lock_path, 'a') if lock_path is not None else None
+    except OSError:
+        if not shared:
+            raise
+        # Read-only artifact folder: nothing can update it, readers need no lock
+        f = None
+    if f is None:
+        yield
+        return
+    with f:
+        fcntl.flock(f, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+def _json_fingerprint(fingerprint):
+    return [list(item) if item is not None else None for item in fingerprint]
+
+def read_published(published_path):
+    # -> return: {'version', 'fingerprint'} of the last complete publish, None when there is none
+    if published_path is None:
+        return None
+    try:
+        with open(published_path) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+def write_published(published_path, version, fingerprint):
+    # Written after every artifact, replaced atomically: the marker other processes reload on
+    tmp_path = f'{published_path}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump({'version': version, 'fingerprint': _json_fingerprint(fingerprint)}, f)
+    os.replace(tmp_path, published_path)
+
+
+class ModelStore:
+    '''
+    Process-wide cache of the model and dataframe.
+    -> loader: callable returning (model, df, forecast_table)
+    -> paths: artifact files watched for changes (mtime/size), hashed for the version. Optional artifacts may be missing
+    -> check_interval: minimum seconds between two artifact checks
+    -> published_path: version file written last by update() (the version of the artifacts it lists)
+    -> lock_path: file locked by update() while it rewrites the artifacts, reloads wait for it
+    Processes serving the same files coordinate through lock_path: an update re-reads what another
+    process published before changing it, and a reload never sees half of an update.
+    '''
+    def __init__(self, loader, paths, check_interval = 5.0, published_path = None, lock_path = None):
+        self.loader = loader
+        self.paths = list(paths)
+        self.check_interval = check_interval
+        self.published_path = published_path
+        self.lock_path = lock_path
+        self._snapshot = None
+        self._fingerprint = None
+        self._last_check = 0.0
+        self._lock = threading.Lock()
+        self._listeners = []
+
+    def add_reload_listener(self, callback):
+        # callback(old_snapshot, new_snapshot) is called after every successful swap
+        self._listeners.append(callback)
+
+    def get(self):
+        snapshot = self._snapshot
+        if snapshot is None or time.monotonic() - self._last_check >= self.check_interval:
+            snapshot = self._refresh()
+        return snapshot
+
+    def version(self):
+        snapshot = self._snapshot
+        return snapshot.version if snapshot is not None else None
+
+    def update(self, updater):
+        '''
+        Replace the served artifacts in place (ex. online model update) without waiting for the next check.
+        -> updater: callable(snapshot) persisting the new artifacts and returning (model, df, forecast_table),
+           or None to keep the current snapshot
+        -> return: the served snapshot
+        '''
+        self.get()
+        # Both locks are held while the files are rewritten: no thread or process reloads half of them,
+        # and no other update starts from the same data
+        with self._lock, artifact_lock(self.lock_path):
+            # Another process may have published since our last check, start from what is on disk
+            fingerprint = self._watched_fingerprint()
+            if fingerprint != self._fingerprint:
+                self._load(fingerprint)
+            artifacts = updater(self._snapshot)
+            if artifacts is None:
+                return self._snapshot
+            version = content_version(self.paths)
+            if self.published_path is not None:
+                write_published(self.published_path, version, file_fingerprint(self.paths))
+            return self._swap(artifacts, version, self._watched_fingerprint())
+
+    def _watched_fingerprint(self):
+        return file_fingerprint(self.paths + ([self.published_path] if self.published_path else []))
+
+    def _published_version(self, fingerprint):
+        # Version recorded by the last update when the artifacts are still the ones it wrote,
+        # a content hash when they were replaced some other way (ex. a new model copied in place)
+        published = read_published(self.published_path)
+        if published is not None and published.get('fingerprint') == _json_fingerprint(fingerprint[:len(self.paths)]):
+            return published['version']
+        return content_version(self.paths)
+
+    def _refresh(self):
+        with self._lock:
+            # Another thread may have refreshed while we were waiting for the lock
+            if self._snapshot is not None and time.monotonic() - self._last_check < self.check_interval:
+                return self._snapshot
+            self._last_check = time.monotonic()
+            try:
+                fingerprint = self._watched_fingerprint()
+            except OSError as e:
+                if self._snapshot is None:
+                    logging.error(CustomException(e,sys))
+                    raise CustomException(e,sys)
+                # Artifacts are being replaced, keep serving the current snapshot
+                logging.info(f'Artifacts not readable, keep serving version {self._snapshot.version}')
+                return self._snapshot
+            if fingerprint == self._fingerprint:
+                return self._snapshot
+            # Waits for an update in progress in another process, the artifacts are complete once it is ours
+            with artifact_lock(self.lock_path, shared = True):
+                return self._load(self._watched_fingerprint())
+
+    def _load(self, fingerprint):
+        old_snapshot = self._snapshot
+        try:
+            version = self._published_version(fingerprint)
+            if old_snapshot is not None and old_snapshot.version == version:
+                # Touched but identical content, nothing to reload
+                self._fingerprint = fingerprint
+                return old_snapshot
+            artifacts = self.loader()
+        except Exception as e:
+            if old_snapshot is None:
+                raise CustomException(e,sys)
+            logging.error(CustomException(e,sys))
+            return old_snapshot
+        return self._swap(artifacts, version, fingerprint)
+
+    def _swap(self, artifacts, version, fingerprint):
+        old_snapshot = self._snapshot
+        new_snapshot = ModelSnapshot(*artifacts, version, time.time())
+        self._snapshot = new_snapshot
+        self._fingerprint = fingerprint
+        logging.info(f'Model version {version} loaded')
+        for callback in self._listeners:
+            try:
+                callback(old_snapshot, new_snapshot)
+            except Exception as e:
+                logging.error(CustomException(e,sys))
+        return new_snapshot
@@ -0,0 +1,80 @@
+from utils.logger import logging
+from utils.features import FeatureEngine
+from utils.forecast import forecast_path, save_forecast_table
+from utils.store import append_store
+
+import numpy as np
+import pandas as pd
+
+# Online update of the served model: new closing prices are turned into feature rows and
+# Kalman filtered into the ARIMA state with its parameters unchanged, which moves the forecast
+# origin forward in milliseconds instead of rerunning the training pipeline.
+
+
+def new_observations(df, prices):
+    '''
+    -> args: df (served feature dataframe), prices (list of {"date": "YYYY-MM-DD", "close": float})
+    -> return: dataframe with date and close columns, only the dates after the last served date,
+       sorted and deduplicated (last price of a date wins), ValueError for a missing date, a weekend date,
+       a skipped business day or a close price that is not a finite positive number
+    '''
+    df_prices = pd.DataFrame(prices, columns = ['date', 'close'])
+    df_prices['date'] = pd.to_datetime(df_prices['date'], format = '%Y-%m-%d')
+    df_prices['close'] = pd.to_numeric(df_prices['close']).astype('float64')
+    # Checked before anything is written: one inf/NaN in the store or the state breaks every later forecast
+    if df_prices['date'].isna().any():
+        raise ValueError('Every price must have a date (YYYY-MM-DD)')
+    close = df_prices['close'].to_numpy()
+    if (~np.isfinite(close) | (close <= 0)).any():
+        raise ValueError('Every close price must be a finite positive number')
+    # The series and the forecast table only hold business days (np.busday_count slices the table)
+    not_busday = ~np.is_busday(df_prices['date'].to_numpy().astype('datetime64[D]'))
+    if not_busday.any():
+        raise ValueError(f'{df_prices["date"][not_busday].iloc[0].date()} is not a business day')
+    df_prices = df_prices[df_prices['date'] > df.index[-1]]
+    df_prices = df_prices.drop_duplicates('date', keep = 'last').sort_values('date')
+    # Every row is one Kalman step and forecast dates are counted in business days: a missing day would
+    # shift every later date by one step
+    dates = df_prices['date'].to_numpy().astype('datetime64[D]')
+    expected = np.busday_offset(np.datetime64(df.index[-1].date(), 'D'), np.arange(1, len(dates) + 1), roll = 'forward')
+    missing = np.flatnonzero(dates != expected)
+    if len(missing):
+        raise ValueError(f'Prices must cover every business day after the last observed date, {expected[missing[0]]} is missing')
+    return df_prices.reset_index(drop = True)
+
+def absorb_observations(model_state, df):
+    '''
+    Filter every row of df the state has not seen yet, so the state (and every forecast) starts after
+    the last row of df. A model trained on the train split catches up with the test rows this way too.
+    -> args: model_state (ArimaState), df (served feature dataframe, including the new rows)
+    -> return: updated ArimaState, same parameters
+    '''
+    nobs = model_state.nobs
+    # Compared with a tolerance, the published model was fitted on features computed from CSV text
+    if len(df) < nobs or not np.isclose(model_state.last_endog, df['close_log_diff'].iloc[nobs - 1]):
+        raise ValueError('The served dataframe does not start with the data the model was fitted on')
+    df_new = df.iloc[nobs:]
+    return model_state.update(df_new['close_log_diff'].to_numpy(), df_new[model_state.features].to_numpy())
+
+def update_artifacts(snapshot, prices, model_path, df_path, table_path, horizon):
+    '''
+    -> args: snapshot (served ModelSnapshot), prices (new closing prices), artifact paths,
+       horizon (business days of the regenerated forecast table)
+    -> return: (model, df, forecast_table) to serve, None when there is no new date
+    '''
+    df_prices = new_observations(snapshot.df, prices)
+    if df_prices.empty:
+        return None
+
+    df_features = FeatureEngine.from_features(snapshot.df).update(df_prices)
+    df = pd.concat([snapshot.df, df_features])
+    model_state = absorb_observations(snapshot.model, df)
+    forecast_table = forecast_path(model_state, df, horizon)
+
+    # Runs under the update lock of the ModelStore, the version file it writes afterwards tells the other
+    # workers the three artifacts are complete
+    append_store(df_features, df_path, after_last = True)
+    model_state.save(model_path)
+    save_forecast_table(forecast_table, table_path)
+    logging.info(f'{len(df_features)} new rows absorbed, data now ends on {df.index[-1].date()}')
+    return model_state, df, forecast_table
@@ -0,0 +1,15 @@
+from utils.logger import logging
+from backend.backend import app, model_store
+import gc
+
+# Production entry point (see gunicorn.conf.py). With preload_app the master process imports this
+# module once: the model, dataframe and forecast table are loaded here, before the workers are forked,
+# so every worker starts with them already in memory and shares the pages copy-on-write.
+model_store.get()
+logging.info(f'Model version {model_store.version()} preloaded')
+
+# Move everything loaded so far out of the garbage collector's reach: collections in the workers
+# would otherwise write to the header of every object and un-share the pages
+gc.freeze()
+
+application = app
@@ -0,0 +1,376 @@
+from utils.logger import logging
+from utils.exception import CustomException
+import sys
+import os
+import json
+import time
+import random
+import signal
+import argparse
+import threading
+import subprocess
+from datetime import datetime
+
+import numpy as np
+
+# Load generator for the forecast service: closed-loop clients (each sends its next request as soon as
+# the previous one returns) for a fixed duration, against the Flask app in-process, a server already
+# listening, or a server started here in any serving mode, so a change can be compared under identical load.
+#     python -m benchmarks.load --in-process --concurrency 8 --duration 30
+#     python -m benchmarks.load --serve dev --concurrency 16
+#     python -m benchmarks.load --serve gunicorn --workers 4 --concurrency 16 --output load_gunicorn.json
+#     python -m benchmarks.load --url http://127.0.0.1:5000 --pid <server pid>
+# The clients share the machine (and, in-process, the GIL) with the server: compare runs made the same way.
+
+REPO_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+# kind=weight of the generated requests
+DEFAULT_MIX = 'random=0.6,hot=0.3,invalid=0.1'
+# Business days after the last observed date a random window can start at, and its longest length (at least 2 days,
+# the end date must be after the start date)
+MAX_OFFSET = 250
+MAX_WINDOW = 20
+# Distinct windows of the hot kind (repeated, served from the forecast cache once warm)
+HOT_WINDOWS = 8
+SERVE_COMMANDS = {
+    'dev': ['-m', 'flask', '--app', 'backend.backend:app', 'run', '--host', '127.0.0.1', '--port', '{port}', '--with-threads'],
+    'gunicorn': ['-m', 'gunicorn', '-c', 'backend/gunicorn.conf.py', '--bind', '127.0.0.1:{port}', 'backend.wsgi:application'],
+    'asgi': ['-m', 'gunicorn', '-c', 'backend/gunicorn.conf.py', '--bind', '127.0.0.1:{port}',
+             '-k', 'uvicorn.workers.UvicornWorker', 'backend.asgi:application']}
+
+
+def parse_mix(mix):
+    # 'random=0.6,hot=0.3,invalid=0.1' -> (kinds, normalized weights)
+    weights = {}
+    for item in mix.split(','):
+        kind, weight = item.split('=')
+        if kind.strip() not in ('random', 'hot', 'invalid'):
+            raise ValueError(f'Unknown request kind {kind}, expected random, hot or invalid')
+        weights[kind.strip()] = float(weight)
+    total = sum(weights.values())
+    return list(weights), [weight / total for weight in weights.values()]
+
+
+class RequestMix:
+    '''
+    Query strings of GET / drawn with fixed weights, reproducible from the seed.
+    -> origin: first business day after the last observed date (first key of a default GET /)
+    -> random: start within MAX_OFFSET business days, 2 to MAX_WINDOW business days long
+    -> hot: one of HOT_WINDOWS windows, the same for every run with the same seed
+    -> invalid: start on or before the last observed date, end before start or a malformed date
+    '''
+    def __init__(self, origin, mix = DEFAULT_MIX, seed = 0):
+        self.origin = np.datetime64(origin, 'D')
+        self.kinds, self.weights = parse_mix(mix)
+        self.seed = seed
+        rng = random.Random(seed)
+        self.hot_windows = [self.window(rng) for _ in range(HOT_WINDOWS)]
+
+    def window(self, rng):
+        start = np.busday_offset(self.origin, rng.randrange(MAX_OFFSET), roll = 'forward')
+        end = np.busday_offset(start, rng.randrange(1, MAX_WINDOW), roll = 'forward')
+        return str(start), str(end)
+
+    def invalid(self, rng):
+        choice = rng.randrange(3)
+        if choice == 0:
+            # Business days before the origin: the last observed date or earlier
+            start = np.busday_offset(self.origin, -rng.randrange(1, 30), roll = 'backward')
+            return str(start), str(start + np.timedelta64(5, 'D'))
+        if choice == 1:
+            start, end = self.window(rng)
+            return end, str(np.datetime64(end) - np.timedelta64(rng.randrange(1, 10), 'D'))
+        return '2099-13-45', '2099-14-01'
+
+    def draw(self, rng):
+        # -> return: (kind, query string)
+        kind = rng.choices(self.kinds, self.weights)[0]
+        if kind == 'hot':
+            start, end = rng.choice(self.hot_windows)
+        elif kind == 'invalid':
+            start, end = self.invalid(rng)
+        else:
+            start, end = self.window(rng)
+        return kind, f'/?start_date={start}&end_date={end}'
+
+
+class HttpClient:
+    # One keep-alive connection per load thread
+    def __init__(self, url, timeout):
+        import requests
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def get(self, path):
+        response = self.session.get(self.url + path, timeout = self.timeout)
+        return response.status_code, response.content
+
+
+class InProcessClient:
+    # Flask test client: no network, the app runs on the load threads
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def get(self, path):
+        response = self.client.get(path)
+        return response.status_code, response.data
+
+
+def is_success(kind, status, body):
+    # Valid windows must return predictions, invalid ones a 4xx or an error message. A 5xx is always a failure
+    if status >= 500:
+        return False
+    try:
+        payload = json.loads(body)
+    except ValueError:
+        return False
+    has_error = status >= 400 or (isinstance(payload, dict) and 'error' in payload)
+    return has_error if kind == 'invalid' else not has_error
+
+
+def process_memory(pid):
+    '''
+    -> return: {'rss': MB, 'pss': MB} from /proc (Linux), None when the process is gone or /proc is not available.
+       PSS splits the pages shared copy-on-write by the preloaded workers between them, RSS counts them in every worker
+    '''
+    memory = {}
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    memory['rss'] = int(line.split()[1]) / 1024
+        with open(f'/proc/{pid}/smaps_rollup') as f:
+            for line in f:
+                if line.startswith('Pss:'):
+                    memory['pss'] = int(line.split()[1]) / 1024
+    except (FileNotFoundError, ProcessLookupError, PermissionError):
+        pass
+    return memory or None
+
+def process_tree(pid):
+    # pid and every descendant (gunicorn master and its workers)
+    children = {}
+    for name in os.listdir('/proc') if os.path.isdir('/proc') else []:
+        if not name.isdigit():
+            continue
+        try:
+            with open(f'/proc/{name}/stat') as f:
+                # ppid is the second field after the parenthesized command name
+                ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (FileNotFoundError, ProcessLookupError, PermissionError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(name))
+    tree, pending = [], [pid]
+    while pending:
+        current = pending.pop()
+        tree.append(current)
+        pending += children.get(current, [])
+    return tree
+
+
+class MemorySampler:
+    '''
+    -> pid: root of the server process tree (this process for --in-process)
+    -> interval: seconds between two samples
+    Samples are (seconds since start, {pid: {'rss': MB, 'pss': MB}}).
+    '''
+    def __init__(self, pid, interval = 1.0):
+        self.pid = pid
+        self.interval = interval
+        self.samples = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target = self._run, name = 'memory-sampler', daemon = True)
+
+    def start(self):
+        self.started = time.perf_counter()
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return self.samples
+
+    def _run(self):
+        while True:
+            memory = {pid: process_memory(pid) for pid in process_tree(self.pid)}
+            self.samples.append((round(time.perf_counter() - self.started, 2), {pid: value for pid, value in memory.items() if value}))
+            if self._stop.wait(self.interval):
+                return
+
+
+def run_load(client_factory, mix, concurrency = 8, duration = 30.0, warmup = 2.0, seed = 0):
+    '''
+    -> args: client_factory (callable returning a client with get(path) -> (status, body)), mix (RequestMix),
+       concurrency (client threads), duration and warmup (seconds, warmup requests are not recorded), seed
+    -> return: list of (kind, seconds since start, latency seconds, success) of the recorded requests
+    '''
+    records = []
+    lock = threading.Lock()
+    started = time.perf_counter()
+    record_from = started + warmup
+    stop_at = record_from + duration
+
+    def load_thread(index):
+        client = client_factory()
+        rng = random.Random(seed * 1000 + index)
+        local = []
+        while True:
+            now = time.perf_counter()
+            if now >= stop_at:
+                break
+            kind, path = mix.draw(rng)
+            try:
+                status, body = client.get(path)
+                success = is_success(kind, status, body)
+            except Exception:
+                success = False
+            finished = time.perf_counter()
+            if now >= record_from:
+                local.append((kind, finished - record_from, finished - now, success))
+        with lock:
+            records.extend(local)
+
+    threads = [threading.Thread(target = load_thread, args = (index,), name = f'load-{index}') for index in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return records
+
+def summarize(records, duration):
+    '''
+    -> args: records of run_load, duration (recorded seconds)
+    -> return: dict with requests, throughput (per second), error_rate and latency percentiles in ms, overall and per kind
+    '''
+    def stats(rows):
+        if not rows:
+            return {'requests': 0}
+        latency = np.array([row[2] for row in rows]) * 1000
+        errors = sum(not row[3] for row in rows)
+        return {'requests': len(rows), 'throughput': len(rows) / duration, 'error_rate': errors / len(rows),
+                'mean_ms': float(latency.mean()), 'p50_ms': float(np.percentile(latency, 50)),
+                'p95_ms': float(np.percentile(latency, 95)), 'p99_ms': float(np.percentile(latency, 99)),
+                'max_ms': float(latency.max())}
+    summary = stats(records)
+    summary['kinds'] = {kind: stats([row for row in records if row[0] == kind]) for kind in sorted({row[0] for row in records})}
+    return summary
+
+def forecast_origin(client):
+    # First business day after the last observed date: first date of the default GET / range
+    status, body = client.get('/')
+    payload = json.loads(body)
+    if status != 200 or 'error' in payload:
+        raise RuntimeError(f'GET / failed with status {status}: {payload}')
+    return min(payload)
+
+def free_port():
+    import socket
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def start_server(mode, port, workers = None, timeout = 120.0):
+    '''
+    -> args: mode (dev, gunicorn or asgi), port, workers (WEB_CONCURRENCY of gunicorn), timeout (seconds to wait for /health)
+    -> return: server process, listening on 127.0.0.1:port
+    '''
+    import requests
+    env = dict(os.environ)
+    if workers:
+        env['WEB_CONCURRENCY'] = str(workers)
+    # The load run has its own access numbers, do not write one log line per request to the console
+    env.setdefault('GUNICORN_ACCESS_LOG', '/dev/null')
+    command = [sys.executable] + [part.format(port = port) for part in SERVE_COMMANDS[mode]]
+    process = subprocess.Popen(command, cwd = REPO_PATH, env = env, stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'{mode} server exited with status {process.returncode}')
+        try:
+            if requests.get(f'http://127.0.0.1:{port}/health', timeout = 1).status_code == 200:
+                return process
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    stop_server(process)
+    raise RuntimeError(f'{mode} server not healthy after {timeout}s')
+
+def stop_server(process, timeout = 30.0):
+    process.send_signal(signal.SIGTERM)
+    try:
+        process.wait(timeout)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+def print_report(result):
+    summary = result['summary']
+    print(f"{result['target']}: {result['concurrency']} clients for {result['duration']}s")
+    rows = [('all', summary)] + list(summary['kinds'].items())
+    print(f"{'kind':<8} {'requests':>9} {'req/s':>8} {'errors':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for kind, stats in rows:
+        if not stats['requests']:
+            continue
+        print(f"{kind:<8} {stats['requests']:>9} {stats['throughput']:>8.1f} {stats['error_rate']:>7.2%} "
+              f"{stats['p50_ms']:>8.2f} {stats['p95_ms']:>8.2f} {stats['p99_ms']:>8.2f} {stats['max_ms']:>8.2f}")
+    if result['memory']:
+        print('Memory MB over time (total RSS, total PSS, RSS per process):')
+        for seconds, memory in result['memory']:
+            rss = sum(value.get('rss', 0) for value in memory.values())
+            pss = sum(value.get('pss', 0) for value in memory.values())
+            print(f"  {seconds:>7.1f}s {rss:>8.1f} {pss:>8.1f}  " + ' '.join(f"{pid}:{value.get('rss', 0):.0f}" for pid, value in sorted(memory.items())))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Load test the forecast service')
+    target = parser.add_mutually_exclusive_group(required = True)
+    target.add_argument('--in-process', action = 'store_true', help = 'Drive backend.backend:app through the Flask test client')
+    target.add_argument('--url', help = 'Base URL of a running server, ex. http://127.0.0.1:5000')
+    target.add_argument('--serve', choices = sorted(SERVE_COMMANDS), help = 'Start the server in this mode on a free localhost port')
+    parser.add_argument('--workers', type = int, help = 'Worker processes of --serve gunicorn/asgi (WEB_CONCURRENCY)')
+    parser.add_argument('--pid', type = int, help = 'Server process to sample the memory of with --url (and its children)')
+    parser.add_argument('--concurrency', type = int, default = 8, help = 'Client threads')
+    parser.add_argument('--duration', type = float, default = 30, help = 'Recorded seconds')
+    parser.add_argument('--warmup', type = float, default = 2, help = 'Seconds of load before recording')
+    parser.add_argument('--mix', default = DEFAULT_MIX, help = 'Request kinds and weights (random, hot, invalid)')
+    parser.add_argument('--seed', type = int, default = 0)
+    parser.add_argument('--timeout', type = float, default = 30, help = 'Seconds before an HTTP request fails')
+    parser.add_argument('--memory-interval', type = float, default = 1, help = 'Seconds between two memory samples')
+    parser.add_argument('--output', help = 'Write the summary and memory samples to this JSON file')
+    args = parser.parse_args()
+
+    process = None
+    try:
+        if args.in_process:
+            from backend.backend import app
+            target_name, server_pid = 'in-process', os.getpid()
+            client_factory = lambda: InProcessClient(app)
+        else:
+            url = args.url
+            server_pid = args.pid
+            if args.serve:
+                port = free_port()
+                process = start_server(args.serve, port, args.workers)
+                url, server_pid = f'http://127.0.0.1:{port}', process.pid
+            target_name = args.serve or url
+            client_factory = lambda: HttpClient(url, args.timeout)
+
+        sampler = MemorySampler(server_pid, args.memory_interval) if server_pid else None
+        mix = RequestMix(forecast_origin(client_factory()), args.mix, args.seed)
+        if sampler:
+            sampler.start()
+        records = run_load(client_factory, mix, args.concurrency, args.duration, args.warmup, args.seed)
+        result = {'target': target_name, 'created': datetime.now().isoformat(timespec = 'seconds'),
+                  'concurrency': args.concurrency, 'duration': args.duration, 'mix': args.mix, 'seed': args.seed,
+                  'summary': summarize(records, args.duration), 'memory': sampler.stop() if sampler else []}
+        print_report(result)
+        logging.info(f"Load test of {target_name}: {result['summary'].get('throughput', 0):.1f} req/s")
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(result, f, indent = 1)
+    except Exception as e:
+        logging.error(CustomException(e,sys))
+        raise CustomException(e,sys)
+    finally:
+        if process is not None:
+            stop_server(process)
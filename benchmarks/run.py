@@ -0,0 +1,227 @@
+from utils.logger import logging
+from utils.exception import CustomException
+from utils.arima_state import ArimaState
+from utils.forecast import forecast_origin, forecast_path, simulate_paths, path_distribution
+from pipeline.data_preprocess import preprocess_dataset
+from pipeline.train_model import train_model
+from backend import backend as backend_module
+from backend.model_store import ModelStore
+from .synthetic import synthetic_prices
+import sys
+import os
+import json
+import time
+import platform
+import argparse
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+# Benchmark suite: wall time and peak traced memory of the pipeline stages and the prediction
+# endpoint on synthetic series, written to JSON and compared against a stored baseline.
+#     python -m benchmarks.run                        -> run, write benchmarks/results.json, compare
+#     python -m benchmarks.run --save-baseline        -> run and store the result as the new baseline
+
+SIZES = [1_000, 10_000, 100_000, 1_000_000]
+HORIZONS = [5, 60, 250]
+# Business days requested from GET / (inside the precomputed forecast table)
+ENDPOINT_HORIZON = 60
+TABLE_HORIZON = 260
+# Monte Carlo benchmark: paths x the longest horizon
+SIMULATION_PATHS = 10_000
+BENCHMARK_PATH = os.path.abspath(os.path.dirname(__file__))
+BASELINE_PATH = os.path.join(BENCHMARK_PATH, 'baseline.json')
+RESULTS_PATH = os.path.join(BENCHMARK_PATH, 'results.json')
+# Seconds a benchmark may lose on top of --threshold before it counts as a regression (timer and scheduler noise)
+MIN_DELTA = float(os.environ.get('BENCHMARK_MIN_DELTA', 0.005))
+
+
+def measure(function, repeat = 1, memory = True):
+    '''
+    -> args: function (no arguments), repeat (timed runs), memory (measure the peak in the untimed warm-up run)
+    -> return: dict with seconds (median), min_seconds, peak_mb (None without memory), repeat
+    '''
+    # Untimed warm-up: one-time costs (lazy imports, first-call caches) would otherwise land in the only timed run
+    # of the slow benchmarks. Under tracemalloc when memory is measured, tracing slows Python code down
+    peak_mb = None
+    if memory:
+        tracemalloc.start()
+        try:
+            function()
+            peak_mb = tracemalloc.get_traced_memory()[1] / 1024 ** 2
+        finally:
+            tracemalloc.stop()
+    else:
+        function()
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - started)
+    return {'seconds': float(np.median(timings)), 'min_seconds': float(np.min(timings)), 'peak_mb': peak_mb, 'repeat': repeat}
+
+def horizon_dates(df, horizon):
+    # First and last business day of a `horizon` day forecast
+    origin = forecast_origin(df)
+    end = np.busday_offset(origin, horizon - 1, roll = 'forward')
+    return origin.astype(datetime), end.astype(datetime)
+
+def serve_snapshot(model_state, df, forecast_table):
+    # Point the Flask app at the synthetic artifacts instead of the files in backend/models
+    backend_module.model_store = backend_module.model_registry.register(
+        None, ModelStore(lambda: (model_state, df, forecast_table), [], check_interval = float('inf')))
+    backend_module.forecast_cache.clear()
+
+def check_batch_consistency(client, df):
+    '''
+    A date range gets the same predictions from GET / alone, from POST /batch alone and from POST /batch next to
+    a range past the forecast table (a longer path computed by the model). AssertionError otherwise.
+    '''
+    origin = forecast_origin(df)
+    ranges = []
+    for first, last in [(0, 5), (TABLE_HORIZON - 10, TABLE_HORIZON + 40)]:
+        start_date, end_date = (np.busday_offset(origin, k, roll = 'forward').astype(datetime) for k in (first, last - 1))
+        ranges.append({'start_date': f'{start_date:%Y-%m-%d}', 'end_date': f'{end_date:%Y-%m-%d}'})
+    batch = client.post('/batch', json = {'ranges': ranges}).get_json()['results']
+    for date_range, result in zip(ranges, batch):
+        alone = client.get('/', query_string = date_range).get_json()
+        batch_alone = client.post('/batch', json = {'ranges': [date_range]}).get_json()['results'][0]
+        assert result['predictions'] == batch_alone['predictions'] == alone, \
+            f'{date_range} predictions differ between GET /, POST /batch alone and POST /batch with other ranges'
+
+def run_size(n_rows, results, model_state, train_max_rows, repeat, memory):
+    '''
+    -> return: model_state to reuse for the sizes that are too large to train
+    '''
+    df_raw = synthetic_prices(n_rows)
+    heavy = n_rows > 100_000
+
+    results[f'preprocess_dataset/{n_rows}'] = measure(lambda: preprocess_dataset(df_raw.copy()), 1 if heavy else 3, memory)
+    df, df_train, df_test, exog_train, exog_test = preprocess_dataset(df_raw.copy())
+
+    key = f'train_model/{n_rows}'
+    if n_rows <= train_max_rows:
+        trained = {}
+        def train():
+            trained['result'] = train_model(df_train, df_test, exog_train, exog_test, ticker_code = 'BENCH', log_mlflow = False, plot = False)
+        results[key] = measure(train, 3 if n_rows <= 10_000 else 1, memory)
+        if trained['result'] is None:
+            results[key] = {'error': 'train_model failed, see the logs'}
+        else:
+            model_state = ArimaState.from_results(trained['result'][0])
+    else:
+        results[key] = {'skipped': f'more than {train_max_rows} rows (--train-max-rows)'}
+    if model_state is None:
+        return model_state
+
+    forecast_table = forecast_path(model_state, df, TABLE_HORIZON)
+    for horizon in HORIZONS:
+        start_date, end_date = horizon_dates(df, horizon)
+        results[f'predict_future_model_h{horizon}/{n_rows}'] = measure(
+            lambda: backend_module.predict_future(start_date, end_date, model_state, df), repeat, memory)
+        results[f'predict_future_table_h{horizon}/{n_rows}'] = measure(
+            lambda: backend_module.predict_future(start_date, end_date, model_state, df, forecast_table), repeat, memory)
+    horizon = max(HORIZONS)
+    results[f'simulate_paths_{SIMULATION_PATHS}_h{horizon}/{n_rows}'] = measure(
+        lambda: path_distribution(simulate_paths(model_state, forecast_table['close_pred'][:horizon], df['close_log'].iloc[-1],
+                                                 SIMULATION_PATHS, seed = 0), [0.05, 0.5, 0.95], [df['close'].iloc[-1]]),
+        max(repeat // 4, 3), memory)
+
+    serve_snapshot(model_state, df, forecast_table)
+    client = backend_module.app.test_client()
+    check_batch_consistency(client, df)
+    start_date, end_date = horizon_dates(df, ENDPOINT_HORIZON)
+    url = f'/?start_date={start_date:%Y-%m-%d}&end_date={end_date:%Y-%m-%d}'
+
+    def get_cold():
+        backend_module.forecast_cache.clear()
+        assert client.get(url).status_code == 200
+    def get_warm():
+        assert client.get(url).status_code == 200
+    results[f'get_cold_h{ENDPOINT_HORIZON}/{n_rows}'] = measure(get_cold, repeat, memory)
+    results[f'get_warm_h{ENDPOINT_HORIZON}/{n_rows}'] = measure(get_warm, repeat, memory)
+    return model_state
+
+def run_suite(sizes = SIZES, train_max_rows = 100_000, repeat = 20, memory = True):
+    results = {}
+    model_state = None
+    for n_rows in sizes:
+        started = time.perf_counter()
+        model_state = run_size(n_rows, results, model_state, train_max_rows, repeat, memory)
+        logging.info(f'Benchmarks on {n_rows} rows completed in {time.perf_counter() - started:.1f}s')
+    return {
+        'meta': {
+            'created': datetime.now().isoformat(timespec = 'seconds'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'machine': platform.machine(),
+            'cpus': os.cpu_count()},
+        'results': results}
+
+def compare(current, baseline, threshold = 0.2, min_delta = MIN_DELTA):
+    '''
+    -> args: current and baseline result files, threshold (allowed relative slowdown),
+       min_delta (seconds, absolute slowdowns below this, or below the spread of the baseline runs, are noise)
+    -> return: dataframe with one row per benchmark present in both, status regression/improved/ok
+    '''
+    rows = []
+    for key, result in current['results'].items():
+        base = baseline['results'].get(key, {})
+        if 'min_seconds' not in result or 'min_seconds' not in base:
+            continue
+        # Fastest runs: scheduler and cache noise only ever add time, the median of a few runs moves with it
+        ratio = result['min_seconds'] / base['min_seconds'] if base['min_seconds'] else np.inf
+        status = 'ok'
+        # Median minus fastest baseline run: how much this machine moved the benchmark while the baseline was taken
+        noise = max(min_delta, base['seconds'] - base['min_seconds'])
+        if result['min_seconds'] > base['min_seconds'] * (1 + threshold) + noise:
+            status = 'regression'
+        elif ratio < 1 - threshold:
+            status = 'improved'
+        rows.append({'benchmark': key, 'baseline_s': base['min_seconds'], 'current_s': result['min_seconds'],
+                     'ratio': ratio, 'peak_mb': result.get('peak_mb'), 'status': status})
+    return pd.DataFrame(rows, columns = ['benchmark', 'baseline_s', 'current_s', 'ratio', 'peak_mb', 'status'])
+
+def write_json(data, path):
+    with open(path, 'w') as f:
+        json.dump(data, f, indent = 1)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Benchmark the pipeline stages and the prediction endpoint')
+    parser.add_argument('--sizes', type = int, nargs = '+', default = SIZES, help = 'Synthetic series lengths (rows)')
+    parser.add_argument('--train-max-rows', type = int, default = 100_000, help = 'Skip train_model above this size')
+    parser.add_argument('--repeat', type = int, default = 20, help = 'Timed runs of the fast benchmarks (fastest compared)')
+    parser.add_argument('--no-memory', action = 'store_true', help = 'Skip the tracemalloc run')
+    parser.add_argument('--output', default = RESULTS_PATH)
+    parser.add_argument('--baseline', default = BASELINE_PATH)
+    parser.add_argument('--threshold', type = float, default = 0.2, help = 'Allowed slowdown before failing (0.2 = 20%%)')
+    parser.add_argument('--min-delta', type = float, default = MIN_DELTA, help = 'Absolute slowdown in seconds always tolerated')
+    parser.add_argument('--save-baseline', action = 'store_true', help = 'Store this run as the baseline')
+    args = parser.parse_args()
+
+    try:
+        current = run_suite(args.sizes, args.train_max_rows, args.repeat, not args.no_memory)
+        write_json(current, args.output)
+        logging.info(f'Benchmark results written to {args.output}')
+        if args.save_baseline:
+            write_json(current, args.baseline)
+            print(f'Baseline saved to {args.baseline}')
+            sys.exit(0)
+        if not os.path.exists(args.baseline):
+            print(f'No baseline at {args.baseline}, run with --save-baseline first')
+            sys.exit(0)
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        df_compare = compare(current, baseline, args.threshold, args.min_delta)
+        print(df_compare.to_string(index = False, float_format = '%.4f'))
+        regressions = df_compare[df_compare['status'] == 'regression']
+        if len(regressions):
+            print(f'{len(regressions)} benchmarks slower than the baseline by more than {args.threshold:.0%}')
+            sys.exit(1)
+    except Exception as e:
+        logging.error(CustomException(e,sys))
+        raise CustomException(e,sys)
@@ -0,0 +1,21 @@
+import numpy as np
+import pandas as pd
+
+# Synthetic price series for the benchmarks, generated offline and reproducible from the seed.
+# Bars are hourly: one million daily bars would not fit in the datetime64[ns] range (years 1677-2262),
+# and starting in December keeps year, month and day varying even for the smallest series
+# (ARIMA rejects a constant exog column next to its own constant).
+START_DATE = '1990-12-01'
+FREQUENCY = 'h'
+
+
+def synthetic_prices(n_rows, seed = 0, start_price = 100.0, drift = 0.0001, volatility = 0.01):
+    '''
+    -> args: n_rows, seed, start_price, drift and volatility of the log returns per bar
+    -> return: dataframe with Date and Close columns, like load_dataset()
+    '''
+    rng = np.random.default_rng(seed)
+    log_returns = rng.normal(drift, volatility, n_rows)
+    close = start_price * np.exp(np.cumsum(log_returns))
+    dates = pd.date_range(START_DATE, periods = n_rows, freq = FREQUENCY)
+    return pd.DataFrame({'Date': dates, 'Close': close})
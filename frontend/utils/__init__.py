@@ -0,0 +1,26 @@
+import os
+import sys
+import importlib.util
+
+# The Streamlit app imports frontend/utils as `utils`, which hides the repo's utils package: the modules shared
+# with the pipeline and the backend are loaded from utils/<name>.py by path (copied next to frontend/ in the image)
+# instead of duplicated here, and the modules of this folder only re-export them.
+SHARED_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__),'..','..','utils'))
+
+
+def load_shared(name, *attributes):
+    '''
+    -> args: name (module of the repo's utils package), attributes (names to return)
+    -> return: the attributes of utils/<name>.py, loaded once per process as shared_<name>
+    '''
+    module_name = f'shared_{name}'
+    if module_name not in sys.modules:
+        spec = importlib.util.spec_from_file_location(module_name, os.path.join(SHARED_DIR, f'{name}.py'))
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[module_name] = module
+        try:
+            spec.loader.exec_module(module)
+        except Exception:
+            del sys.modules[module_name]
+            raise
+    return tuple(getattr(sys.modules[module_name], attribute) for attribute in attributes)
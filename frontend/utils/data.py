@@ -0,0 +1,110 @@
+import os
+
+import pandas as pd
+import requests
+import streamlit as st
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from utils.store import load_store, schema_path
+
+# Data layer of the Streamlit app. A rerun (every widget change) only touches what is not cached yet:
+#     load_history()                  -> dataset store, read again only when the pipeline republishes it
+#     fetch_window(first, last)       -> whole selectable forecast window, one backend call per model version
+#     slice_window(window, start, end) -> rows of the picked dates, no network
+# Requests reuse one keep-alive session per process.
+
+# Local stand-in: BACKEND_URL=http://127.0.0.1:5000
+BACKEND_URL = os.environ.get('BACKEND_URL', 'https://mutual-jolyn-fadhilrezam-e8b0b3af.koyeb.app').rstrip('/')
+DF_PATH = os.path.abspath(os.environ.get('DATA_STORE_PATH',
+                                         os.path.join(os.path.dirname(__file__),'..','..','data','processed','nvda','df_cleaned')))
+# Business days after the last observed date the date pickers allow
+WINDOW_DAYS = int(os.environ.get('FORECAST_WINDOW_DAYS', 14))
+# Seconds before the served model version is asked again (a new version refetches the window)
+MODEL_VERSION_TTL = float(os.environ.get('MODEL_VERSION_TTL', 60))
+# (connect, read) seconds of one backend call
+REQUEST_TIMEOUT = (float(os.environ.get('BACKEND_CONNECT_TIMEOUT', 3.05)), float(os.environ.get('BACKEND_READ_TIMEOUT', 30)))
+
+
+@st.cache_resource
+def get_session():
+    # One pooled keep-alive session per process, shared by every browser session of the app
+    session = requests.Session()
+    retry = Retry(total = 2, backoff_factor = 0.2, status_forcelist = (502, 503, 504), allowed_methods = ('GET',))
+    adapter = HTTPAdapter(pool_connections = 4, pool_maxsize = 16, max_retries = retry)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+def store_fingerprint(df_path = DF_PATH):
+    # Changes when the pipeline republishes the store, part of the history cache key
+    try:
+        return os.stat(schema_path(df_path)).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+@st.cache_data(show_spinner = False)
+def _load_history(df_path, fingerprint):
+    if fingerprint is None:
+        return None
+    return load_store(df_path, columns = ['close'])
+
+def load_history(df_path = DF_PATH):
+    # -> return: close column of the dataset store (None when it is not published), cached across reruns
+    return _load_history(df_path, store_fingerprint(df_path))
+
+@st.cache_data(ttl = MODEL_VERSION_TTL, show_spinner = False)
+def backend_health(backend_url = BACKEND_URL):
+    # -> return: /health body (model_version, last_date of the served model), empty when the backend does not answer
+    try:
+        response = get_session().get(f'{backend_url}/health', timeout = REQUEST_TIMEOUT)
+        return response.json()
+    except (requests.RequestException, ValueError):
+        return {}
+
+def model_version(backend_url = BACKEND_URL):
+    # -> return: content hash of the served model, None when the backend does not report it
+    return backend_health(backend_url).get('model_version')
+
+def last_observed_date(df, backend_url = BACKEND_URL):
+    # -> return: last date absorbed by the served model (moved by POST /update), the local store's when the backend does not report it
+    last_date = backend_health(backend_url).get('last_date')
+    return pd.Timestamp(last_date) if last_date else df.index.max()
+
+def forecast_window(df, backend_url = BACKEND_URL):
+    # -> return: (first, last) selectable dates, WINDOW_DAYS business days after the last date the backend has observed
+    first = (last_observed_date(df, backend_url) + pd.Timedelta(days = 1)).date()
+    last = pd.date_range(first, periods = WINDOW_DAYS, freq = 'B').max().date()
+    return first, last
+
+def _request_window(backend_url, first, last):
+    response = get_session().get(f'{backend_url}/', params = {'start_date': first, 'end_date': last}, timeout = REQUEST_TIMEOUT)
+    json_response = response.json()
+    if 'error' in json_response:
+        raise ValueError(json_response['error'])
+    response.raise_for_status()
+    window = pd.DataFrame.from_dict(json_response, orient = 'index')
+    window.index = pd.to_datetime(window.index)
+    return window
+
+@st.cache_data(max_entries = 16, show_spinner = False)
+def _fetch_window(backend_url, version, first, last):
+    # version is only part of the cache key: a newly served model gets its own entry
+    return _request_window(backend_url, first, last)
+
+def fetch_window(first, last, backend_url = BACKEND_URL):
+    '''
+    -> args: first, last (dates of the whole selectable window)
+    -> return: dataframe of predicted close prices by date, fetched once per (model version, window)
+       and on every call while the backend does not report its version
+    '''
+    version = model_version(backend_url)
+    first, last = first.strftime('%Y-%m-%d'), last.strftime('%Y-%m-%d')
+    if version is None:
+        # Nothing tells when the served model changes: a cached window could outlive it forever
+        return _request_window(backend_url, first, last)
+    return _fetch_window(backend_url, version, first, last)
+
+def slice_window(window, start_date, end_date):
+    # -> return: rows of the prefetched window between start_date and end_date (both included)
+    return window.loc[pd.Timestamp(start_date):pd.Timestamp(end_date)]
@@ -0,0 +1,4 @@
+from . import load_shared
+
+SCHEMA_FILE, schema_path, read_schema, load_columns, load_store, load_splits = load_shared(
+    'store', 'SCHEMA_FILE', 'schema_path', 'read_schema', 'load_columns', 'load_store', 'load_splits')
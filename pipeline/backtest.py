@@ -0,0 +1,161 @@
+from utils.logger import logging
+from utils.exception import CustomException
+from utils.store import load_store, read_schema
+from .paths import ticker_path
+import sys
+import os
+import time
+import argparse
+
+import pandas as pd
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from statsmodels.tsa.arima.model import ARIMA
+
+import warnings
+warnings.filterwarnings("ignore")
+
+
+def load_backtest_dataset(ticker_code = 'NVDA'):
+    '''
+    -> return: df (full processed dataset), exog_columns, initial (number of training rows)
+    '''
+    store_path = os.path.join(ticker_path("processed", ticker_code, create = False), "df_cleaned")
+    schema = read_schema(store_path)
+    return load_store(store_path), schema['exog'], schema['splits']['train'][1]
+
+def backtest_origins(n, initial, horizon, step = 1):
+    # Origin t forecasts rows t .. t+horizon-1 from the rows before t
+    return np.arange(initial, n - horizon + 1, step)
+
+def fit_arima(y, exog, order, start_params = None):
+    # Only the point forecasts are needed, skip the parameter covariance
+    return ARIMA(y, order = order, exog = exog).fit(start_params = start_params, cov_type = 'none')
+
+def segment_forecasts(model_arima, y, exog, origins, horizon):
+    '''
+    Forecasts of every origin in one segment from a single filter pass.
+    The fitted parameters are applied to the whole series (no re-estimation) and filtered once, the predicted
+    state at row t only uses the rows before t, then the h-step forecasts of all origins are
+        obs_intercept[t+h] + Z T^h a[t]
+    computed as one matrix product instead of one forecast call per origin.
+    -> args: model_arima (fitted on rows before the first origin), y, exog, origins, horizon
+    -> return: forecast matrix (origins x horizon)
+    '''
+    # apply rather than extend: extend rebuilds the model on the new rows only, and a short slice
+    # can hold a constant exog column (ex. year) that statsmodels rejects next to the trend
+    applied = model_arima.apply(y, exog = exog)
+    ssm = applied.filter_results
+    design = ssm.design[:, :, 0]
+    transition = ssm.transition[:, :, 0]
+    obs_intercept = np.broadcast_to(ssm.obs_intercept[0], (len(y),))
+
+    # Z T^h for h = 0 .. horizon-1
+    loadings = np.empty((horizon, transition.shape[0]))
+    loadings[0] = design[0]
+    for h in range(1, horizon):
+        loadings[h] = loadings[h - 1] @ transition
+
+    states = ssm.predicted_state[:, origins]
+    return (loadings @ states).T + obs_intercept[origins[:, None] + np.arange(horizon)]
+
+def backtest(df, exog_columns, order = (1,0,1), initial = None, horizon = 20, step = 1, refit_every = None):
+    '''
+    Walk-forward (rolling origin) backtest. The model is fitted once on the rows before the first origin
+    and moved forward by filtering the new observations with its parameters; parameters are only
+    re-estimated every refit_every origins, warm started from the previous estimate.
+    -> args: df (processed dataset), exog_columns, order, initial (rows before the first origin, default 85%),
+       horizon (business days), step (rows between origins), refit_every (origins between refits, None never)
+    -> return: dict with origins (dates), forecasts, actuals, errors (origins x horizon, log diff scale),
+       price errors (origins x horizon, original scale), rmse_by_horizon, refits and seconds
+    '''
+    try:
+        started = time.perf_counter()
+        y = df['close_log_diff'].to_numpy(dtype = 'float64')
+        exog = df[exog_columns].to_numpy(dtype = 'float64') if exog_columns else None
+        initial = initial or int(len(df) * 0.85)
+        origins = backtest_origins(len(y), initial, horizon, step)
+        if not len(origins):
+            raise ValueError(f'No origin between row {initial} and {len(y) - horizon}')
+        refit_every = refit_every or len(origins)
+        logging.info(f'Backtest of ARIMA{tuple(order)} over {len(origins)} origins, horizon {horizon}, refit every {refit_every} origins')
+
+        forecasts = np.empty((len(origins), horizon))
+        model_arima = None
+        for i in range(0, len(origins), refit_every):
+            start = origins[i]
+            model_arima = fit_arima(y[:start], None if exog is None else exog[:start], order,
+                                    start_params = None if model_arima is None else model_arima.params)
+            segment = origins[i:i + refit_every]
+            forecasts[i:i + len(segment)] = segment_forecasts(model_arima, y, exog, segment, horizon)
+
+        # Row t+h of the target for every origin t and step h, no copy
+        actuals = sliding_window_view(y, horizon)[origins]
+        errors = actuals - forecasts
+        close = df['close'].to_numpy(dtype = 'float64')
+        close_log = df['close_log'].to_numpy(dtype = 'float64')
+        price_forecasts = np.exp(close_log[origins - 1][:, None] + np.cumsum(forecasts, axis = 1))
+        price_errors = sliding_window_view(close, horizon)[origins] - price_forecasts
+
+        result = {
+            'origins': df.index.values[origins],
+            'forecasts': forecasts,
+            'actuals': actuals,
+            'errors': errors,
+            'price_errors': price_errors,
+            'rmse_by_horizon': np.sqrt(np.mean(errors ** 2, axis = 0)),
+            'rmse_original_scale_by_horizon': np.sqrt(np.mean(price_errors ** 2, axis = 0)),
+            'refits': -(-len(origins) // refit_every),
+            'seconds': time.perf_counter() - started}
+        logging.info(f'Backtest completed in {result["seconds"]:.2f}s with {result["refits"]} fits')
+        return result
+    except Exception as e:
+        logging.error(CustomException(e,sys))
+        raise CustomException(e,sys)
+
+def backtest_refit(df, exog_columns, origins, order = (1,0,1), horizon = 20):
+    '''
+    Naive reference: a full ARIMA fit and a forecast call at every origin.
+    -> return: forecast matrix (origins x horizon), seconds
+    '''
+    started = time.perf_counter()
+    y = df['close_log_diff'].to_numpy(dtype = 'float64')
+    exog = df[exog_columns].to_numpy(dtype = 'float64') if exog_columns else None
+    forecasts = np.empty((len(origins), horizon))
+    for i, t in enumerate(origins):
+        model_arima = ARIMA(y[:t], order = order, exog = None if exog is None else exog[:t]).fit()
+        forecasts[i] = model_arima.forecast(steps = horizon, exog = None if exog is None else exog[t:t + horizon])
+    return forecasts, time.perf_counter() - started
+
+def save_backtest(result, ticker_code = 'NVDA'):
+    folder_path = ticker_path("backtests", ticker_code)
+    file_path = os.path.join(folder_path, 'backtest.npz')
+    np.savez(file_path, **result)
+    logging.info(f'Backtest saved to {file_path}')
+    return file_path
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Walk-forward backtest of the ARIMA model on the stored dataset')
+    parser.add_argument('--ticker', default = 'NVDA')
+    parser.add_argument('--order', type = int, nargs = 3, default = [1, 0, 1])
+    parser.add_argument('--horizon', type = int, default = 20)
+    parser.add_argument('--step', type = int, default = 1)
+    parser.add_argument('--initial', type = int, default = None, help = 'Rows before the first origin, default: the train split')
+    parser.add_argument('--refit-every', type = int, default = None, help = 'Origins between parameter refits, default: never')
+    parser.add_argument('--compare-naive', type = int, default = 0, help = 'Also refit at the first N origins and report the timing')
+    args = parser.parse_args()
+
+    df, exog_columns, train_rows = load_backtest_dataset(args.ticker)
+    result = backtest(df, exog_columns, tuple(args.order), args.initial or train_rows, args.horizon, args.step, args.refit_every)
+    save_backtest(result, args.ticker)
+    summary = pd.DataFrame({'rmse': result['rmse_by_horizon'], 'rmse_original_scale': result['rmse_original_scale_by_horizon']},
+                           index = pd.RangeIndex(1, args.horizon + 1, name = 'horizon'))
+    print(summary.to_string())
+    print(f'{len(result["origins"])} origins in {result["seconds"]:.2f}s ({result["refits"]} fits)')
+
+    if args.compare_naive:
+        origins = backtest_origins(len(df), args.initial or train_rows, args.horizon, args.step)[:args.compare_naive]
+        _, seconds = backtest_refit(df, exog_columns, origins, tuple(args.order), args.horizon)
+        estimate = seconds / len(origins) * len(result['origins'])
+        print(f'Naive refit: {len(origins)} origins in {seconds:.2f}s, about {estimate:.0f}s for all {len(result["origins"])} origins')
@@ -0,0 +1,173 @@
+from utils.logger import logging
+from .paths import DATA_PATH
+import os
+import json
+import time
+import shutil
+import hashlib
+
+# Content-addressed artifact cache for the pipeline stages.
+#     <cache>/<stage>/<key>/meta.json  -> inputs the key was computed from, digests and stage results
+#     <cache>/<stage>/<key>/<name>     -> copy of every file or folder the stage produced
+# A key hashes the stage inputs: parameters and the keys of the upstream stages, or the digest of
+# the raw data for preprocessing. A stage whose key is cached restores its artifacts instead of running.
+#
+# Stage graph of run_pipeline (stage -> upstream stages its key depends on):
+STAGE_GRAPH = {
+    'ingestion': [],
+    'preprocess': ['ingestion'],
+    'order_search': ['preprocess'],
+    'train': ['preprocess', 'order_search'],
+    'forecast_table': ['preprocess', 'train']}
+
+CACHE_PATH = os.path.abspath(os.environ.get('PIPELINE_CACHE_PATH', os.path.join(DATA_PATH, 'cache')))
+# Least recently used entries are removed above this size
+CACHE_MAX_BYTES = int(os.environ.get('PIPELINE_CACHE_MAX_BYTES', 1024 ** 3))
+META_FILE = 'meta.json'
+
+
+def file_digest(path, block_size = 1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def path_digest(path):
+    # Digest of a file, or of every file of a folder with its relative path
+    if not os.path.isdir(path):
+        return file_digest(path)
+    digest = hashlib.sha256()
+    for folder, dirs, files in sorted(os.walk(path)):
+        dirs.sort()
+        for name in sorted(files):
+            file_path = os.path.join(folder, name)
+            digest.update(os.path.relpath(file_path, path).replace(os.sep, '/').encode())
+            digest.update(file_digest(file_path).encode())
+    return digest.hexdigest()
+
+def path_size(path):
+    if not os.path.isdir(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(folder, name)) for folder, _, files in os.walk(path) for name in files)
+
+def copy_path(source, destination):
+    # Copy next to the destination first and swap, readers never see a half copied artifact
+    tmp_path = f'{destination}.tmp-{os.getpid()}'
+    if os.path.isdir(source):
+        shutil.rmtree(tmp_path, ignore_errors = True)
+        shutil.copytree(source, tmp_path)
+        old_path = f'{destination}.old-{os.getpid()}'
+        if os.path.exists(destination):
+            os.rename(destination, old_path)
+        os.rename(tmp_path, destination)
+        shutil.rmtree(old_path, ignore_errors = True)
+    else:
+        shutil.copyfile(source, tmp_path)
+        os.replace(tmp_path, destination)
+
+
+class ArtifactCache:
+    '''
+    -> path: cache folder (PIPELINE_CACHE_PATH, default data/cache)
+    -> max_bytes: size above which the least recently used entries are evicted (PIPELINE_CACHE_MAX_BYTES, default 1 GB)
+    '''
+    def __init__(self, path = CACHE_PATH, max_bytes = CACHE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def key(stage, **inputs):
+        payload = json.dumps({'stage': stage, 'inputs': inputs}, sort_keys = True, default = str)
+        return hashlib.sha256(payload.encode()).hexdigest()[:24]
+
+    def entry_path(self, stage, key):
+        return os.path.join(self.path, stage, key)
+
+    def load(self, stage, key, destinations):
+        '''
+        -> args: stage, key, destinations ({artifact name: path to restore it to})
+        -> return: meta of the entry with every artifact restored, None on a miss
+        '''
+        entry_path = self.entry_path(stage, key)
+        try:
+            with open(os.path.join(entry_path, META_FILE)) as f:
+                meta = json.load(f)
+            for name, destination in destinations.items():
+                # Artifacts already in place (the usual case on a rerun) are not copied again
+                if os.path.exists(destination) and path_digest(destination) == meta['digests'][name]:
+                    continue
+                copy_path(os.path.join(entry_path, name), destination)
+            # Modification time of meta.json orders the entries for eviction
+            os.utime(os.path.join(entry_path, META_FILE))
+        except (FileNotFoundError, KeyError, ValueError):
+            # Never stored, evicted by another process meanwhile, or incomplete
+            return None
+        logging.info(f'{stage} restored from cache entry {key}')
+        return meta
+
+    def save(self, stage, key, sources, meta = None):
+        '''
+        -> args: stage, key, sources ({artifact name: file or folder produced by the stage}), meta (json serializable results)
+        -> return: None, the entry is written to a temporary folder and renamed into place
+        '''
+        entry_path = self.entry_path(stage, key)
+        tmp_path = f'{entry_path}.tmp-{os.getpid()}'
+        shutil.rmtree(tmp_path, ignore_errors = True)
+        os.makedirs(tmp_path)
+        try:
+            digests = {}
+            for name, source in sources.items():
+                if os.path.isdir(source):
+                    shutil.copytree(source, os.path.join(tmp_path, name))
+                else:
+                    shutil.copyfile(source, os.path.join(tmp_path, name))
+                digests[name] = path_digest(source)
+            with open(os.path.join(tmp_path, META_FILE), 'w') as f:
+                json.dump({**(meta or {}), 'digests': digests, 'created': time.time()}, f, indent = 1, default = str)
+            shutil.rmtree(entry_path, ignore_errors = True)
+            try:
+                os.rename(tmp_path, entry_path)
+            except OSError:
+                # Another process stored the same key meanwhile
+                pass
+        finally:
+            shutil.rmtree(tmp_path, ignore_errors = True)
+        logging.info(f'{stage} stored in cache entry {key}')
+        self.evict(keep = entry_path)
+
+    def entries(self):
+        # -> return: list of (last used, size, path), oldest first
+        entries = []
+        if not os.path.exists(self.path):
+            return entries
+        for stage in os.listdir(self.path):
+            stage_path = os.path.join(self.path, stage)
+            if not os.path.isdir(stage_path):
+                continue
+            for key in os.listdir(stage_path):
+                entry_path = os.path.join(stage_path, key)
+                try:
+                    entries.append((os.path.getmtime(os.path.join(entry_path, META_FILE)), path_size(entry_path), entry_path))
+                except FileNotFoundError:
+                    # Temporary folder of a save in progress
+                    continue
+        return sorted(entries)
+
+    def evict(self, keep = None):
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry_path in entries:
+            if total <= self.max_bytes:
+                break
+            if entry_path == keep:
+                continue
+            shutil.rmtree(entry_path, ignore_errors = True)
+            total -= size
+            logging.info(f'Evicted cache entry {entry_path} ({size} bytes)')
+        return total
+
+    def clear(self, stages = None):
+        # Drop every entry of the given stages (all stages by default)
+        for stage in stages or STAGE_GRAPH:
+            shutil.rmtree(os.path.join(self.path, stage), ignore_errors = True)
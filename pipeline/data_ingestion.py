@@ -1,37 +1,101 @@
-from utils.logger import logging
-from utils.exception import CustomException
-import sys
-import yfinance as yf
-from datetime import datetime
-from dateutil.relativedelta import relativedelta
-import os
-
-
-#Function get_stock_data to store in csv format in local folder
-def get_stock_data(ticker_code, start_date, end_date):
-    try:
-        folder_path = os.path.abspath(os.path.join(os.path.dirname(__file__),"..",'data','raw'))
-        if os.path.exists(folder_path):
-            df = yf.download(ticker_code, start = start_date, end = end_date)
-            file_name = f'{ticker_code.lower().replace("^","")}_stock_prices.csv'
-            file_path = os.path.join(folder_path, file_name)
-            df.to_csv(file_path)
-            logging.info(f'{ticker_code} stock data successfully saved in {file_path}')
-            logging.info('Data Ingestion Completed')
-            return df.head()
-    except Exception as e:
-        logging.error(CustomException(e,sys))
-
-
-if __name__ == '__main__':
-    logging.info('Initializing Ticker Code and Date Range')
-    ticker_code = input('Input the stock name (ex. TSLA, NVDA, ^GSPC, etc): ').strip().upper()
-    start_date = input('Input start date (YYYY-MM-DD):')
-    end_date = input('Input end date (YYYY-MM-DD):')
-    if not ticker_code:
-        ticker_code = 'NVDA'
-    if not start_date:
-        start_date = datetime(2019,10,5)
-    if not end_date: 
-        end_date = start_date + relativedelta(years = 5)
-    df = get_stock_data(ticker_code, start_date, end_date)
+from utils.logger import logging
+from utils.exception import CustomException
+import sys
+from .providers import YahooProvider, stock_file_name
+from datetime import datetime
+from dateutil.relativedelta import relativedelta
+import os
+import shutil
+
+import pandas as pd
+
+
+def read_last_date(file_path, block_size = 4096):
+    # Read only the end of the file to find the last stored bar
+    with open(file_path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        position = f.tell()
+        tail = b''
+        lines = []
+        while position > 0:
+            step = min(block_size, position)
+            position -= step
+            f.seek(position)
+            tail = f.read(step) + tail
+            lines = [line for line in tail.splitlines() if line.strip()]
+            if len(lines) > 1 or (position == 0 and lines):
+                break
+    if not lines:
+        return None
+    last_line = lines[-1].decode()
+    # Header only, nothing stored yet
+    if last_line.startswith('Date') or last_line.startswith('Price'):
+        return None
+    return pd.Timestamp(last_line.split(',')[0]).tz_localize(None).normalize()
+
+def append_rows(df_new, file_path):
+    # Append to a copy and swap it in, readers see either the old or the new file
+    with open(file_path, 'rb') as f:
+        first_line = f.readline()
+    header = first_line.decode().strip().split(',')
+    # Keep the line terminator the file was written with
+    lineterminator = '\r\n' if first_line.endswith(b'\r\n') else '\n'
+    tmp_path = f'{file_path}.tmp'
+    shutil.copyfile(file_path, tmp_path)
+    df_new.reset_index()[header].to_csv(tmp_path, mode = 'a', header = False, index = False, lineterminator = lineterminator)
+    os.replace(tmp_path, file_path)
+
+#Function get_stock_data to store in csv format in local folder
+def get_stock_data(ticker_code, start_date, end_date, provider = None, incremental = False):
+    '''
+    -> args: ticker_code, start_date, end_date, provider (MarketDataProvider, default Yahoo),
+       incremental (only fetch bars after the last stored date and append them)
+    -> return: head of the fetched dataframe
+    '''
+    try:
+        provider = provider or YahooProvider()
+        folder_path = os.path.abspath(os.path.join(os.path.dirname(__file__),"..",'data','raw'))
+        if os.path.exists(folder_path):
+            file_name = stock_file_name(ticker_code)
+            file_path = os.path.join(folder_path, file_name)
+            last_date = read_last_date(file_path) if incremental and os.path.exists(file_path) else None
+
+            if last_date is not None:
+                fetch_start = last_date + pd.Timedelta(days = 1)
+                if fetch_start >= pd.Timestamp(end_date):
+                    logging.info(f'{ticker_code} stock data already up to date ({last_date.date()})')
+                    return None
+                df = provider.fetch(ticker_code, fetch_start, end_date)
+                # Providers may return overlapping or repeated bars
+                df = df[df.index > last_date]
+                df = df[~df.index.duplicated(keep = 'last')].sort_index()
+                if df.empty:
+                    logging.info(f'No new {ticker_code} bars after {last_date.date()}')
+                    return None
+                append_rows(df, file_path)
+                logging.info(f'{len(df)} new {ticker_code} rows appended to {file_path}')
+            else:
+                df = provider.fetch(ticker_code, start_date, end_date)
+                tmp_path = f'{file_path}.tmp'
+                df.to_csv(tmp_path)
+                os.replace(tmp_path, file_path)
+                logging.info(f'{ticker_code} stock data successfully saved in {file_path}')
+            logging.info('Data Ingestion Completed')
+            return df.head()
+    except Exception as e:
+        logging.error(CustomException(e,sys))
+
+
+if __name__ == '__main__':
+    logging.info('Initializing Ticker Code and Date Range')
+    ticker_code = input('Input the stock name (ex. TSLA, NVDA, ^GSPC, etc): ').strip().upper()
+    start_date = input('Input start date (YYYY-MM-DD):')
+    end_date = input('Input end date (YYYY-MM-DD):')
+    incremental = input('Only fetch bars after the last stored date? (y/N):').strip().lower() == 'y'
+    if not ticker_code:
+        ticker_code = 'NVDA'
+    if not start_date:
+        start_date = datetime(2019,10,5)
+    if not end_date:
+        end_date = start_date + relativedelta(years = 5)
+    df = get_stock_data(ticker_code, start_date, end_date, incremental = incremental)
@@ -1,88 +1,195 @@
-from utils.logger import logging
-from utils.exception import CustomException
-import sys
-import os
-
-import pandas as pd
-import numpy as np
-
-
-
-    
-def load_dataset():
-    logging.info('Dataframe initialization')
-    try:
-        folder_path = os.path.abspath(os.path.join(os.path.dirname(__file__),"..","data","raw"))
-        file_name = 'nvda_stock_prices.csv'
-        file_path = os.path.join(folder_path,file_name)
-        if os.path.exists(file_path):
-            df = pd.read_csv(file_path)[['Date','Close']]
-            logging.info('Dataframe successfully loaded')
-            return df
-    except Exception as e:
-        logging.error(CustomException(e,sys))
-
-def preprocess_dataset(df):
-    try:
-        # Lower column name, replace whitespace and extract year, month and day from date column as new columns or features
-        df.columns = df.columns.str.lower().str.replace(' ','_')
-        df['date'] = pd.to_datetime(df['date'])
-        df['year'] = df['date'].dt.year
-        df['month'] = df['date'].dt.month
-        df['day'] = df['date'].dt.day
-
-        #Transform dataframe with transformation log and differencing to stabilze the data range and remove any trends
-        df['close_log'] = np.log(df['close'])
-        df['close_log_diff'] = df['close_log'].diff()
-        df.dropna(inplace = True)
-
-        for lag in range(1, 4):
-            df[f'lag_{lag}'] = df['close_log_diff'].shift(lag)
-            df.dropna(inplace = True)
-        df['rolling_mean'] = df['close_log_diff'].rolling(window = 5).mean()
-        df.dropna(inplace = True)
-
-        # Split dataframe and to train test split with 80/20 distribution
-        # Store other features as exogenous variables
-        df.set_index('date', inplace = True)
-        df.index = pd.to_datetime(df.index)
-        # n_rows = int(len(df)*0.8)
-        # df_train = df.iloc[:n_rows]
-        # df_test = df.iloc[n_rows:]
-        # exog_train = df_train[['lag_1', 'lag_2', 'lag_3', 'rolling_mean', 'year', 'month', 'day']]
-        # exog_test = df_test[['lag_1', 'lag_2', 'lag_3', 'rolling_mean', 'year', 'month', 'day']]
-        n_rows = int(len(df)*0.85)
-        df_train = df.iloc[:n_rows]
-        df_test = df.iloc[n_rows:]
-
-        features = df.drop(['close','close_log','close_log_diff'], axis = 1).columns.tolist()
-        exog_train = df_train[features]
-        exog_test = df_test[features]
-        return df, df_train, df_test, exog_train, exog_test
-    
-    except CustomException as e:
-        logging.error(CustomException(e,sys))
-
-def store_dataframe(df, df_train, df_test, exog_train, exog_test):
-    logging.info('Preparing to store train,test and exogenous dataframe')
-    try:
-        folder_path = os.path.abspath(os.path.join(os.path.dirname(__file__),"..","data","processed"))
-        folder_path_backend = os.path.abspath(os.path.join(os.path.dirname(__file__),"..","backend","data"))
-        if os.path.exists(folder_path):
-            df.to_csv(os.path.join(folder_path, 'df_cleaned.csv'), index = True)
-            df.to_csv(os.path.join(folder_path_backend, 'df_cleaned.csv'), index = True)
-            df_train.to_csv(os.path.join(folder_path, 'df_train.csv'), index = True)
-            df_test.to_csv(os.path.join(folder_path, 'df_test.csv'), index = True)
-            exog_train.to_csv(os.path.join(folder_path, 'exog_train.csv'), index = True)
-            exog_test.to_csv(os.path.join(folder_path, 'exog_test.csv'), index = True)
-            logging.info(f'Preprocessed Dataframe Successfully stored in {folder_path} and {folder_path_backend} for df_cleaned')
-    except Exception as e:
-        logging.error(CustomException(e,sys))
-    
-if __name__ == '__main__':
-    df = load_dataset()
-    df_cleaned, df_train, df_test, exog_train, exog_test = preprocess_dataset(df)
-    store_dataframe(df_cleaned, df_train, df_test, exog_train, exog_test)
-
-
-
+from utils.logger import logging
+from utils.exception import CustomException
+from utils.features import FeatureEngine, TAIL_SIZE
+from utils.store import write_store, append_store, finalize_store, load_store, load_columns, read_schema
+from .paths import DATA_PATH, ticker_path
+from .providers import stock_file_name
+import sys
+import os
+import shutil
+
+import pandas as pd
+import numpy as np
+
+# Share of the rows in the train split, the rest is the test split
+TRAIN_FRACTION = 0.85
+# Raw rows parsed at a time by the streaming preprocessing, peak memory grows with it
+CHUNK_ROWS = int(os.environ.get('PREPROCESS_CHUNK_ROWS', 100_000))
+TARGET_COLUMNS = ['close','close_log','close_log_diff']
+
+
+
+    
+def load_dataset(ticker_code = 'NVDA'):
+    logging.info(f'{ticker_code} Dataframe initialization')
+    try:
+        folder_path = os.path.join(DATA_PATH, "raw")
+        file_name = stock_file_name(ticker_code)
+        file_path = os.path.join(folder_path,file_name)
+        if os.path.exists(file_path):
+            df = pd.read_csv(file_path)[['Date','Close']]
+            logging.info('Dataframe successfully loaded')
+            return df
+    except Exception as e:
+        logging.error(CustomException(e,sys))
+
+def preprocess_dataset(df):
+    try:
+        # Lower column name, replace whitespace
+        df.columns = df.columns.str.lower().str.replace(' ','_')
+        df = df.dropna(subset = ['close'])
+
+        # Extract year, month and day from date column as new columns or features
+        # Transform with log and differencing to stabilze the data range and remove any trends,
+        # then add lags and rolling mean of the differences (see utils/features.py)
+        df = FeatureEngine().update(df)
+        return split_dataset(df)
+    
+    except CustomException as e:
+        logging.error(CustomException(e,sys))
+
+def preprocess_incremental(df_cleaned, df):
+    '''
+    -> args: df_cleaned (previously preprocessed dataframe), df (raw dataframe with Date and Close)
+    -> return: df, df_train, df_test, exog_train, exog_test like preprocess_dataset,
+       features are only computed for the raw rows after the last date of df_cleaned
+    '''
+    try:
+        df.columns = df.columns.str.lower().str.replace(' ','_')
+        df = df.dropna(subset = ['close'])
+        df_new = df[pd.to_datetime(df['date']) > df_cleaned.index[-1]]
+        df_features = FeatureEngine.from_features(df_cleaned).update(df_new)
+        logging.info(f'Features computed for {len(df_features)} new rows')
+        return split_dataset(pd.concat([df_cleaned, df_features]))
+    except Exception as e:
+        logging.error(CustomException(e,sys))
+
+def split_dataset(df):
+    try:
+        # Split dataframe and to train test split with 80/20 distribution
+        # Store other features as exogenous variables
+        # n_rows = int(len(df)*0.8)
+        # df_train = df.iloc[:n_rows]
+        # df_test = df.iloc[n_rows:]
+        # exog_train = df_train[['lag_1', 'lag_2', 'lag_3', 'rolling_mean', 'year', 'month', 'day']]
+        # exog_test = df_test[['lag_1', 'lag_2', 'lag_3', 'rolling_mean', 'year', 'month', 'day']]
+        n_rows = int(len(df)*TRAIN_FRACTION)
+        df_train = df.iloc[:n_rows]
+        df_test = df.iloc[n_rows:]
+
+        features = df.drop(TARGET_COLUMNS, axis = 1).columns.tolist()
+        exog_train = df_train[features]
+        exog_test = df_test[features]
+        return df, df_train, df_test, exog_train, exog_test
+    
+    except Exception as e:
+        logging.error(CustomException(e,sys))
+
+def load_cleaned_dataset(ticker_code = 'NVDA'):
+    logging.info(f'{ticker_code} Preprocessed dataframe initialization')
+    try:
+        store_path = os.path.join(ticker_path("processed", ticker_code, create = False), "df_cleaned")
+        if os.path.exists(store_path):
+            df = load_store(store_path)
+            logging.info('Preprocessed dataframe successfully loaded')
+            return df
+    except Exception as e:
+        logging.error(CustomException(e,sys))
+
+def split_rows(nrows):
+    # Row ranges of split_dataset for a store of nrows rows
+    n_train = int(nrows*TRAIN_FRACTION)
+    return {'train': [0, n_train], 'test': [n_train, nrows]}
+
+def resume_engine(store_path):
+    '''
+    -> return: FeatureEngine continuing after the stored rows and the last stored date,
+       read from the tail of the memory-mapped columns
+    '''
+    schema = read_schema(store_path)
+    nrows = schema['nrows']
+    columns = load_columns(store_path, schema)
+    engine = FeatureEngine(last_close_log = columns['close_log'][nrows - 1],
+                           diffs = np.asarray(columns['close_log_diff'][-TAIL_SIZE:]), rows_seen = nrows)
+    return engine, pd.Timestamp(columns[schema['index']][nrows - 1])
+
+def preprocess_streaming(ticker_code = 'NVDA', chunk_rows = CHUNK_ROWS, incremental = False):
+    '''
+    -> args: ticker_code, chunk_rows (raw rows read at a time),
+       incremental (append the raw rows after the last stored date to the existing store)
+    -> return: schema of processed/<ticker>/df_cleaned, the same store preprocess_dataset and store_dataframe write,
+       built one chunk at a time: the lag and rolling state crosses chunk boundaries in FeatureEngine
+    '''
+    logging.info(f'{ticker_code} Streaming preprocessing by chunks of {chunk_rows} rows')
+    try:
+        file_path = os.path.join(DATA_PATH, "raw", stock_file_name(ticker_code))
+        store_path = os.path.join(ticker_path("processed", ticker_code), "df_cleaned")
+        if incremental and os.path.exists(os.path.join(store_path, 'schema.json')) and read_schema(store_path)['nrows']:
+            # Appended in place, append_store keeps the store readable at every step
+            engine, last_date = resume_engine(store_path)
+            target_path = store_path
+        else:
+            # Built next to the current store and swapped in once complete
+            engine, last_date = FeatureEngine(), None
+            target_path = f'{store_path}.tmp'
+            shutil.rmtree(target_path, ignore_errors = True)
+
+        written = target_path == store_path
+        df_features = None
+        for chunk in pd.read_csv(file_path, usecols = ['Date','Close'], chunksize = chunk_rows):
+            chunk.columns = chunk.columns.str.lower().str.replace(' ','_')
+            chunk = chunk.dropna(subset = ['close'])
+            if last_date is not None:
+                chunk = chunk[pd.to_datetime(chunk['date']) > last_date]
+            df_features = engine.update(chunk)
+            if not len(df_features):
+                continue
+            if written:
+                append_store(df_features, target_path)
+            else:
+                write_store(df_features, target_path)
+                written = True
+        if not written:
+            if df_features is None:
+                raise ValueError(f'{file_path} has no rows')
+            write_store(df_features, target_path)
+
+        schema = read_schema(target_path)
+        exog = [column for column in schema['columns'] if column not in TARGET_COLUMNS + [schema['index']]]
+        nrows = schema['nrows']
+        schema = finalize_store(target_path, splits = split_rows(nrows), exog = exog)
+        if target_path != store_path:
+            old_path = f'{store_path}.old'
+            shutil.rmtree(old_path, ignore_errors = True)
+            if os.path.exists(store_path):
+                os.rename(store_path, old_path)
+            os.rename(target_path, store_path)
+            shutil.rmtree(old_path, ignore_errors = True)
+        logging.info(f'{nrows} preprocessed rows stored in {store_path}')
+        return schema
+    except Exception as e:
+        logging.error(CustomException(e,sys))
+        raise CustomException(e,sys)
+
+def store_dataframe(df, df_train, df_test, exog_train, exog_test, ticker_code = 'NVDA'):
+    logging.info(f'Preparing to store {ticker_code} train,test and exogenous dataframe')
+    try:
+        folder_path = ticker_path("processed", ticker_code)
+        if os.path.exists(folder_path):
+            # One columnar store, train/test/exog are row ranges and column lists into it
+            store_path = os.path.join(folder_path, 'df_cleaned')
+            n_train = len(df_train)
+            write_store(df, store_path,
+                        splits = {'train': [0, n_train], 'test': [n_train, n_train + len(df_test)]},
+                        exog = exog_train.columns.tolist())
+            logging.info(f'Preprocessed Dataframe Successfully stored in {store_path}')
+    except Exception as e:
+        logging.error(CustomException(e,sys))
+    
+if __name__ == '__main__':
+    df = load_dataset()
+    df_cleaned, df_train, df_test, exog_train, exog_test = preprocess_dataset(df)
+    store_dataframe(df_cleaned, df_train, df_test, exog_train, exog_test)
+
+
+
@@ -1,89 +1,259 @@
-from utils.logger import logging
-from utils.exception import CustomException
-import sys
-
-from .data_ingestion import get_stock_data
-from .data_preprocess import load_dataset, preprocess_dataset, store_dataframe
-from .train_model import train_model, save_model
-
-from datetime import datetime
-from dateutil.relativedelta import relativedelta
-
-def run_pipeline(ticker_code, start_date, end_date):
-    try:
-        get_stock_data(ticker_code, start_date,end_date)
-        '''
-        -> args (default):
-            1. ticker_code = 'NVDA'
-            2. start_date = 2019-10-05
-            3.end_date = start_date + 5 years ahead (2024-10-05)
-        -> return: None
-        '''
-    except Exception as e:
-        logging.error(CustomException(e,sys))
-
-    try:
-        df  = load_dataset()
-        '''
-        -> args: None
-        -> return: df (dataframe)
-        '''
-    except Exception as e:
-        logging.error(CustomException(e,sys))
-
-    try:
-        df_cleaned, df_train, df_test, exog_train, exog_test = preprocess_dataset(df)
-        
-        '''
-        -> args: df
-        -> return: df_train, df_test, exog_train, exog_test
-        '''
-    except Exception as e:
-        logging.error(CustomException(e,sys))
-
-    try:
-        store_dataframe(df_cleaned, df_train, df_test, exog_train, exog_test)
-        '''
-        -> args: df_cleaned, df_train, df_test, exog_train, exog_test
-        -> return: None'''
-    except Exception as e:
-        logging.error(CustomException(e,sys))    
-    try:
-        model_arima = train_model(df_train, df_test, exog_train, exog_test)
-        '''
-        -> args: df_train, df_test, exog_train, exog_test
-        -> return: model_arima
-        '''
-    except Exception as e:
-        logging.error(CustomException(e,sys))
-
-    try:
-        save_model(model_arima)
-        '''
-        -> args: model_arima
-        -> return: None
-        '''
-    except Exception as e:
-        logging.error(CustomException(e,sys))
-
-if __name__ == '__main__':
-    try:
-        logging.info('Initializing Ticker Code and Date Range')
-        ticker_code = input('Input the stock name (ex. TSLA, NVDA, ^GSPC, etc): ').strip().upper()
-        start_date = input('Input start date (YYYY-MM-DD):')
-        end_date = input('Input end date (YYYY-MM-DD):')
-        if not ticker_code:
-            ticker_code = 'NVDA'
-        if not start_date:
-            start_date = datetime(2019,10,5)
-        if not end_date: 
-            end_date = start_date + relativedelta(years = 5)
-        run_pipeline(ticker_code, start_date, end_date)
-    except Exception as e:
-        logging.error(CustomException(e,sys))
-    
-
-
-
-
-
+from utils.logger import logging
+from utils.exception import CustomException
+from utils.metrics import span
+from utils.features import LAGS, ROLLING_WINDOW
+from utils.store import load_splits, copy_store
+from utils.arima_state import ArimaState
+from utils.forecast import FORECAST_EXOG_WINDOW
+import sys
+import os
+import time
+from contextlib import contextmanager
+
+import pandas as pd
+
+from .data_ingestion import get_stock_data
+from .data_preprocess import load_dataset, load_cleaned_dataset, preprocess_dataset, preprocess_incremental, store_dataframe, preprocess_streaming, TRAIN_FRACTION
+from .train_model import train_model, save_model, export_forecast_table, HEADLESS, FORECAST_HORIZON
+from .model_selection import search_order
+from .cache import ArtifactCache, STAGE_GRAPH, file_digest
+from .paths import DATA_PATH, ticker_path
+from .providers import stock_file_name
+
+from datetime import datetime
+from dateutil.relativedelta import relativedelta
+
+def run_pipeline(ticker_code, start_date, end_date, incremental = False, provider = None, order_search = None, headless = HEADLESS,
+                 cache = None, force = (), streaming = False):
+    '''
+    -> args (default):
+        1. ticker_code = 'NVDA'
+        2. start_date = 2019-10-05
+        3.end_date = start_date + 5 years ahead (2024-10-05)
+        4. incremental = False (True only fetches the bars after the last stored date)
+        5. provider = None (market data provider, Yahoo Finance by default)
+        6. order_search = None (dict of search_order arguments to select the order and exog columns, None keeps (1,0,1))
+        7. headless = False (no plot and no MLflow tracking, PIPELINE_HEADLESS=1 changes the default)
+        8. cache = None (ArtifactCache of the stage outputs, default data/cache, False to always run every stage)
+        9. force = () (stages to run even when their output is cached, True for all of them)
+        10. streaming = False (preprocess the raw file by chunks straight into the store, for intraday history)
+    -> return: status (dict with ticker, status, failed stage, error, rmse metrics, duration, seconds per stage
+       and the stages restored from the cache)
+    '''
+    status = {'ticker': ticker_code, 'status': 'failed', 'stage': None, 'error': None, 'order': None,
+              'rmse': None, 'rmse_original_scale': None, 'seconds': None, 'stages': {}, 'cached': []}
+    started = time.perf_counter()
+
+    @contextmanager
+    def stage(name):
+        # Seconds per stage in the status, and span_duration_seconds{span="pipeline_<name>"} in this process
+        timing = None
+        try:
+            with span(f'pipeline_{name}') as timing:
+                yield
+        finally:
+            status['stages'][name] = timing.seconds if timing is not None else None
+
+    def fail(stage, e):
+        logging.error(CustomException(e,sys))
+        status['stage'] = stage
+        status['error'] = str(e)
+        status['seconds'] = time.perf_counter() - started
+        return status
+
+    cache = ArtifactCache() if cache is None else cache
+    force = set(STAGE_GRAPH) if force is True else set(force or ())
+
+    def lookup(name, key, destinations):
+        # Meta of the cached stage output restored to destinations, None when the stage has to run
+        if not cache or name in force:
+            return None
+        meta = cache.load(name, key, destinations)
+        if meta is not None:
+            status['cached'].append(name)
+        return meta
+
+    def remember(name, key, sources, meta = None):
+        if cache:
+            cache.save(name, key, sources, meta)
+
+    raw_path = os.path.join(DATA_PATH, 'raw', stock_file_name(ticker_code))
+    # Incremental runs and date ranges that are not over yet always ask the provider for new bars
+    fetch_once = not incremental and pd.Timestamp(end_date) <= pd.Timestamp.today().normalize()
+    ingestion_key = ArtifactCache.key('ingestion', ticker = ticker_code, start_date = pd.Timestamp(start_date).isoformat(),
+                                      end_date = pd.Timestamp(end_date).isoformat(),
+                                      provider = {'name': provider.name, **vars(provider)} if provider else 'yahoo')
+    try:
+        with stage('ingestion'):
+            if not (fetch_once and lookup('ingestion', ingestion_key, {'raw': raw_path})):
+                fetched = get_stock_data(ticker_code, start_date,end_date, provider = provider, incremental = incremental)
+                '''
+                -> args: ticker_code, start_date, end_date, provider, incremental
+                -> return: head of the fetched dataframe (None when nothing was fetched)
+                '''
+                if fetch_once and fetched is not None:
+                    remember('ingestion', ingestion_key, {'raw': raw_path})
+    except Exception as e:
+        return fail('ingestion', e)
+
+    store_path = os.path.join(ticker_path("processed", ticker_code), "df_cleaned")
+    try:
+        with stage('load'):
+            if not os.path.exists(raw_path):
+                raise FileNotFoundError(f'No raw data stored for {ticker_code}')
+            # Content addressed: a refetch returning the same bars keeps the downstream stages cached
+            preprocess_key = ArtifactCache.key('preprocess', raw = file_digest(raw_path), lags = LAGS,
+                                               rolling_window = ROLLING_WINDOW, train_fraction = TRAIN_FRACTION)
+            preprocessed = lookup('preprocess', preprocess_key, {'df_cleaned': store_path})
+            if preprocessed:
+                df_cleaned, df_train, df_test, exog_train, exog_test = load_splits(store_path)
+            elif not streaming:
+                df  = load_dataset(ticker_code)
+                if df is None:
+                    raise FileNotFoundError(f'No raw data stored for {ticker_code}')
+                '''
+                -> args: ticker_code
+                -> return: df (dataframe)
+                '''
+    except Exception as e:
+        return fail('load', e)
+
+    if not preprocessed:
+        try:
+            with stage('preprocess'):
+                df_previous = load_cleaned_dataset(ticker_code) if incremental and not streaming else None
+                if streaming:
+                    # Written to the store chunk by chunk, the frames below are read back from it
+                    preprocess_streaming(ticker_code, incremental = incremental)
+                    df_cleaned, df_train, df_test, exog_train, exog_test = load_splits(store_path)
+                elif df_previous is not None:
+                    df_cleaned, df_train, df_test, exog_train, exog_test = preprocess_incremental(df_previous, df)
+                else:
+                    df_cleaned, df_train, df_test, exog_train, exog_test = preprocess_dataset(df)
+
+                '''
+                -> args: df (and the previous df_cleaned in incremental mode, only new rows get features)
+                -> return: df_cleaned, df_train, df_test, exog_train, exog_test
+                '''
+        except Exception as e:
+            return fail('preprocess', e)
+
+        try:
+            with stage('store'):
+                if not streaming:
+                    store_dataframe(df_cleaned, df_train, df_test, exog_train, exog_test, ticker_code)
+                '''
+                -> args: df_cleaned, df_train, df_test, exog_train, exog_test, ticker_code
+                -> return: None'''
+                remember('preprocess', preprocess_key, {'df_cleaned': store_path})
+        except Exception as e:
+            return fail('store', e)
+
+    order = (1,0,1)
+    if order_search is not None:
+        try:
+            with stage('order_search'):
+                # Pool size and tracking do not change the selected order
+                search_key = ArtifactCache.key('order_search', data = preprocess_key,
+                                               **{name: value for name, value in order_search.items() if name not in ('workers', 'log_mlflow')})
+                searched = lookup('order_search', search_key, {})
+                if searched:
+                    order, exog_columns = tuple(searched['order']), searched['exog']
+                else:
+                    df_search = search_order(df_train, df_test, exog_train, exog_test, ticker_code = ticker_code,
+                                             **{'log_mlflow': not headless, **order_search})
+                    order, exog_columns = tuple(int(value) for value in df_search['order'].iloc[0]), list(df_search['exog'].iloc[0])
+                    '''
+                    -> args: df_train, df_test, exog_train, exog_test, ticker_code, search space and pool options
+                    -> return: candidates ranked best first
+                    '''
+                    remember('order_search', search_key, {}, {'order': order, 'exog': exog_columns})
+                exog_train, exog_test = exog_train[exog_columns], exog_test[exog_columns]
+        except Exception as e:
+            return fail('order_search', e)
+
+    model_folder = ticker_path("models", ticker_code)
+    model_paths = {name: os.path.join(model_folder, name) for name in ['arima_model.pkl', 'arima_state.npz']}
+    train_key = ArtifactCache.key('train', data = preprocess_key, order = list(order), exog = exog_train.columns.tolist())
+    try:
+        with stage('train'):
+            trained = lookup('train', train_key, model_paths)
+            if trained:
+                # The NumPy state is enough for the forecast table, statsmodels is not imported
+                model_arima = ArimaState.load(model_paths['arima_state.npz'])
+                rmse_arima, rmse_arima_original_scale = trained['rmse'], trained['rmse_original_scale']
+            else:
+                model_arima, rmse_arima, rmse_arima_original_scale = train_model(df_train, df_test, exog_train, exog_test, ticker_code, order,
+                                                                                 log_mlflow = not headless, plot = not headless)
+            status['order'] = order
+            status['rmse'] = float(rmse_arima)
+            status['rmse_original_scale'] = float(rmse_arima_original_scale)
+            '''
+            -> args: df_train, df_test, exog_train, exog_test, ticker_code, order
+            -> return: model_arima, rmse_arima, rmse_arima_original_scale
+            '''
+    except Exception as e:
+        return fail('train', e)
+
+    if not trained:
+        try:
+            with stage('save'):
+                save_model(model_arima, ticker_code)
+                '''
+                -> args: model_arima, ticker_code
+                -> return: None
+                '''
+                remember('train', train_key, model_paths, {'rmse': status['rmse'], 'rmse_original_scale': status['rmse_original_scale']})
+        except Exception as e:
+            return fail('save', e)
+
+    table_path = os.path.join(model_folder, 'forecast_table.npy')
+    table_key = ArtifactCache.key('forecast_table', data = preprocess_key, model = train_key, horizon = FORECAST_HORIZON,
+                                  exog_window = FORECAST_EXOG_WINDOW)
+    try:
+        with stage('forecast_table'):
+            if not lookup('forecast_table', table_key, {'forecast_table': table_path}):
+                export_forecast_table(model_arima, df_cleaned, ticker_code)
+                '''
+                -> args: model_arima, df_cleaned, ticker_code
+                -> return: None
+                '''
+                remember('forecast_table', table_key, {'forecast_table': table_path})
+    except Exception as e:
+        return fail('forecast_table', e)
+
+    try:
+        with stage('publish'):
+            # The backend serves, and POST /update appends to, its own copy next to the model: later runs and
+            # cache restores of the training store never change the data the published model absorbed
+            copy_store(store_path, os.path.join(model_folder, 'df_served'))
+    except Exception as e:
+        return fail('publish', e)
+
+    status['status'] = 'ok'
+    status['seconds'] = time.perf_counter() - started
+    logging.info(f'{ticker_code} pipeline completed in {status["seconds"]:.1f}s')
+    return status
+
+if __name__ == '__main__':
+    try:
+        logging.info('Initializing Ticker Code and Date Range')
+        ticker_code = input('Input the stock name (ex. TSLA, NVDA, ^GSPC, etc): ').strip().upper()
+        start_date = input('Input start date (YYYY-MM-DD):')
+        end_date = input('Input end date (YYYY-MM-DD):')
+        incremental = input('Only fetch bars after the last stored date? (y/N):').strip().lower() == 'y'
+        if not ticker_code:
+            ticker_code = 'NVDA'
+        if not start_date:
+            start_date = datetime(2019,10,5)
+        if not end_date: 
+            end_date = start_date + relativedelta(years = 5)
+        run_pipeline(ticker_code, start_date, end_date, incremental = incremental)
+    except Exception as e:
+        logging.error(CustomException(e,sys))
+    
+
+
+
+
+
@@ -0,0 +1,182 @@
+from utils.logger import logging
+from utils.exception import CustomException
+from .tracking import get_tracker
+import sys
+import os
+import time
+import itertools
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+import numpy as np
+
+import warnings
+warnings.filterwarnings("ignore")
+
+# Default search space, the served model uses (1,0,1) with every exogenous feature
+P_VALUES = [0, 1, 2]
+D_VALUES = [0]
+Q_VALUES = [0, 1, 2]
+
+# Data shared with the worker processes, set once per worker by _init_worker
+_search_data = {}
+
+
+def candidate_name(order, exog_columns, all_columns):
+    p, d, q = order
+    name = f'p{p}_d{d}_q{q}'
+    if list(exog_columns) != list(all_columns):
+        name += '_' + '-'.join(exog_columns) if exog_columns else '_noexog'
+    return name
+
+def candidate_grid(p_values, d_values, q_values, exog_subsets, all_columns):
+    candidates = []
+    for order in itertools.product(p_values, d_values, q_values):
+        for exog_columns in exog_subsets:
+            candidates.append({'name': candidate_name(order, exog_columns, all_columns),
+                               'order': tuple(order), 'exog': list(exog_columns)})
+    return candidates
+
+def _init_worker(search_data):
+    _search_data.update(search_data)
+
+def fit_candidate(candidate, maxiter, holdout = False):
+    '''
+    -> args: candidate (name, order, exog), maxiter (optimizer iteration cap), holdout (compute test RMSE)
+    -> return: dict with aic, bic, llf, converged, rmse (holdout only), seconds, error
+    '''
+    from statsmodels.tsa.arima.model import ARIMA
+
+    result = {'name': candidate['name'], 'aic': np.nan, 'bic': np.nan, 'llf': np.nan,
+              'converged': False, 'rmse': np.nan, 'seconds': np.nan, 'error': None}
+    started = time.perf_counter()
+    try:
+        columns = [_search_data['columns'].index(column) for column in candidate['exog']]
+        exog_train = _search_data['exog_train'][:, columns] if columns else None
+        model_arima = ARIMA(_search_data['y_train'], order = candidate['order'], exog = exog_train).fit(
+            method_kwargs = {'maxiter': maxiter}, low_memory = True, cov_type = 'none')
+        result['aic'] = float(model_arima.aic)
+        result['bic'] = float(model_arima.bic)
+        result['llf'] = float(model_arima.llf)
+        result['converged'] = bool((model_arima.mle_retvals or {}).get('converged', False))
+        if holdout:
+            exog_test = _search_data['exog_test'][:, columns] if columns else None
+            y_pred = model_arima.get_forecast(steps = len(_search_data['y_test']), exog = exog_test).predicted_mean
+            result['rmse'] = float(np.sqrt(np.mean((_search_data['y_test'] - np.asarray(y_pred)) ** 2)))
+    except Exception as e:
+        result['error'] = str(e)
+    result['seconds'] = time.perf_counter() - started
+    return result
+
+def _map(candidates, maxiter, holdout, executor):
+    if executor is None:
+        return [fit_candidate(candidate, maxiter, holdout) for candidate in candidates]
+    futures = [executor.submit(fit_candidate, candidate, maxiter, holdout) for candidate in candidates]
+    return [future.result() for future in futures]
+
+def search_order(df_train, df_test, exog_train, exog_test,
+                 p_values = P_VALUES, d_values = D_VALUES, q_values = Q_VALUES, exog_subsets = None,
+                 workers = None, screen_maxiter = 10, maxiter = 50, prune_margin = 10.0, rank_by = 'aic',
+                 log_mlflow = True, ticker_code = 'NVDA'):
+    '''
+    Two-pass (p,d,q) / exog subset search over a process pool.
+    1. Screening: every candidate is fitted with at most screen_maxiter optimizer iterations.
+    2. Pruning: candidates whose screening AIC is more than prune_margin above the best one
+       (a likelihood ratio threshold) or that failed are dropped.
+    3. Full fit of the survivors with maxiter iterations and holdout RMSE on the test split.
+    -> args: train/test frames, search space, workers (1 runs in process), rank_by (aic, bic or rmse)
+    -> return: dataframe of every candidate sorted by rank_by, pruned ones last
+    '''
+    try:
+        all_columns = exog_train.columns.tolist()
+        exog_subsets = exog_subsets or [all_columns]
+        candidates = candidate_grid(p_values, d_values, q_values, exog_subsets, all_columns)
+        search_data = {
+            'columns': all_columns,
+            'y_train': df_train['close_log_diff'].to_numpy(dtype = 'float64'),
+            'y_test': df_test['close_log_diff'].to_numpy(dtype = 'float64'),
+            'exog_train': exog_train.to_numpy(dtype = 'float64'),
+            'exog_test': exog_test.to_numpy(dtype = 'float64')}
+        workers = workers or os.cpu_count()
+        logging.info(f'{ticker_code} order search over {len(candidates)} candidates on {workers} workers')
+        started = time.perf_counter()
+
+        executor = None
+        if workers > 1:
+            executor = ProcessPoolExecutor(max_workers = workers, initializer = _init_worker, initargs = (search_data,))
+        else:
+            _init_worker(search_data)
+        try:
+            screened = _map(candidates, screen_maxiter, False, executor)
+            best_aic = np.nanmin([result['aic'] for result in screened] or [np.nan])
+            survivors = [candidate for candidate, result in zip(candidates, screened)
+                         if result['error'] is None and result['aic'] <= best_aic + prune_margin]
+            logging.info(f'{len(survivors)}/{len(candidates)} candidates kept after screening (best AIC {best_aic:.2f})')
+            fitted = {result['name']: result for result in _map(survivors, maxiter, True, executor)}
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+        rows = []
+        for candidate, screen in zip(candidates, screened):
+            row = fitted.get(candidate['name'], screen)
+            row.update({'order': candidate['order'], 'exog': candidate['exog'],
+                        'pruned': candidate['name'] not in fitted, 'screen_aic': screen['aic']})
+            rows.append(row)
+        df_results = pd.DataFrame(rows).sort_values(['pruned', rank_by]).reset_index(drop = True)
+        logging.info(f'Order search completed in {time.perf_counter() - started:.1f}s, best candidate {df_results["name"].iloc[0]}')
+
+        if log_mlflow:
+            log_search(df_results, ticker_code, rank_by)
+        return df_results
+    except Exception as e:
+        logging.error(CustomException(e,sys))
+        raise CustomException(e,sys)
+
+def log_search(df_results, ticker_code, rank_by):
+    # One parent run, the tracking writer sends every candidate in batched calls instead of one request per value
+    params = {'ticker': ticker_code, 'rank_by': rank_by, 'candidates': len(df_results),
+              'best_candidate': df_results['name'].iloc[0], 'best_order': df_results['order'].iloc[0]}
+    metrics = {}
+    for row in df_results.itertuples():
+        params[f'{row.name}/pruned'] = row.pruned
+        for key in ['aic', 'bic', 'rmse', 'screen_aic', 'seconds']:
+            value = getattr(row, key)
+            if pd.notna(value):
+                metrics[f'{row.name}/{key}'] = value
+    with get_tracker().start_run(run_name = f'{ticker_code} order search',
+                                 tags = {'Training Info': f'ARIMA order search for {ticker_code} stock price'}) as run:
+        run.log_params(params)
+        run.log_metrics(metrics)
+    logging.info(f'Order search of {ticker_code} queued for MLflow')
+
+
+if __name__ == '__main__':
+    from .train_model import load_preprocessed_dataset
+
+    parser = argparse.ArgumentParser(description = 'Search ARIMA orders on the stored train/test split')
+    parser.add_argument('--ticker', default = 'NVDA')
+    parser.add_argument('--p', type = int, nargs = '+', default = P_VALUES)
+    parser.add_argument('--d', type = int, nargs = '+', default = D_VALUES)
+    parser.add_argument('--q', type = int, nargs = '+', default = Q_VALUES)
+    parser.add_argument('--exog-subsets', nargs = '+', help = 'Comma separated column lists, "none" for no exog, "all" for every column (default: all)')
+    parser.add_argument('--workers', type = int, default = None)
+    parser.add_argument('--screen-maxiter', type = int, default = 10)
+    parser.add_argument('--maxiter', type = int, default = 50)
+    parser.add_argument('--prune-margin', type = float, default = 10.0)
+    parser.add_argument('--rank-by', choices = ['aic', 'bic', 'rmse'], default = 'aic')
+    parser.add_argument('--no-mlflow', action = 'store_true')
+    args = parser.parse_args()
+
+    df_train, df_test, exog_train, exog_test = load_preprocessed_dataset(args.ticker)
+    exog_subsets = None
+    if args.exog_subsets:
+        all_columns = exog_train.columns.tolist()
+        exog_subsets = [[] if subset == 'none' else all_columns if subset == 'all' else subset.split(',')
+                        for subset in args.exog_subsets]
+    df_results = search_order(df_train, df_test, exog_train, exog_test, args.p, args.d, args.q, exog_subsets,
+                              workers = args.workers, screen_maxiter = args.screen_maxiter, maxiter = args.maxiter,
+                              prune_margin = args.prune_margin, rank_by = args.rank_by,
+                              log_mlflow = not args.no_mlflow, ticker_code = args.ticker)
+    print(df_results[['name', 'aic', 'bic', 'rmse', 'converged', 'pruned', 'seconds']].to_string())
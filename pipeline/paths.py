@@ -0,0 +1,18 @@
+import os
+
+DATA_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__),"..","data"))
+
+
+def ticker_slug(ticker_code):
+    # NVDA -> nvda, ^GSPC -> gspc
+    return ticker_code.lower().replace("^","")
+
+def ticker_path(kind, ticker_code, create = True):
+    '''
+    -> args: kind (processed, models, visualizations), ticker_code
+    -> return: data/<kind>/<ticker> folder, so runs of different tickers never share a file
+    '''
+    folder_path = os.path.join(DATA_PATH, kind, ticker_slug(ticker_code))
+    if create:
+        os.makedirs(folder_path, exist_ok = True)
+    return folder_path
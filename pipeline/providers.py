@@ -0,0 +1,62 @@
+from utils.logger import logging
+from .paths import ticker_slug
+import os
+
+import pandas as pd
+
+PRICE_COLUMNS = ['Open', 'High', 'Low', 'Close', 'Adj Close', 'Volume']
+
+
+def stock_file_name(ticker_code):
+    return f'{ticker_slug(ticker_code)}_stock_prices.csv'
+
+
+class MarketDataProvider:
+    '''
+    Source of daily bars. fetch() returns a dataframe indexed by 'Date' with PRICE_COLUMNS,
+    covering start_date (inclusive) to end_date (exclusive), the same convention as yf.download.
+    '''
+    name = None
+
+    def fetch(self, ticker_code, start_date, end_date):
+        raise NotImplementedError
+
+
+class YahooProvider(MarketDataProvider):
+    name = 'yahoo'
+
+    def fetch(self, ticker_code, start_date, end_date):
+        import yfinance as yf
+        df = yf.download(ticker_code, start = start_date, end = end_date, progress = False)
+        # Recent yfinance versions return (field, ticker) columns even for a single ticker
+        if isinstance(df.columns, pd.MultiIndex):
+            df.columns = df.columns.get_level_values(0)
+        df.index.name = 'Date'
+        return df[[column for column in PRICE_COLUMNS if column in df.columns]]
+
+
+class CsvProvider(MarketDataProvider):
+    '''
+    Reads bars from local files named like the raw dataset (<ticker>_stock_prices.csv),
+    used as an offline stand-in for Yahoo (fixtures, mirrors, backfills).
+    '''
+    name = 'csv'
+
+    def __init__(self, folder_path):
+        self.folder_path = folder_path
+
+    def fetch(self, ticker_code, start_date, end_date):
+        file_path = os.path.join(self.folder_path, stock_file_name(ticker_code))
+        df = pd.read_csv(file_path, index_col = 'Date', parse_dates = ['Date'], float_precision = 'round_trip')
+        mask = (df.index >= pd.Timestamp(start_date)) & (df.index < pd.Timestamp(end_date))
+        logging.info(f'{int(mask.sum())} rows of {ticker_code} read from {file_path}')
+        return df.loc[mask]
+
+
+PROVIDERS = {
+    YahooProvider.name: YahooProvider,
+    CsvProvider.name: CsvProvider}
+
+
+def get_provider(name = 'yahoo', **kwargs):
+    return PROVIDERS[name](**kwargs)
@@ -0,0 +1,116 @@
+from utils.logger import logging
+from utils.exception import CustomException
+from utils.metrics import REGISTRY, observe_span
+import sys
+import os
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from .main import run_pipeline
+from .train_model import HEADLESS
+from .cache import STAGE_GRAPH
+from .providers import CsvProvider
+
+from datetime import datetime
+from dateutil.relativedelta import relativedelta
+
+
+def run_ticker(ticker_code, start_date, end_date, incremental = False, provider = None, order_search = None, headless = HEADLESS,
+               cache = None, force = (), streaming = False):
+    # Runs in a worker process, never let an exception escape and kill the pool
+    try:
+        return run_pipeline(ticker_code, start_date, end_date, incremental = incremental, provider = provider,
+                            order_search = order_search, headless = headless, cache = cache, force = force, streaming = streaming)
+    except Exception as e:
+        logging.error(CustomException(e,sys))
+        return {'ticker': ticker_code, 'status': 'failed', 'stage': None, 'error': str(e), 'order': None,
+                'rmse': None, 'rmse_original_scale': None, 'seconds': None, 'stages': {}, 'cached': []}
+
+def record_status(status):
+    # Stage spans are measured in the worker processes, bring them into this process' registry
+    for stage, seconds in status.get('stages', {}).items():
+        if seconds is not None:
+            observe_span(f'pipeline_{stage}', seconds, error = stage == status['stage'])
+    REGISTRY.counter('pipeline_runs_total', 'Ticker pipeline runs by outcome', status = status['status']).inc()
+    if status['seconds'] is not None:
+        REGISTRY.histogram('pipeline_duration_seconds', 'Ticker pipeline duration').observe(status['seconds'])
+
+def run_universe(tickers, start_date, end_date, workers = None, incremental = False, provider = None, order_search = None,
+                 headless = HEADLESS, cache = None, force = (), streaming = False):
+    '''
+    -> args: tickers (list of ticker codes), start_date, end_date,
+       workers (process count, default: number of CPUs), incremental, provider (picklable, default Yahoo),
+       order_search (search_order arguments, the search runs serially inside each ticker process),
+       headless (skip plots and MLflow tracking), cache, force and streaming (see run_pipeline)
+    -> return: list of per-ticker status dicts (see run_pipeline), in the order of tickers
+    '''
+    tickers = list(dict.fromkeys(ticker.strip().upper() for ticker in tickers if ticker.strip()))
+    workers = workers or os.cpu_count()
+    if order_search is not None:
+        # Tickers already use every worker, do not nest a second pool per ticker
+        order_search = {**order_search, 'workers': 1}
+    logging.info(f'Running pipeline for {len(tickers)} tickers on {workers} workers')
+    started = time.perf_counter()
+    statuses = {}
+    with ProcessPoolExecutor(max_workers = workers) as executor:
+        futures = {executor.submit(run_ticker, ticker, start_date, end_date, incremental, provider, order_search, headless, cache, force, streaming): ticker for ticker in tickers}
+        for future in as_completed(futures):
+            ticker = futures[future]
+            try:
+                statuses[ticker] = future.result()
+            except Exception as e:
+                # Worker process died (e.g. out of memory)
+                logging.error(CustomException(e,sys))
+                statuses[ticker] = {'ticker': ticker, 'status': 'failed', 'stage': None, 'error': str(e), 'order': None,
+                                    'rmse': None, 'rmse_original_scale': None, 'seconds': None, 'stages': {}, 'cached': []}
+            record_status(statuses[ticker])
+            logging.info(f'{ticker}: {statuses[ticker]["status"]} ({len(statuses)}/{len(tickers)})')
+    failed = [ticker for ticker, status in statuses.items() if status['status'] != 'ok']
+    logging.info(f'{len(tickers) - len(failed)}/{len(tickers)} tickers completed in {time.perf_counter() - started:.1f}s')
+    if failed:
+        logging.error(f'Failed tickers: {failed}')
+    return [statuses[ticker] for ticker in tickers]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Run the training pipeline for many tickers in parallel')
+    parser.add_argument('tickers', nargs = '*', help = 'Ticker codes (ex. NVDA AMD ^GSPC)')
+    parser.add_argument('--tickers-file', help = 'File with one ticker code per line')
+    parser.add_argument('--start-date', default = '2019-10-05', help = 'YYYY-MM-DD')
+    parser.add_argument('--end-date', help = 'YYYY-MM-DD, default start date + 5 years')
+    parser.add_argument('--workers', type = int, default = None, help = 'Worker processes, default: number of CPUs')
+    parser.add_argument('--incremental', action = 'store_true', help = 'Only fetch and preprocess new bars')
+    parser.add_argument('--source-dir', help = 'Read bars from <ticker>_stock_prices.csv files in this folder instead of Yahoo')
+    parser.add_argument('--order-search', action = 'store_true', help = 'Select the ARIMA order per ticker (default grid)')
+    parser.add_argument('--headless', action = 'store_true', default = HEADLESS, help = 'No plots and no MLflow tracking (fastest)')
+    parser.add_argument('--force', nargs = '*', choices = list(STAGE_GRAPH), metavar = 'STAGE',
+                        help = f'Rerun these stages even when their output is cached, every stage without a name ({", ".join(STAGE_GRAPH)})')
+    parser.add_argument('--streaming', action = 'store_true', help = 'Preprocess the raw file by chunks (PREPROCESS_CHUNK_ROWS rows) with bounded memory')
+    parser.add_argument('--no-cache', action = 'store_true', help = 'Neither read nor write the stage cache')
+    parser.add_argument('--output', help = 'Write the per-ticker status list to this JSON file')
+    parser.add_argument('--metrics', help = 'Write stage latencies in the Prometheus text format to this file (node exporter textfile collector)')
+    args = parser.parse_args()
+
+    tickers = list(args.tickers)
+    if args.tickers_file:
+        with open(args.tickers_file) as f:
+            tickers += [line.strip() for line in f if line.strip() and not line.startswith('#')]
+    if not tickers:
+        parser.error('No tickers given')
+    start_date = datetime.strptime(args.start_date, '%Y-%m-%d')
+    end_date = datetime.strptime(args.end_date, '%Y-%m-%d') if args.end_date else start_date + relativedelta(years = 5)
+
+    provider = CsvProvider(args.source_dir) if args.source_dir else None
+    results = run_universe(tickers, start_date, end_date, workers = args.workers, incremental = args.incremental, provider = provider,
+                           order_search = {} if args.order_search else None, headless = args.headless,
+                           cache = False if args.no_cache else None, force = True if args.force == [] else (args.force or ()),
+                           streaming = args.streaming)
+    for status in results:
+        print(status)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent = 1)
+    if args.metrics:
+        REGISTRY.write_textfile(args.metrics)
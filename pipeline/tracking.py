@@ -0,0 +1,313 @@
+from utils.logger import logging
+from utils.exception import CustomException
+import sys
+import os
+import time
+import queue
+import atexit
+import shutil
+import weakref
+import tempfile
+import itertools
+import threading
+import multiprocessing.util
+
+# Experiment tracking off the training critical path: runs, params, metrics, tags, artifacts and models
+# are queued and a background thread writes them to the MLflow store in batches.
+#     run = get_tracker().start_run(run_name = 'NVDA', tags = {...})
+#     run.log_params({...}); run.log_metrics({...}); run.log_model(model_arima); run.end()
+# TRACKING_BACKEND=null (or log_mlflow = False) swaps in a tracker whose calls do nothing.
+
+EXPERIMENT_NAME = "MLflow Stock Forecast with ARIMA"
+TRACKING_BACKEND = os.environ.get('TRACKING_BACKEND', 'mlflow')
+# Seconds the writer gathers queued calls before a batch is written
+FLUSH_INTERVAL = float(os.environ.get('TRACKING_FLUSH_INTERVAL', 1.0))
+# Seconds a flush (and the flush at exit) waits for the writer
+FLUSH_TIMEOUT = float(os.environ.get('TRACKING_FLUSH_TIMEOUT', 120))
+# Limits of one MLflow log_batch call
+MAX_METRICS = 1000
+MAX_PARAMS = 100
+MAX_TAGS = 100
+
+
+class Run:
+    '''
+    Handle of a queued run, every method returns immediately.
+    Used as a context manager the run ends FINISHED, or FAILED when the block raises.
+    '''
+    def __init__(self, tracker, key):
+        self._tracker = tracker
+        self.key = key
+
+    def log_params(self, params):
+        self._tracker._put(self.key, 'params', {name: str(value) for name, value in params.items()})
+
+    def log_metrics(self, metrics, step = 0):
+        timestamp = int(time.time() * 1000)
+        self._tracker._put(self.key, 'metrics', [(name, float(value), timestamp, step) for name, value in metrics.items()])
+
+    def set_tags(self, tags):
+        self._tracker._put(self.key, 'tags', {name: str(value) for name, value in tags.items()})
+
+    def log_artifact(self, path, artifact_path = None):
+        # Copied now: the file may be rewritten (next ticker, next run) before the writer gets to it
+        staged_path = os.path.join(tempfile.mkdtemp(dir = self._tracker._staging_dir()), os.path.basename(path))
+        shutil.copyfile(path, staged_path)
+        self._tracker._put(self.key, 'artifact', (staged_path, artifact_path))
+
+    def log_model(self, model, artifact_path = 'model_arima', input_example = None, output_example = None):
+        # Serialized once by the writer, logging the same results object again reuses the files
+        self._tracker._put(self.key, 'model', (model, artifact_path, input_example, output_example))
+
+    def end(self, status = 'FINISHED'):
+        self._tracker._put(self.key, 'end', status)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.end('FAILED' if exc_type else 'FINISHED')
+        return False
+
+
+class NullRun(Run):
+    def __init__(self):
+        self.key = None
+
+    def log_params(self, params):
+        pass
+
+    def log_metrics(self, metrics, step = 0):
+        pass
+
+    def set_tags(self, tags):
+        pass
+
+    def log_artifact(self, path, artifact_path = None):
+        pass
+
+    def log_model(self, model, artifact_path = 'model_arima', input_example = None, output_example = None):
+        pass
+
+    def end(self, status = 'FINISHED'):
+        pass
+
+
+class NullTracker:
+    # Benchmarks, headless runs and TRACKING_BACKEND=null: nothing is queued, imported or written
+    def start_run(self, run_name = None, tags = None):
+        return NullRun()
+
+    def flush(self, timeout = None):
+        return True
+
+    def close(self, timeout = None):
+        return True
+
+
+class MlflowTracker:
+    '''
+    -> experiment_name: MLflow experiment of every run
+    -> flush_interval: seconds the writer gathers calls into one batch
+    MLflow itself is only imported by the writer thread, the tracking URI is MLflow's (MLFLOW_TRACKING_URI, ./mlruns by default).
+    '''
+    def __init__(self, experiment_name = EXPERIMENT_NAME, flush_interval = FLUSH_INTERVAL):
+        self.experiment_name = experiment_name
+        self.flush_interval = flush_interval
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self._pid = None
+        self._reset()
+
+    def _reset(self):
+        # Also called in a forked child: the parent's queue and writer thread are not usable there
+        self._queue = queue.Queue()
+        self._thread = None
+        self._staging = None
+        self._pid = os.getpid()
+
+    def start_run(self, run_name = None, tags = None):
+        key = next(self._ids)
+        self._put(key, 'start', (run_name, {name: str(value) for name, value in (tags or {}).items()}))
+        return Run(self, key)
+
+    def _staging_dir(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                self._reset()
+            if self._staging is None:
+                self._staging = tempfile.mkdtemp(prefix = 'tracking-')
+            return self._staging
+
+    def _put(self, key, kind, payload):
+        with self._lock:
+            if self._pid != os.getpid():
+                self._reset()
+            if self._thread is None:
+                self._thread = threading.Thread(target = self._run, name = 'tracking-writer', daemon = True)
+                self._thread.start()
+                # atexit covers the main process, Finalize the pool workers (they leave through os._exit)
+                atexit.register(self.close)
+                multiprocessing.util.Finalize(self, self.close, exitpriority = 10)
+        self._queue.put((key, kind, payload))
+
+    def flush(self, timeout = FLUSH_TIMEOUT):
+        '''
+        -> return: True once everything queued before the call is written, False on timeout
+        '''
+        if self._thread is None or self._pid != os.getpid():
+            return True
+        done = threading.Event()
+        self._queue.put((None, 'flush', done))
+        flushed = done.wait(timeout)
+        if not flushed:
+            logging.error(f'Tracking writer did not flush within {timeout}s, {self._queue.qsize()} calls pending')
+        return flushed
+
+    def close(self, timeout = FLUSH_TIMEOUT):
+        if self._thread is None or self._pid != os.getpid():
+            return True
+        flushed = self.flush(timeout)
+        self._queue.put((None, 'stop', None))
+        self._thread.join(timeout)
+        self._thread = None
+        if self._staging is not None:
+            shutil.rmtree(self._staging, ignore_errors = True)
+            self._staging = None
+        return flushed
+
+    def _run(self):
+        writer = _MlflowWriter(self.experiment_name)
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            # Gather until the interval is over, a flush is requested or the writer stops
+            while batch[-1][1] not in ('flush', 'stop'):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout = remaining))
+                except queue.Empty:
+                    break
+            writer.write(batch)
+            if batch[-1][1] == 'stop':
+                return
+
+
+class _MlflowWriter:
+    # Writer thread side: turns a batch of queued calls into as few MLflow requests as possible
+    def __init__(self, experiment_name):
+        self.experiment_name = experiment_name
+        self.client = None
+        self.experiment_id = None
+        self.run_ids = {}
+        self.pending = {}
+        self.models = {}
+        self.model_dir = None
+
+    def _connect(self):
+        if self.client is None:
+            from mlflow.tracking import MlflowClient
+            self.client = MlflowClient()
+            experiment = self.client.get_experiment_by_name(self.experiment_name)
+            if experiment is not None:
+                self.experiment_id = experiment.experiment_id
+            else:
+                try:
+                    self.experiment_id = self.client.create_experiment(self.experiment_name)
+                except Exception:
+                    # Another ticker process created the experiment at the same time
+                    self.experiment_id = self.client.get_experiment_by_name(self.experiment_name).experiment_id
+
+    def write(self, batch):
+        for key, kind, payload in batch:
+            try:
+                if kind in ('params', 'metrics', 'tags'):
+                    pending = self.pending.setdefault(key, {'params': {}, 'metrics': [], 'tags': {}})
+                    if kind == 'metrics':
+                        pending['metrics'] += payload
+                    else:
+                        pending[kind].update(payload)
+                    continue
+                if kind in ('flush', 'stop'):
+                    self._write_pending()
+                    if kind == 'flush':
+                        payload.set()
+                    elif self.model_dir is not None:
+                        shutil.rmtree(self.model_dir, ignore_errors = True)
+                    continue
+                if kind == 'start':
+                    self._connect()
+                    run_name, tags = payload
+                    self.run_ids[key] = self.client.create_run(self.experiment_id, tags = tags, run_name = run_name).info.run_id
+                    continue
+                # Artifacts, models and the end of a run come after the values logged before them
+                self._write_pending(key)
+                run_id = self.run_ids.get(key)
+                if kind == 'artifact':
+                    staged_path, artifact_path = payload
+                    try:
+                        if run_id is not None:
+                            self.client.log_artifact(run_id, staged_path, artifact_path)
+                    finally:
+                        shutil.rmtree(os.path.dirname(staged_path), ignore_errors = True)
+                elif kind == 'model' and run_id is not None:
+                    self._log_model(run_id, *payload)
+                elif kind == 'end' and run_id is not None:
+                    self.client.set_terminated(run_id, status = payload)
+                    del self.run_ids[key]
+            except Exception as e:
+                logging.error(CustomException(e,sys))
+        self._write_pending()
+
+    def _write_pending(self, key = None):
+        keys = [key] if key is not None else list(self.pending)
+        for run_key in keys:
+            pending = self.pending.pop(run_key, None)
+            run_id = self.run_ids.get(run_key)
+            if pending is None or run_id is None:
+                continue
+            from mlflow.entities import Metric, Param, RunTag
+            metrics = [Metric(name, value, timestamp, step) for name, value, timestamp, step in pending['metrics']]
+            params = [Param(name, value) for name, value in pending['params'].items()]
+            tags = [RunTag(name, value) for name, value in pending['tags'].items()]
+            try:
+                while metrics or params or tags:
+                    self.client.log_batch(run_id, metrics = metrics[:MAX_METRICS], params = params[:MAX_PARAMS], tags = tags[:MAX_TAGS])
+                    metrics, params, tags = metrics[MAX_METRICS:], params[MAX_PARAMS:], tags[MAX_TAGS:]
+            except Exception as e:
+                logging.error(CustomException(e,sys))
+
+    def _log_model(self, run_id, model, artifact_path, input_example, output_example):
+        entry = self.models.get(id(model))
+        if entry is None or entry[0]() is not model:
+            import mlflow.statsmodels
+            from mlflow.models.signature import infer_signature
+            signature = infer_signature(input_example, output_example) if input_example is not None else None
+            if self.model_dir is None:
+                self.model_dir = tempfile.mkdtemp(prefix = 'tracking-models-')
+            model_path = os.path.join(self.model_dir, str(len(os.listdir(self.model_dir))))
+            mlflow.statsmodels.save_model(model, model_path, signature = signature, input_example = input_example)
+            try:
+                reference = weakref.ref(model)
+            except TypeError:
+                reference = lambda: None
+            entry = (reference, model_path)
+            self.models[id(model)] = entry
+            # Files of collected models are not needed anymore
+            for model_id, (reference_other, path_other) in list(self.models.items()):
+                if reference_other() is None and model_id != id(model):
+                    shutil.rmtree(path_other, ignore_errors = True)
+                    del self.models[model_id]
+        self.client.log_artifacts(run_id, entry[1], artifact_path)
+
+
+_tracker = None
+
+def get_tracker():
+    # -> return: tracker of this process, chosen by TRACKING_BACKEND (mlflow or null)
+    global _tracker
+    if _tracker is None:
+        _tracker = NullTracker() if TRACKING_BACKEND == 'null' else MlflowTracker()
+    return _tracker
@@ -1,137 +1,174 @@
-from utils.logger import logging
-from utils.exception import CustomException
-import sys
-import os
-
-import pandas as pd
-import numpy as np
-import matplotlib.pyplot as plt
-import seaborn as sns
-from statsmodels.tsa.arima.model import ARIMA
-from sklearn.metrics import root_mean_squared_error
-import mlflow
-from mlflow.models.signature import infer_signature, ModelSignature
-from mlflow.types.schema import Schema, ColSpec, TensorSpec
-
-import warnings
-warnings.filterwarnings("ignore")
-
-
-def load_preprocessed_dataset():
-    logging.info('Train, Test and Exog Dataframe Initialization')
-    try:
-        folder_path = os.path.abspath(os.path.join(os.path.dirname(__file__),"..","data","processed"))
-        if os.path.exists(folder_path):
-            df_train = pd.read_csv(os.path.join(folder_path, 'df_train.csv'), index_col=0)
-            df_train.index = pd.to_datetime(df_train.index)
-            df_test = pd.read_csv(os.path.join(folder_path, 'df_test.csv'), index_col=0)
-            df_test.index = pd.to_datetime(df_test.index)
-            exog_train = pd.read_csv(os.path.join(folder_path, 'exog_train.csv'), index_col=0)
-            exog_train.index = pd.to_datetime(exog_train.index)
-            exog_test =pd.read_csv(os.path.join(folder_path, 'exog_test.csv'), index_col=0)
-            exog_test.index = pd.to_datetime(exog_test.index)
-            logging.info('Train, Test and Exog Dataframe Loaded Successfully')
-            print(df_train.shape, df_test.shape, exog_train.shape, exog_test.shape)
-        return df_train, df_test, exog_train, exog_test
-    except Exception as e:
-        logging.error(CustomException(e,sys))
-        raise CustomException(e,sys)
-
-def train_model(df_train, df_test, exog_train, exog_test):
-    logging.info('Training Model Initialization')
-    mlflow.statsmodels.autolog()
-    try:
-        mlflow.set_experiment("MLflow Stock Forecast with ARIMA")
-
-        # Start an MLflow run
-        with mlflow.start_run():
-            logging.info("Start Training Model")
-            try:
-                order = (1,0,1)
-                model_arima = ARIMA(df_train['close_log_diff'], order = order, exog = exog_train).fit() 
-                y_pred_arima = model_arima.get_forecast(steps = len(df_test), exog = exog_test).predicted_mean.values
-
-                df_pred_arima = pd.DataFrame({
-                    'close_pred': y_pred_arima}, index = df_test.index)
-
-                close_pred_original = np.exp(df_pred_arima['close_pred'].cumsum() + df_train['close_log'].iloc[-1])
-                df_pred_arima['close_pred_original_scale']= close_pred_original
-                rmse_arima = root_mean_squared_error(df_test['close_log_diff'], df_pred_arima['close_pred'])
-                rmse_arima_original_scale = root_mean_squared_error(df_test['close'], df_pred_arima['close_pred_original_scale'])
-                
-                # Log ARIMA order and loss metric
-                mlflow.log_param("ARIMA_order", order)
-                mlflow.log_metric("RMSE Score Scaled", rmse_arima)
-                mlflow.log_metric("RMSE Score Original Scale", rmse_arima_original_scale)
-
-                # Log Model with it's signature
-                input_example = pd.concat([df_train[['close_log_diff']],exog_train], axis = 1).iloc[[0]]
-                output_example = pd.DataFrame({'predicted_mean': [y_pred_arima[0]]})
-                signature = infer_signature(input_example, output_example)
-                mlflow.statsmodels.log_model(model_arima, artifact_path="model_arima", signature=signature, input_example = input_example)
-                logging.info('Model and Parameters Successufuly Stored in MLflow')
-
-            except Exception as e:
-                logging.info(CustomException(e,sys))
-        
-            try:
-                #Plotting
-                logging.info('Line Plot Comparison : Train vs Test vs Prediction Close Price')
-                plt.figure(figsize=(18, 6))
-                plt.title('ARIMA Model: Comparison of Training, Testing, and Predicted Close Price')
-                sns.lineplot(x=df_train.index, y=df_train['close'], label='Training Data (Close Price)')
-                sns.lineplot(x=df_test.index, y=df_test['close'], label='Test Data (Close Price)')
-                sns.lineplot(x=df_pred_arima.index, y=df_pred_arima['close_pred_original_scale'], label='Predicted Close Price')
-                plt.legend()
-
-                folder_path = os.path.abspath(os.path.join(os.path.dirname(__file__),"..","data","visualizations"))
-                image_name = 'arima_model_comparison.png'
-                if os.path.exists(folder_path):
-                    image_path = os.path.join(folder_path,image_name)
-                    plt.savefig(image_path) #Store lineplot to local folder
-                    mlflow.log_artifact(image_path) #Store lineplot to mlflow directory
-                    logging.info('Plot Successfully Saved to Local and MLflow Experiments')
-                else:
-                    logging.info(f'Creating {folder_path}')
-                    os.makedirs(folder_path)
-                    image_path = os.path.join(folder_path,image_name)
-                    plt.savefig(image_path) #Store lineplot to local folder
-                    mlflow.log_artifact(image_path) #Store lineplot to mlflow directory
-                    mlflow.log_figure()
-                    logging.info('Plot Successfully Saved to Local and MLflow Experiments')
-            except Exception as e:
-                logging.info(CustomException(e,sys))
-        
-            # Set a tag that we can use to remind ourselves what this run was for
-            mlflow.set_tag("Training Info", "ARIMA Model For NVIDIA stock price")
-            logging.info("Training pipeline completed successfully")
-
-        return model_arima, rmse_arima, rmse_arima_original_scale
-            
-    except Exception as e:
-        logging.error(CustomException(e,sys))
-  
-
-def save_model(model_arima):
-    try:
-        logging.info('ARIMA Model Saving Initialization ')
-        folder_path = os.path.abspath(os.path.join(os.path.dirname(__file__),"..","data","models"))
-        model_name = 'arima_model.pkl'
-        if os.path.exists(folder_path):
-            model_path = os.path.join(folder_path,model_name)
-            model_arima.save(model_path)
-            logging.info(f"Saved ARIMA Model to {model_path}")
-        else:
-            logging.error('Model Folder Path Not Found')
-    except Exception as e:
-        logging.error(CustomException(e,sys))
-
-
-if __name__ == '__main__':
-    df_train, df_test, exog_train, exog_test = load_preprocessed_dataset()
-    model_arima, rmse_arima, rmse_arima_original_scale = train_model(df_train, df_test, exog_train, exog_test)
-    print('RMSE Original Scale: ', rmse_arima_original_scale)
-    save_model(model_arima)
-
- 
+from utils.logger import logging
+from utils.exception import CustomException
+from utils.forecast import forecast_path, save_forecast_table
+from utils.store import load_splits
+from utils.arima_state import ArimaState
+from utils.downsample import downsample, PLOT_MAX_POINTS
+from .paths import ticker_path
+from .tracking import get_tracker, NullTracker
+import sys
+import os
+
+import pandas as pd
+import numpy as np
+
+import warnings
+warnings.filterwarnings("ignore")
+
+# statsmodels, matplotlib and seaborn take seconds to import: they are imported inside the functions
+# that use them, so ingestion, preprocessing and the backend never load them (MLflow is only imported
+# by the tracking writer thread, see tracking.py)
+
+# Business days covered by the precomputed forecast table served by the backend
+FORECAST_HORIZON = int(os.environ.get('FORECAST_HORIZON', 260))
+# Headless mode: train without the comparison plot and without MLflow tracking
+HEADLESS = os.environ.get('PIPELINE_HEADLESS', '0') == '1'
+
+
+def load_preprocessed_dataset(ticker_code = 'NVDA'):
+    logging.info(f'{ticker_code} Train, Test and Exog Dataframe Initialization')
+    try:
+        store_path = os.path.join(ticker_path("processed", ticker_code, create = False), "df_cleaned")
+        if os.path.exists(store_path):
+            df_cleaned, df_train, df_test, exog_train, exog_test = load_splits(store_path)
+            logging.info('Train, Test and Exog Dataframe Loaded Successfully')
+            print(df_train.shape, df_test.shape, exog_train.shape, exog_test.shape)
+        return df_train, df_test, exog_train, exog_test
+    except Exception as e:
+        logging.error(CustomException(e,sys))
+        raise CustomException(e,sys)
+
+def train_model(df_train, df_test, exog_train, exog_test, ticker_code = 'NVDA', order = (1,0,1), log_mlflow = not HEADLESS, plot = not HEADLESS):
+    '''
+    -> args: train/test frames, ticker_code, order, log_mlflow (queue the run for MLflow), plot (save the comparison plot),
+       both off by default in headless mode (PIPELINE_HEADLESS=1)
+    -> return: model_arima, rmse_arima, rmse_arima_original_scale
+    '''
+    from statsmodels.tsa.arima.model import ARIMA
+
+    logging.info(f'{ticker_code} Training Model Initialization')
+    # Tracking calls only queue, the writer thread sends them to MLflow while the next stages run
+    tracker = get_tracker() if log_mlflow else NullTracker()
+    try:
+        # Start an MLflow run
+        with tracker.start_run(run_name = ticker_code, tags = {'Training Info': f'ARIMA Model For {ticker_code} stock price'}) as run:
+            logging.info("Start Training Model")
+            try:
+                model_arima = ARIMA(df_train['close_log_diff'], order = order, exog = exog_train).fit() 
+                y_pred_arima = model_arima.get_forecast(steps = len(df_test), exog = exog_test).predicted_mean.values
+
+                df_pred_arima = pd.DataFrame({
+                    'close_pred': y_pred_arima}, index = df_test.index)
+
+                close_pred_original = np.exp(df_pred_arima['close_pred'].cumsum() + df_train['close_log'].iloc[-1])
+                df_pred_arima['close_pred_original_scale']= close_pred_original
+                rmse_arima = rmse(df_test['close_log_diff'], df_pred_arima['close_pred'])
+                rmse_arima_original_scale = rmse(df_test['close'], df_pred_arima['close_pred_original_scale'])
+                
+                # Log ARIMA order and loss metric
+                run.log_params({"ARIMA_order": order, "ticker": ticker_code})
+                run.log_metrics({"RMSE Score Scaled": rmse_arima, "RMSE Score Original Scale": rmse_arima_original_scale})
+
+                # Log Model with it's signature, serialized once by the writer (autolog would pickle it a second time)
+                input_example = pd.concat([df_train[['close_log_diff']],exog_train], axis = 1).iloc[[0]]
+                output_example = pd.DataFrame({'predicted_mean': [y_pred_arima[0]]})
+                run.log_model(model_arima, artifact_path="model_arima", input_example = input_example, output_example = output_example)
+                if log_mlflow:
+                    logging.info('Model and Parameters Queued for MLflow')
+
+            except Exception as e:
+                logging.info(CustomException(e,sys))
+        
+            if plot:
+                try:
+                    image_path = plot_predictions(df_train, df_test, df_pred_arima, ticker_code)
+                    run.log_artifact(image_path) #Store lineplot to mlflow directory
+                    logging.info('Plot Successfully Saved to Local and MLflow Experiments')
+                except Exception as e:
+                    logging.info(CustomException(e,sys))
+        
+            logging.info("Training pipeline completed successfully")
+
+        return model_arima, rmse_arima, rmse_arima_original_scale
+            
+    except Exception as e:
+        logging.error(CustomException(e,sys))
+  
+
+def rmse(y_true, y_pred):
+    return float(np.sqrt(np.mean((np.asarray(y_true) - np.asarray(y_pred)) ** 2)))
+
+def plot_predictions(df_train, df_test, df_pred_arima, ticker_code = 'NVDA', max_points = PLOT_MAX_POINTS):
+    '''
+    -> args: train/test frames, df_pred_arima (with close_pred_original_scale), ticker_code,
+       max_points (points drawn per series, downsampled keeping the shape, 0 draws every point)
+    -> return: path of the saved line plot
+    '''
+    import matplotlib
+    matplotlib.use('Agg') # Only saved to file, no display needed
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
+    logging.info('Line Plot Comparison : Train vs Test vs Prediction Close Price')
+    figure = plt.figure(figsize=(18, 6))
+    try:
+        plt.title('ARIMA Model: Comparison of Training, Testing, and Predicted Close Price')
+        series = [(df_train['close'], 'Training Data (Close Price)'), (df_test['close'], 'Test Data (Close Price)'),
+                  (df_pred_arima['close_pred_original_scale'], 'Predicted Close Price')]
+        for values, label in series:
+            values = downsample(values, max_points)
+            sns.lineplot(x=values.index, y=values, label=label)
+        plt.legend()
+
+        folder_path = ticker_path("visualizations", ticker_code)
+        image_path = os.path.join(folder_path, 'arima_model_comparison.png')
+        plt.savefig(image_path) #Store lineplot to local folder
+        return image_path
+    finally:
+        # Figures stay registered in pyplot until closed, one per training run otherwise
+        plt.close(figure)
+
+def save_model(model_arima, ticker_code = 'NVDA'):
+    try:
+        logging.info(f'{ticker_code} ARIMA Model Saving Initialization ')
+        folder_path = ticker_path("models", ticker_code)
+        model_name = 'arima_model.pkl'
+        if os.path.exists(folder_path):
+            model_path = os.path.join(folder_path,model_name)
+            model_arima.save(model_path)
+            logging.info(f"Saved ARIMA Model to {model_path}")
+            # NumPy-only serving artifact loaded by the backend
+            state_path = os.path.join(folder_path, 'arima_state.npz')
+            ArimaState.from_results(model_arima).save(state_path)
+            logging.info(f"Saved ARIMA serving state to {state_path}")
+        else:
+            logging.error('Model Folder Path Not Found')
+    except Exception as e:
+        logging.error(CustomException(e,sys))
+
+def export_forecast_table(model_arima, df, ticker_code = 'NVDA', horizon = FORECAST_HORIZON):
+    '''
+    -> args: model_arima, df (cleaned dataframe the model is served with), ticker_code, horizon (business days)
+    -> return: None, stores forecast_table.npy next to the saved model
+    '''
+    try:
+        logging.info(f'{ticker_code} Forecast Table Initialization for {horizon} business days')
+        folder_path = ticker_path("models", ticker_code)
+        if os.path.exists(folder_path):
+            forecast_table = forecast_path(model_arima, df, horizon)
+            save_forecast_table(forecast_table, os.path.join(folder_path, 'forecast_table.npy'))
+        else:
+            logging.error('Model Folder Path Not Found')
+    except Exception as e:
+        logging.error(CustomException(e,sys))
+
+
+if __name__ == '__main__':
+    df_train, df_test, exog_train, exog_test = load_preprocessed_dataset()
+    model_arima, rmse_arima, rmse_arima_original_scale = train_model(df_train, df_test, exog_train, exog_test)
+    print('RMSE Original Scale: ', rmse_arima_original_scale)
+    save_model(model_arima)
+    export_forecast_table(model_arima, pd.concat([df_train, df_test]))
+
+ 
     
\ No newline at end of file
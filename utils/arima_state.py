@@ -0,0 +1,153 @@
+import os
+
+import numpy as np
+
+# Serving artifact of a fitted ARIMA: the state space matrices, the exogenous coefficients and the
+# Kalman filter state after the last observation, saved as one small .npz file. Forecasting and
+# absorbing new observations only need NumPy, statsmodels is used when the artifact is exported.
+#     y[t] = exog[t] @ beta + Z a[t]          (with a leading 1 in exog[t] for the constant)
+#     a[t+1] = T a[t] + R eta[t],  eta ~ N(0, Q)
+
+STATE_ARRAYS = ['design', 'obs_cov', 'transition', 'selection', 'state_cov', 'beta', 'state', 'state_cov_matrix']
+
+
+def _cov_factor(cov):
+    # factor @ factor.T == cov, also for the singular state covariances of ARIMA (eigenvalues clipped at 0)
+    eigenvalues, eigenvectors = np.linalg.eigh((cov + cov.T) / 2)
+    return eigenvectors * np.sqrt(np.clip(eigenvalues, 0, None))
+
+
+class ArimaState:
+    '''
+    -> design (Z), obs_cov (H), transition (T), selection (R), state_cov (Q): state space matrices
+    -> beta: coefficients of exog_names ('const' first when the model has a constant)
+    -> state, state_cov_matrix: predicted state mean and covariance for the next observation
+    -> nobs: observations absorbed into the state, last_endog: last of them (to check the data lines up)
+    '''
+    def __init__(self, design, obs_cov, transition, selection, state_cov, beta, state, state_cov_matrix,
+                 exog_names, nobs, last_endog, order):
+        self.design = np.asarray(design, dtype = 'float64')
+        self.obs_cov = np.asarray(obs_cov, dtype = 'float64')
+        self.transition = np.asarray(transition, dtype = 'float64')
+        self.selection = np.asarray(selection, dtype = 'float64')
+        self.state_cov = np.asarray(state_cov, dtype = 'float64')
+        self.beta = np.asarray(beta, dtype = 'float64')
+        self.state = np.asarray(state, dtype = 'float64')
+        self.state_cov_matrix = np.asarray(state_cov_matrix, dtype = 'float64')
+        self.exog_names = [str(name) for name in exog_names]
+        self.nobs = int(nobs)
+        self.last_endog = float(last_endog)
+        self.order = tuple(int(value) for value in order)
+
+    @classmethod
+    def from_results(cls, model_arima):
+        # Export a fitted statsmodels ARIMA results object (only its attributes are read)
+        ssm = model_arima.filter_results
+        param_names = list(model_arima.model.param_names)
+        params = np.asarray(model_arima.params, dtype = 'float64')
+        exog_names = list(model_arima.model.exog_names or [])
+        trend = getattr(model_arima.model, 'trend', None)
+        if trend not in (None, 'n', 'c'):
+            raise ValueError(f'Trend {trend} is not supported by the serving artifact, only a constant')
+        return cls(
+            design = ssm.design[:, :, 0],
+            obs_cov = ssm.obs_cov[:, :, 0],
+            transition = ssm.transition[:, :, 0],
+            selection = ssm.selection[:, :, 0],
+            state_cov = ssm.state_cov[:, :, 0],
+            beta = params[[param_names.index(name) for name in exog_names]],
+            state = model_arima.predicted_state[:, -1],
+            state_cov_matrix = model_arima.predicted_state_cov[:, :, -1],
+            exog_names = exog_names,
+            nobs = model_arima.nobs,
+            last_endog = np.asarray(model_arima.model.endog)[-1, 0],
+            order = model_arima.model.order)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle = False) as artifact:
+            arrays = {name: artifact[name] for name in STATE_ARRAYS}
+            return cls(**arrays, exog_names = artifact['exog_names'].tolist(), nobs = artifact['nobs'],
+                       last_endog = artifact['last_endog'], order = artifact['order'])
+
+    def save(self, path):
+        # Write next to the final path and rename, readers never load a partial file
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, **{name: getattr(self, name) for name in STATE_ARRAYS},
+                     exog_names = np.array(self.exog_names, dtype = str), nobs = self.nobs,
+                     last_endog = self.last_endog, order = np.array(self.order))
+        os.replace(tmp_path, path)
+
+    @property
+    def features(self):
+        # Exogenous columns read from the dataframe, the constant is added here
+        return [name for name in self.exog_names if name != 'const']
+
+    def _intercept(self, exog):
+        # exog @ beta for every row, exog holds the feature columns only. Accumulated column by column in a
+        # fixed order rather than a BLAS product, whose rounding depends on the number of rows: a row gives
+        # the same bits in any horizon
+        exog = np.asarray(exog, dtype = 'float64').reshape(-1, len(self.features))
+        if 'const' in self.exog_names:
+            exog = np.column_stack([np.ones(len(exog)), exog])
+        intercept = np.zeros(len(exog))
+        for column, coefficient in zip(exog.T, self.beta):
+            intercept += column * coefficient
+        return intercept
+
+    def forecast(self, steps, exog = None):
+        '''
+        -> args: steps, exog (steps x features, same columns as self.features)
+        -> return: point forecasts, same as statsmodels get_forecast(steps, exog).predicted_mean
+        '''
+        intercept = self._intercept(exog) if self.exog_names else np.zeros(steps)
+        y_pred = np.empty(steps)
+        state = self.state
+        for h in range(steps):
+            y_pred[h] = intercept[h] + self.design[0] @ state
+            state = self.transition @ state
+        return y_pred
+
+    def simulate(self, steps, n_paths, seed = None):
+        '''
+        Deviations of simulated observations from the point forecast, every path drawn at once.
+        The state starts from N(state, state_cov_matrix) and is driven by N(0, state_cov) innovations.
+        -> args: steps, n_paths, seed (int or numpy Generator)
+        -> return: (n_paths x steps) array, add it to forecast(steps, exog) for simulated observations
+        '''
+        rng = np.random.default_rng(seed)
+        z = self.design[0]
+        # Factors of the (possibly singular) covariances: x @ factor.T ~ N(0, cov) for standard normal x
+        state_factor = _cov_factor(self.state_cov_matrix)
+        shock_factor = self.selection @ _cov_factor(self.state_cov)
+        deviations = np.empty((n_paths, steps))
+        state = rng.standard_normal((n_paths, len(self.state))) @ state_factor.T
+        for h in range(steps):
+            deviations[:, h] = state @ z
+            state = state @ self.transition.T + rng.standard_normal((n_paths, shock_factor.shape[1])) @ shock_factor.T
+        if self.obs_cov[0, 0] > 0:
+            deviations += np.sqrt(self.obs_cov[0, 0]) * rng.standard_normal((n_paths, steps))
+        return deviations
+
+    def update(self, endog, exog = None):
+        '''
+        Kalman filter the new observations with the parameters unchanged.
+        -> args: endog (new observations), exog (rows x features)
+        -> return: new ArimaState with the state after the last new observation
+        '''
+        endog = np.asarray(endog, dtype = 'float64')
+        intercept = self._intercept(exog) if self.exog_names else np.zeros(len(endog))
+        state, cov = self.state, self.state_cov_matrix
+        state_noise = self.selection @ self.state_cov @ self.selection.T
+        z = self.design[0]
+        for y, d in zip(endog, intercept):
+            gain = cov @ z
+            variance = z @ gain + self.obs_cov[0, 0]
+            state = state + gain * (y - d - z @ state) / variance
+            cov = cov - np.outer(gain, gain) / variance
+            state = self.transition @ state
+            cov = self.transition @ cov @ self.transition.T + state_noise
+        return ArimaState(self.design, self.obs_cov, self.transition, self.selection, self.state_cov, self.beta,
+                          state, cov, self.exog_names, self.nobs + len(endog),
+                          endog[-1] if len(endog) else self.last_endog, self.order)
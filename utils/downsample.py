@@ -0,0 +1,85 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+# Shape preserving downsampling of the series drawn by the training plot.
+# Renderer (matplotlib) cost grows with the points, not with the pixels:
+# a few thousand well chosen points look the same as years of daily or intraday closes.
+#     lttb   -> Largest Triangle Three Buckets, one point per bucket keeping the visual shape (default)
+#     minmax -> lowest and highest point of every bucket, keeps every spike (2 points per bucket)
+# PLOT_MAX_POINTS=0 draws every point.
+
+# Points kept per drawn series
+PLOT_MAX_POINTS = int(os.environ.get('PLOT_MAX_POINTS', 2000))
+# lttb or minmax
+PLOT_DOWNSAMPLE = os.environ.get('PLOT_DOWNSAMPLE', 'lttb')
+
+
+def _bucket_edges(start, stop, n_buckets):
+    # n_buckets contiguous ranges [edges[k], edges[k + 1]) covering start..stop
+    return np.linspace(start, stop, n_buckets + 1).astype('int64')
+
+def lttb(x, y, n_out):
+    '''
+    -> args: x, y (numeric arrays, x increasing), n_out (points kept, first and last included)
+    -> return: sorted indices of the kept points
+    '''
+    n = len(y)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype = 'float64')
+    y = np.asarray(y, dtype = 'float64')
+    # Inner points split in n_out - 2 buckets, the first and last points are always kept
+    edges = _bucket_edges(1, n - 1, n_out - 2)
+    sizes = np.diff(edges)
+    # Mean point of every bucket, and of the last point after the last bucket
+    x_mean = np.append(np.add.reduceat(x[1:n - 1], edges[:-1] - 1) / sizes, x[-1])
+    y_mean = np.append(np.add.reduceat(y[1:n - 1], edges[:-1] - 1) / sizes, y[-1])
+    selected = np.empty(n_out, dtype = 'int64')
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for k in range(n_out - 2):
+        lo, hi = edges[k], edges[k + 1]
+        # Point of the bucket making the largest triangle with the previous kept point and the next bucket mean
+        area = np.abs((x[a] - x_mean[k + 1]) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (y_mean[k + 1] - y[a]))
+        a = lo + int(np.argmax(area))
+        selected[k + 1] = a
+    return selected
+
+def minmax(y, n_out):
+    '''
+    -> args: y (numeric array), n_out (points kept, about 2 per bucket)
+    -> return: sorted indices of the first and last points and the lowest and highest point of every bucket
+    '''
+    n = len(y)
+    if n_out >= n or n_out < 4:
+        return np.arange(n)
+    y = np.asarray(y, dtype = 'float64')
+    edges = _bucket_edges(0, n, (n_out - 2) // 2)
+    sizes = np.diff(edges)
+    bucket = np.repeat(np.arange(len(sizes)), sizes)
+    kept = [np.array([0, n - 1])]
+    for reduce in (np.minimum, np.maximum):
+        # First point of every bucket equal to its min/max
+        matches = np.flatnonzero(y == np.repeat(reduce.reduceat(y, edges[:-1]), sizes))
+        _, first = np.unique(bucket[matches], return_index = True)
+        kept.append(matches[first])
+    return np.unique(np.concatenate(kept))
+
+def downsample(series, max_points = PLOT_MAX_POINTS, method = PLOT_DOWNSAMPLE):
+    '''
+    -> args: series (pandas Series, datetime or numeric index), max_points (0 keeps every point), method (lttb or minmax)
+    -> return: the rows of series to draw, missing values dropped
+    '''
+    series = series.dropna()
+    if not max_points or len(series) <= max_points:
+        return series
+    if method == 'minmax':
+        return series.iloc[minmax(series.to_numpy(), max_points)]
+    if method != 'lttb':
+        raise ValueError(f'Unknown downsampling method {method}, lttb or minmax')
+    index = series.index
+    x = index.asi8 if isinstance(index, pd.DatetimeIndex) else (
+        index.to_numpy() if pd.api.types.is_numeric_dtype(index) else np.arange(len(series)))
+    return series.iloc[lttb(x, series.to_numpy(), max_points)]
@@ -0,0 +1,76 @@
+import numpy as np
+import pandas as pd
+
+LAGS = 3
+ROLLING_WINDOW = 5
+FEATURE_COLUMNS = ['close', 'year', 'month', 'day', 'close_log', 'close_log_diff'] + \
+    [f'lag_{lag}' for lag in range(1, LAGS + 1)] + ['rolling_mean']
+# Leading rows without features. The original preprocessing dropped the NaNs left by the diff
+# and then again after every lag, so the history starts 1 + (1+2+3) + (5-1) = 11 rows in
+WARMUP_ROWS = 1 + sum(range(1, LAGS + 1)) + ROLLING_WINDOW - 1
+# Diffs to carry between updates: enough for the lags and the rolling window
+TAIL_SIZE = max(LAGS, ROLLING_WINDOW - 1)
+
+
+class FeatureEngine:
+    '''
+    Builds the model features (log close, log diff, lags, rolling mean) from closing prices,
+    keeping only the tail state needed to continue: the last log close and the last TAIL_SIZE diffs.
+    Feeding the history in one call or in any number of appended pieces gives identical rows.
+    '''
+    def __init__(self, last_close_log = None, diffs = (), rows_seen = 0):
+        self.last_close_log = last_close_log
+        self.diffs = np.asarray(diffs, dtype = 'float64')[-TAIL_SIZE:]
+        self.rows_seen = rows_seen
+
+    @classmethod
+    def from_features(cls, df):
+        # Resume after an already processed dataframe (output of update or preprocess_dataset)
+        return cls(
+            last_close_log = df['close_log'].iloc[-1],
+            diffs = df['close_log_diff'].values[-TAIL_SIZE:],
+            rows_seen = max(WARMUP_ROWS, len(df)))
+
+    def update(self, df_new):
+        '''
+        -> args: df_new (new rows with 'date' and 'close' columns, in date order)
+        -> return: feature rows for df_new indexed by date, warm-up rows excluded
+        '''
+        dates = pd.DatetimeIndex(pd.to_datetime(df_new['date']), name = 'date')
+        close = df_new['close'].to_numpy(dtype = 'float64')
+        n = len(close)
+
+        close_log = np.log(close)
+        previous = np.empty(n)
+        if n:
+            previous[0] = np.nan if self.last_close_log is None else self.last_close_log
+            previous[1:] = close_log[:-1]
+        close_log_diff = close_log - previous
+
+        # Carried diffs (NaN padded while warming up) followed by the new ones
+        history = np.concatenate([
+            np.full(TAIL_SIZE - len(self.diffs), np.nan), self.diffs, close_log_diff])
+        lags = {lag: history[TAIL_SIZE - lag:TAIL_SIZE - lag + n] for lag in range(1, TAIL_SIZE + 1)}
+
+        # Same summation order for every row, whatever the chunking
+        rolling_sum = close_log_diff
+        for lag in range(1, ROLLING_WINDOW):
+            rolling_sum = rolling_sum + lags[lag]
+
+        df = pd.DataFrame({
+            'close': close,
+            'year': dates.year,
+            'month': dates.month,
+            'day': dates.day,
+            'close_log': close_log,
+            'close_log_diff': close_log_diff}, index = dates)
+        for lag in range(1, LAGS + 1):
+            df[f'lag_{lag}'] = lags[lag]
+        df['rolling_mean'] = rolling_sum / ROLLING_WINDOW
+
+        skip = min(max(WARMUP_ROWS - self.rows_seen, 0), n)
+        if n:
+            self.last_close_log = close_log[-1]
+            self.diffs = history[-TAIL_SIZE:]
+        self.rows_seen += n
+        return df.iloc[skip:]
@@ -0,0 +1,125 @@
+from utils.logger import logging
+from utils.metrics import span
+from utils.arima_state import ArimaState
+import os
+
+import numpy as np
+import pandas as pd
+
+# Forecast table layout: one row per business day after the last observed date
+FORECAST_TABLE_DTYPE = np.dtype([
+    ('date', 'datetime64[D]'),
+    ('close_pred', 'f8'),
+    ('close_pred_original_scale', 'f8')])
+
+TARGET_COLUMNS = ['close', 'close_log', 'close_log_diff']
+
+# Last observed rows repeated as the future exogenous values, whatever the horizon: row k of every
+# forecast path uses the same past row, so a date gets the same prediction from any horizon
+FORECAST_EXOG_WINDOW = int(os.environ.get('FORECAST_EXOG_WINDOW', 260))
+
+
+def forecast_origin(df):
+    # First business day after the last observed date, every forecast path starts here
+    last_date = np.datetime64(pd.Timestamp(df.index[-1]).date(), 'D')
+    return np.busday_offset(last_date, 1, roll = 'forward')
+
+
+def model_features(model_arima, df):
+    # Exog columns the model was fitted on: ArimaState.features, statsmodels exog_names without the constant
+    features = getattr(model_arima, 'features', None)
+    if features is not None:
+        return features
+    exog_names = getattr(model_arima.model, 'exog_names', None)
+    if exog_names:
+        return [name for name in exog_names if name != 'const']
+    return df.drop(TARGET_COLUMNS, axis = 1).columns.tolist()
+
+
+def forecast_path(model_arima, df, horizon):
+    '''
+    -> args: model_arima (fitted ARIMA results or ArimaState), df (cleaned dataframe), horizon (business days)
+    -> return: structured array with FORECAST_TABLE_DTYPE starting at forecast_origin(df), the first rows
+       of a longer horizon are the same as a shorter one
+    '''
+    origin = forecast_origin(df)
+    dates = np.busday_offset(origin, np.arange(horizon), roll = 'forward')
+    all_dates = pd.DatetimeIndex(dates)
+
+    #Prepare exog dataframe based on date range, with the columns the model was fitted on
+    with span('forecast_exog'):
+        features = model_features(model_arima, df)
+        # Not tail(horizon): the exog of a date would then change with the requested horizon
+        exog_past = df[features].tail(FORECAST_EXOG_WINDOW)
+        exog_future = exog_past.iloc[np.arange(horizon) % len(exog_past)].copy()
+        exog_future.index = all_dates
+        exog_future['year'] = all_dates.year
+        exog_future['month'] = all_dates.month
+        exog_future['day'] = all_dates.day
+
+    with span('forecast_model'):
+        y_pred = np.asarray(model_arima.forecast(steps = horizon, exog = exog_future))
+
+    path = np.empty(horizon, dtype = FORECAST_TABLE_DTYPE)
+    path['date'] = dates
+    path['close_pred'] = y_pred
+    path['close_pred_original_scale'] = np.exp(np.cumsum(y_pred) + df['close_log'].iloc[-1])
+    return path
+
+
+def simulate_paths(model_arima, y_pred, last_close_log, n_paths = 10000, seed = None):
+    '''
+    Monte Carlo close prices around a point forecast, drawn from the fitted innovation variance.
+    -> args: model_arima (ArimaState or fitted ARIMA results), y_pred (point forecast of close_log_diff, one per
+       business day, ex. forecast_path(...)['close_pred']), last_close_log (df['close_log'].iloc[-1]), n_paths, seed
+    -> return: (n_paths x horizon) array of simulated close prices
+    '''
+    if not isinstance(model_arima, ArimaState):
+        model_arima = ArimaState.from_results(model_arima)
+    # In place from log differences to prices, the array is the only (n_paths x horizon) allocation
+    paths = model_arima.simulate(len(y_pred), n_paths, seed)
+    paths += np.asarray(y_pred, dtype = 'float64')
+    np.cumsum(paths, axis = 1, out = paths)
+    paths += last_close_log
+    np.exp(paths, out = paths)
+    return paths
+
+
+def path_distribution(paths, quantiles = (), thresholds = ()):
+    '''
+    -> args: paths (n_paths x horizon simulated prices), quantiles (levels in [0, 1]), thresholds (prices)
+    -> return: dict of (levels x horizon) arrays: quantiles, exceed (P(close > threshold) on each day)
+       and hit (P(close > threshold) on any day up to each day)
+    '''
+    horizon = paths.shape[1]
+    distribution = {'quantiles': np.quantile(paths, quantiles, axis = 0).reshape(-1, horizon),
+                    'exceed': np.empty((len(thresholds), horizon)),
+                    'hit': np.empty((len(thresholds), horizon))}
+    if len(thresholds):
+        running_max = np.maximum.accumulate(paths, axis = 1)
+        for k, threshold in enumerate(thresholds):
+            distribution['exceed'][k] = (paths > threshold).mean(axis = 0)
+            distribution['hit'][k] = (running_max > threshold).mean(axis = 0)
+    return distribution
+
+
+def slice_bounds(origin, start_date, end_date):
+    # Row range [i, j) of the business days between start_date and end_date (inclusive)
+    start = np.datetime64(start_date, 'D')
+    end = np.datetime64(end_date, 'D') + np.timedelta64(1, 'D')
+    i = max(int(np.busday_count(origin, start)), 0)
+    j = max(int(np.busday_count(origin, end)), i)
+    return i, j
+
+
+def save_forecast_table(table, path):
+    # Write next to the final path and rename, readers never see a partial file
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.save(f, table, allow_pickle = False)
+    os.replace(tmp_path, path)
+    logging.info(f'Forecast table with {len(table)} business days saved to {path}')
+
+
+def load_forecast_table(path):
+    return np.load(path, mmap_mode = 'r', allow_pickle = False)
@@ -1,18 +1,183 @@
-import logging
-from datetime import datetime
-import os
-
-logs_path = os.path.join(os.path.dirname(__file__),"..","logs")
-os.makedirs(logs_path, exist_ok=True)
-
-log_file_name = f'{datetime.now().strftime("%Y-%m-%d")}.log'
-log_file_path = os.path.abspath(os.path.join(logs_path, log_file_name))
-
-logging.basicConfig(
-    filename = log_file_path,
-    level = logging.INFO,
-    format = '%(asctime)s - %(levelname)s - %(message)s')
-
-if __name__ == '__main__':
-    logging.info('Logging has started')
-    logging.info(f'Log File sucessfully created in {log_file_path}')
+import logging
+import logging.handlers
+from datetime import datetime
+import os
+import copy
+import json
+import queue
+import atexit
+import threading
+import multiprocessing.util
+
+# Logging of every process (pipeline, backend workers, Streamlit through frontend/utils/logger.py).
+# Modules keep calling logging.info(...) on the root logger, which only puts the record on a queue:
+# a QueueListener thread formats it and writes it to disk, so log I/O never runs on the request thread.
+#     LOG_FORMAT=json                         -> one JSON object per line instead of text
+#     LOG_LEVEL=INFO                          -> default level
+#     LOG_LEVELS=model_store=DEBUG,werkzeug=WARNING
+#                                             -> per module (file name) or named logger level
+#     LOG_ROTATION=daily|size                 -> one file per day (default) or LOG_MAX_BYTES per file
+#     LOG_BACKUP_COUNT=14                     -> rotated files kept
+
+logs_path = os.environ.get('LOG_PATH', os.path.join(os.path.dirname(__file__),"..","logs"))
+os.makedirs(logs_path, exist_ok=True)
+
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'text')
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_LEVELS = os.environ.get('LOG_LEVELS', '')
+LOG_ROTATION = os.environ.get('LOG_ROTATION', 'daily')
+LOG_MAX_BYTES = int(os.environ.get('LOG_MAX_BYTES', 50 * 1024 ** 2))
+LOG_BACKUP_COUNT = int(os.environ.get('LOG_BACKUP_COUNT', 14))
+TEXT_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+
+
+class DailyFileHandler(logging.FileHandler):
+    '''
+    logs/<YYYY-MM-DD>.log, a new file after midnight and only the last backup_count days kept.
+    Files are never renamed, so several processes (gunicorn workers, pipeline pool) can append to the same one.
+    '''
+    def __init__(self, folder, backup_count = LOG_BACKUP_COUNT):
+        self.folder = os.path.abspath(folder)
+        self.backup_count = backup_count
+        self.day = datetime.now().strftime('%Y-%m-%d')
+        super().__init__(os.path.join(self.folder, f'{self.day}.log'), delay = True)
+
+    def emit(self, record):
+        day = datetime.fromtimestamp(record.created).strftime('%Y-%m-%d')
+        if day != self.day:
+            self.day = day
+            self.close()
+            self.baseFilename = os.path.join(self.folder, f'{day}.log')
+            self.prune()
+        super().emit(record)
+
+    def prune(self):
+        if self.backup_count <= 0:
+            return
+        days = sorted(name for name in os.listdir(self.folder) if len(name) == 14 and name.endswith('.log'))
+        for name in days[:-self.backup_count - 1]:
+            try:
+                os.remove(os.path.join(self.folder, name))
+            except OSError:
+                pass
+
+
+class JsonFormatter(logging.Formatter):
+    # One object per line: time, level, logger, module, line, process, message (and exception)
+    def format(self, record):
+        entry = {'time': datetime.fromtimestamp(record.created).isoformat(timespec = 'milliseconds'),
+                 'level': record.levelname, 'logger': record.name, 'module': record.module,
+                 'line': record.lineno, 'process': record.process, 'message': record.getMessage()}
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default = str)
+
+
+class LevelFilter(logging.Filter):
+    # Level of the named logger or of the module (file name without .py) a record comes from, default otherwise
+    def __init__(self, default_level, levels):
+        super().__init__()
+        self.default_level = default_level
+        self.levels = levels
+
+    def filter(self, record):
+        level = self.levels.get(record.name, self.levels.get(record.module, self.default_level))
+        return record.levelno >= level
+
+
+class LogQueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        # Messages with arguments are rendered on the calling thread (the arguments may change after the call).
+        # Plain strings and exceptions (logging.error(CustomException(e,sys))) are rendered by the writer thread,
+        # like timestamps, tracebacks and the output format
+        record = copy.copy(record)
+        if record.args or not isinstance(record.msg, (str, BaseException)):
+            record.msg = record.getMessage()
+            record.args = None
+        return record
+
+
+def parse_levels(levels):
+    # 'model_store=DEBUG,werkzeug=WARNING' -> {'model_store': 10, 'werkzeug': 30}
+    parsed = {}
+    for item in levels.split(','):
+        if '=' in item:
+            name, level = item.split('=', 1)
+            parsed[name.strip()] = logging.getLevelName(level.strip().upper())
+    return {name: level for name, level in parsed.items() if isinstance(level, int)}
+
+def file_handler():
+    if LOG_ROTATION == 'size':
+        handler = logging.handlers.RotatingFileHandler(os.path.join(logs_path, 'app.log'), maxBytes = LOG_MAX_BYTES,
+                                                       backupCount = LOG_BACKUP_COUNT, delay = True)
+    else:
+        handler = DailyFileHandler(logs_path)
+    handler.setFormatter(JsonFormatter() if LOG_FORMAT == 'json' else logging.Formatter(TEXT_FORMAT))
+    return handler
+
+
+class _LogWriter:
+    # Queue, handler and listener thread of this process, recreated in a forked child (threads do not survive a fork)
+    def __init__(self):
+        default_level = logging.getLevelName(LOG_LEVEL)
+        default_level = default_level if isinstance(default_level, int) else logging.INFO
+        levels = parse_levels(LOG_LEVELS)
+        for name, level in levels.items():
+            logging.getLogger(name).setLevel(level)
+        self.handler = file_handler()
+        self.queue_handler = LogQueueHandler(queue.SimpleQueue())
+        self.queue_handler.addFilter(LevelFilter(default_level, levels))
+        self.listener = None
+        self._lock = threading.Lock()
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(self.queue_handler)
+        # Lowest configured level, the filter decides per module
+        root.setLevel(min([default_level, *levels.values()]))
+        self.start()
+        atexit.register(self.stop)
+        os.register_at_fork(after_in_child = self._after_fork)
+        # multiprocessing children drop the finalizers of their parent after the fork, register ours again there
+        self._register_finalizer()
+        multiprocessing.util.register_after_fork(self, _LogWriter._register_finalizer)
+
+    def _register_finalizer(self):
+        # Pool workers leave through os._exit, atexit does not run there. Runs after the tracking writer (priority 10)
+        multiprocessing.util.Finalize(self, self.stop, exitpriority = 0)
+
+    def start(self):
+        with self._lock:
+            self.listener = logging.handlers.QueueListener(self.queue_handler.queue, self.handler, respect_handler_level = True)
+            self.listener.start()
+
+    def stop(self):
+        # Write everything queued so far and stop the thread
+        with self._lock:
+            listener, self.listener = self.listener, None
+        if listener is not None:
+            listener.stop()
+        self.handler.flush()
+
+    def _after_fork(self):
+        # The parent's queue may hold records already written by the parent and its lock may be held
+        self._lock = threading.Lock()
+        self.queue_handler.queue = queue.SimpleQueue()
+        self.listener = None
+        self.start()
+
+
+_writer = _LogWriter()
+log_file_path = _writer.handler.baseFilename
+
+def flush():
+    # Block until every record logged so far is written (ex. before reading the log file)
+    _writer.stop()
+    _writer.start()
+
+
+if __name__ == '__main__':
+    logging.info('Logging has started')
+    logging.info(f'Log File sucessfully created in {log_file_path}')
+    flush()
@@ -0,0 +1,175 @@
+import os
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+
+# In-process metrics rendered in the Prometheus text format (version 0.0.4).
+# Every process (each gunicorn worker, each pipeline run) keeps its own registry.
+#     with span('forecast_model'):               -> span_duration_seconds{span="forecast_model"} histogram
+#         ...                                       span_errors_total{span="forecast_model"} on exception
+#     REGISTRY.render()                          -> text served at /metrics
+
+# Seconds, from sub-millisecond forecasts slices to multi-minute training runs
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class Histogram:
+    '''
+    Fixed bucket histogram, observe() is O(log buckets) under a lock.
+    Quantiles are interpolated inside the bucket holding the rank, like PromQL histogram_quantile.
+    '''
+    def __init__(self, buckets = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def snapshot(self):
+        with self._lock:
+            return list(self.counts), self.sum, self.count
+
+    def quantile(self, q, counts = None, count = None):
+        if counts is None:
+            counts, _, count = self.snapshot()
+        if not count:
+            return float('nan')
+        rank = q * count
+        cumulative = 0
+        for index, bucket_count in enumerate(counts):
+            if cumulative + bucket_count >= rank and bucket_count:
+                if index == len(self.buckets):
+                    # Above the last bound, nothing better than the bound itself
+                    return self.buckets[-1]
+                lower = self.buckets[index - 1] if index else 0.0
+                upper = self.buckets[index]
+                return lower + (upper - lower) * (rank - cumulative) / bucket_count
+            cumulative += bucket_count
+        return self.buckets[-1]
+
+
+class Counter:
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount = 1.0):
+        with self._lock:
+            self.value += amount
+
+
+def _labels(items):
+    if not items:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in items)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(items, escaped)) + '}'
+
+
+class MetricsRegistry:
+    '''
+    -> histogram(name, help, **labels) / counter(name, help, **labels): child metric, created on first use
+    -> callback(name, type, help, function): function() returns {labels tuple: value}, called at render time
+    '''
+    def __init__(self):
+        self._families = {}
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def _child(self, name, kind, help_text, factory, labels):
+        key = tuple(sorted(labels.items()))
+        family = self._families.get(name)
+        if family is None or key not in family['children']:
+            with self._lock:
+                family = self._families.setdefault(name, {'type': kind, 'help': help_text, 'children': {}})
+                family['children'].setdefault(key, factory())
+        return family['children'][key]
+
+    def histogram(self, name, help_text, **labels):
+        return self._child(name, 'histogram', help_text, Histogram, labels)
+
+    def counter(self, name, help_text, **labels):
+        return self._child(name, 'counter', help_text, Counter, labels)
+
+    def callback(self, name, kind, help_text, function):
+        self._callbacks.append((name, kind, help_text, function))
+
+    def render(self):
+        lines = []
+        with self._lock:
+            families = [(name, family['type'], family['help'], list(family['children'].items()))
+                        for name, family in sorted(self._families.items())]
+        for name, kind, help_text, children in families:
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+            quantile_lines = []
+            for labels, metric in children:
+                if kind == 'counter':
+                    lines.append(f'{name}{_labels(labels)} {metric.value}')
+                    continue
+                counts, total, count = metric.snapshot()
+                cumulative = 0
+                for bound, bucket_count in zip(metric.buckets + (float('inf'),), counts):
+                    cumulative += bucket_count
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append(f'{name}_bucket{_labels(labels + (("le", le),))} {cumulative}')
+                lines.append(f'{name}_sum{_labels(labels)} {total}')
+                lines.append(f'{name}_count{_labels(labels)} {count}')
+                for q in QUANTILES:
+                    quantile_lines.append(f'{name}_quantile{_labels(labels + (("quantile", str(q)),))} {metric.quantile(q, counts, count)}')
+            if quantile_lines:
+                # Estimates for quick looks without PromQL (p50/p95/p99 since the process started)
+                lines += [f'# HELP {name}_quantile Estimated quantiles of {name}', f'# TYPE {name}_quantile gauge'] + quantile_lines
+        for name, kind, help_text, function in self._callbacks:
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+            for labels, value in function().items():
+                lines.append(f'{name}{_labels(tuple(labels))} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def write_textfile(self, path):
+        # For batch jobs: a file picked up by the node exporter textfile collector
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(self.render())
+        os.replace(tmp_path, path)
+
+
+REGISTRY = MetricsRegistry()
+
+
+class Span:
+    def __init__(self, name):
+        self.name = name
+        self.seconds = None
+
+
+def observe_span(name, seconds, error = False, registry = REGISTRY):
+    registry.histogram('span_duration_seconds', 'Duration of instrumented code spans', span = name).observe(seconds)
+    if error:
+        registry.counter('span_errors_total', 'Instrumented code spans that raised', span = name).inc()
+
+@contextmanager
+def span(name, registry = REGISTRY):
+    '''
+    -> args: name (label of the span), registry
+    -> yield: Span, its seconds attribute is set when the block exits
+    '''
+    timing = Span(name)
+    started = time.perf_counter()
+    error = False
+    try:
+        yield timing
+    except BaseException:
+        error = True
+        raise
+    finally:
+        timing.seconds = time.perf_counter() - started
+        observe_span(name, timing.seconds, error, registry)
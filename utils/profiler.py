@@ -0,0 +1,89 @@
+import sys
+import os
+import time
+import threading
+from collections import Counter
+
+# Opt-in sampling profiler for production: for a bounded duration, the requesting thread snapshots the
+# stack of every other thread at a fixed interval and counts identical stacks. The output is the folded
+# format read by flamegraph.pl, speedscope and inferno:
+#     MainThread;app.py:wsgi_app;backend.py:prediction;forecast.py:forecast_path 42
+
+
+class SamplingProfiler:
+    '''
+    -> interval: seconds between two samples (cost is one sys._current_frames() walk per sample)
+    -> max_depth: frames kept per stack, counted from the innermost one. Deeper stacks lose their outermost
+       frames and are folded under a [truncated] frame below the thread name, never mixed with complete stacks
+    -> max_stacks: distinct stacks kept per run, samples of new stacks past it are counted under <thread>;[other]
+    A run samples from the thread calling profile() for a bounded duration and returns its stacks, so the
+    output always belongs to the process that ran it (one gunicorn worker, whichever got the request).
+    '''
+    def __init__(self, interval = 0.005, max_depth = 64, max_stacks = 10000):
+        self.interval = interval
+        self.max_depth = max_depth
+        self.max_stacks = max_stacks
+        self._stacks = Counter()
+        self._samples = 0
+        self._running = False
+        self._lock = threading.Lock()
+        self.started_at = None
+
+    @property
+    def running(self):
+        return self._running
+
+    def profile(self, duration, interval = None):
+        '''
+        -> args: duration (seconds sampled, blocks the calling thread), interval (seconds between samples)
+        -> return: folded stacks of every other thread of this process, None when a run is already in progress
+        '''
+        with self._lock:
+            if self._running:
+                return None
+            self._running = True
+            self.interval = interval or self.interval
+            self._stacks = Counter()
+            self._samples = 0
+            self.started_at = time.time()
+        try:
+            deadline = time.monotonic() + duration
+            while time.monotonic() < deadline:
+                self._sample(threading.get_ident())
+                time.sleep(self.interval)
+        finally:
+            with self._lock:
+                self._running = False
+        return self.folded()
+
+    def folded(self):
+        with self._lock:
+            stacks = self._stacks.most_common()
+        return ''.join(f'{stack} {count}\n' for stack, count in stacks)
+
+    def stats(self):
+        return {'running': self.running, 'interval': self.interval, 'samples': self._samples,
+                'stacks': len(self._stacks), 'started_at': self.started_at}
+
+    def _sample(self, own_id):
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        sampled = []
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_id:
+                continue
+            frames = []
+            while frame is not None and len(frames) < self.max_depth:
+                code = frame.f_code
+                frames.append(f'{os.path.basename(code.co_filename)}:{code.co_name}')
+                frame = frame.f_back
+            if frame is not None:
+                # The outer frames were cut off, the stack no longer starts at the thread's entry point
+                frames.append('[truncated]')
+            sampled.append(';'.join([names.get(thread_id, str(thread_id))] + frames[::-1]))
+        with self._lock:
+            for stack in sampled:
+                if stack not in self._stacks and len(self._stacks) >= self.max_stacks:
+                    # Bounded memory on long runs with many distinct stacks
+                    stack = f'{stack.split(";", 1)[0]};[other]'
+                self._stacks[stack] += 1
+            self._samples += 1
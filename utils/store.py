@@ -0,0 +1,176 @@
+import os
+import json
+import shutil
+import hashlib
+
+import numpy as np
+import pandas as pd
+
+# Columnar dataframe store: one raw little-endian binary file per column plus schema.json.
+#     <store>/schema.json   -> nrows, index and column dtypes, named row ranges (splits), exog columns
+#     <store>/<column>.bin  -> nrows values of that column, memory-mapped on load
+# Column files are written first and schema.json is replaced last, so readers only ever see
+# complete rows: bytes appended after the nrows recorded in the schema are ignored.
+
+SCHEMA_FILE = 'schema.json'
+
+
+def schema_path(path):
+    return os.path.join(path, SCHEMA_FILE)
+
+def read_schema(path):
+    with open(schema_path(path)) as f:
+        return json.load(f)
+
+def _write_schema(path, schema):
+    tmp_path = schema_path(path) + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(schema, f, indent = 1)
+    os.replace(tmp_path, schema_path(path))
+
+def _column_arrays(df):
+    # Index first, stored like any other column
+    index_name = df.index.name or 'index'
+    arrays = {index_name: np.asarray(df.index.values)}
+    for column in df.columns:
+        arrays[column] = np.asarray(df[column].values)
+    return index_name, {name: array.astype(array.dtype.newbyteorder('<')) for name, array in arrays.items()}
+
+def _column_file(path, column):
+    return os.path.join(path, f'{column}.bin')
+
+def write_store(df, path, splits = None, exog = None):
+    '''
+    -> args: df (dataframe with a named index), path (store directory),
+       splits ({'train': [start, stop], ...} row ranges), exog (exogenous column names)
+    -> return: schema
+    '''
+    os.makedirs(path, exist_ok = True)
+    index_name, arrays = _column_arrays(df)
+    checksum = hashlib.sha256()
+    for column, array in arrays.items():
+        tmp_path = _column_file(path, column) + '.tmp'
+        data = np.ascontiguousarray(array).tobytes()
+        checksum.update(data)
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, _column_file(path, column))
+    schema = {
+        'nrows': len(df),
+        'index': index_name,
+        'columns': {column: array.dtype.str for column, array in arrays.items()},
+        'splits': splits or {},
+        'exog': list(exog or []),
+        'checksum': checksum.hexdigest()}
+    _write_schema(path, schema)
+    return schema
+
+def append_store(df_new, path, splits = None, after_last = False):
+    '''
+    -> args: df_new (rows to append, same columns as the store), path, splits (new row ranges, optional),
+       after_last (ValueError unless the new index starts after the last stored index value, ex. dates)
+    -> return: schema
+    '''
+    schema = read_schema(path)
+    index_name, arrays = _column_arrays(df_new)
+    if list(arrays) != list(schema['columns']):
+        raise ValueError(f'Columns {list(arrays)} do not match the store columns {list(schema["columns"])}')
+    if after_last and schema['nrows'] and len(df_new):
+        # Read from disk, not from the caller's copy: another writer may have appended since it was loaded
+        dtype = np.dtype(schema['columns'][index_name])
+        last = np.fromfile(_column_file(path, index_name), dtype = dtype, count = 1,
+                           offset = (schema['nrows'] - 1) * dtype.itemsize)[0]
+        if not arrays[index_name][0] > last:
+            raise ValueError(f'Rows starting at {arrays[index_name][0]} do not come after the last stored row {last}')
+    # Chain the checksum so it still identifies the full content
+    checksum = hashlib.sha256(schema['checksum'].encode())
+    for column, array in arrays.items():
+        array = array.astype(schema['columns'][column])
+        data = np.ascontiguousarray(array).tobytes()
+        checksum.update(data)
+        with open(_column_file(path, column), 'r+b') as f:
+            # Drop leftovers of an interrupted append before writing
+            f.truncate(schema['nrows'] * array.dtype.itemsize)
+            f.seek(0, os.SEEK_END)
+            f.write(data)
+    schema['nrows'] += len(df_new)
+    if splits is not None:
+        schema['splits'] = splits
+    schema['checksum'] = checksum.hexdigest()
+    _write_schema(path, schema)
+    return schema
+
+def copy_store(path, target_path):
+    '''
+    Independent copy of a store (ex. the dataframe served next to a model): appends to the copy never reach
+    the original and rewriting the original never reaches the copy.
+    -> return: schema of the copy, written after its columns like any other store
+    '''
+    schema = read_schema(path)
+    os.makedirs(target_path, exist_ok = True)
+    for column in schema['columns']:
+        tmp_path = _column_file(target_path, column) + '.tmp'
+        shutil.copyfile(_column_file(path, column), tmp_path)
+        os.replace(tmp_path, _column_file(target_path, column))
+    _write_schema(target_path, schema)
+    return schema
+
+def load_columns(path, schema = None):
+    # Read-only memory maps of every column, no parsing
+    schema = schema or read_schema(path)
+    nrows = schema['nrows']
+    columns = {}
+    for column, dtype in schema['columns'].items():
+        if nrows == 0:
+            columns[column] = np.empty(0, dtype = dtype)
+        else:
+            columns[column] = np.memmap(_column_file(path, column), dtype = dtype, mode = 'r', shape = (nrows,))
+    return columns
+
+def load_store(path, split = None, columns = None):
+    '''
+    -> args: path, split (name of a row range in the schema, None for all rows), columns (subset)
+    -> return: dataframe indexed like the stored one
+    '''
+    schema = read_schema(path)
+    arrays = load_columns(path, schema)
+    start, stop = schema['splits'][split] if split else (0, schema['nrows'])
+    index_name = schema['index']
+    columns = columns or [column for column in schema['columns'] if column != index_name]
+    index = pd.Index(np.asarray(arrays[index_name][start:stop]), name = index_name)
+    return pd.DataFrame({column: np.asarray(arrays[column][start:stop]) for column in columns}, index = index)
+
+def load_splits(path):
+    '''
+    -> return: df, df_train, df_test, exog_train, exog_test from one load, the splits are row slices
+    '''
+    schema = read_schema(path)
+    df = load_store(path)
+    df_train = df.iloc[slice(*schema['splits']['train'])]
+    df_test = df.iloc[slice(*schema['splits']['test'])]
+    return df, df_train, df_test, df_train[schema['exog']], df_test[schema['exog']]
+
+def finalize_store(path, splits = None, exog = None, block_size = 1 << 24):
+    '''
+    -> args: path, splits and exog (replace the schema ones when given), block_size (bytes hashed at a time)
+    -> return: schema, with the checksum write_store gives for the same rows (not the chained append one)
+    '''
+    schema = read_schema(path)
+    checksum = hashlib.sha256()
+    for column, dtype in schema['columns'].items():
+        # Plain reads rather than memory maps, the pages do not stay in this process' memory
+        remaining = schema['nrows'] * np.dtype(dtype).itemsize
+        with open(_column_file(path, column), 'rb') as f:
+            while remaining > 0:
+                block = f.read(min(block_size, remaining))
+                if not block:
+                    raise ValueError(f'{_column_file(path, column)} is shorter than the {schema["nrows"]} rows of the schema')
+                checksum.update(block)
+                remaining -= len(block)
+    if splits is not None:
+        schema['splits'] = splits
+    if exog is not None:
+        schema['exog'] = list(exog)
+    schema['checksum'] = checksum.hexdigest()
+    _write_schema(path, schema)
+    return schema